@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QFormLayout, QHBoxLayout, QLabel, \
+    QLineEdit, QPushButton, QComboBox, QCheckBox, QProgressDialog, QMessageBox
+
+from collections import defaultdict
+import os
+
+from maths import batch
+from maths.recipes import Recipe
+from logging_config import get_logger
+from workers import run_in_background
+
+logger = get_logger(__name__)
+
+
+class BatchMathDialog(QDialog):
+    """
+        Apply one math operation to every variable matching a pattern, in one or all open files.
+        The results are computed in a process pool and added as derived variables.
+    """
+
+    POLL_INTERVAL_MS = 100
+
+    def __init__(self, math_funcs, maths_widget, data_file_widget, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Batch maths")
+
+        self._maths_widget = maths_widget
+        self._data_file_widget = data_file_widget
+        self._params_ready = False
+        self._run = None
+        self._progress = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.POLL_INTERVAL_MS)
+        self._timer.timeout.connect(self._poll)
+
+        form = QFormLayout(self)
+
+        self.op_combo = QComboBox()
+        for name, spec in math_funcs:
+            self.op_combo.addItem(name, spec)
+        self.op_combo.currentIndexChanged.connect(self._on_operation_changed)
+        params_button = QPushButton("parameters...")
+        params_button.clicked.connect(self._edit_params)
+        op_layout = QHBoxLayout()
+        op_layout.addWidget(self.op_combo, 1)
+        op_layout.addWidget(params_button)
+        form.addRow("Operation", op_layout)
+        self.params_label = QLabel()
+        form.addRow("", self.params_label)
+
+        self.pattern_edit = QLineEdit("*")
+        self.pattern_edit.textChanged.connect(self._update_matches)
+        self.regex_check = QCheckBox("regex")
+        self.regex_check.toggled.connect(self._update_matches)
+        pattern_layout = QHBoxLayout()
+        pattern_layout.addWidget(self.pattern_edit, 1)
+        pattern_layout.addWidget(self.regex_check)
+        form.addRow("Variables", pattern_layout)
+
+        self.scope_combo = QComboBox()
+        self.scope_combo.addItems(("active file", "all open files"))
+        self.scope_combo.currentIndexChanged.connect(self._update_matches)
+        form.addRow("Files", self.scope_combo)
+
+        self.template_edit = QLineEdit()
+        self.template_edit.setPlaceholderText("default name")
+        self.template_edit.setToolTip("Output name, e.g. '{var}_lp'. Fields: {var}, {op}, {file}")
+        form.addRow("Output name", self.template_edit)
+
+        self.match_label = QLabel()
+        form.addRow("", self.match_label)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close)
+        self.run_button = button_box.addButton("Run", QDialogButtonBox.AcceptRole)
+        button_box.accepted.connect(self.run)
+        button_box.rejected.connect(self.reject)
+        form.addRow(button_box)
+
+        self._on_operation_changed()
+
+    def reject(self):
+        # The results are added when the run finishes, so stay open until then.
+        if self._run is not None:
+            return
+        super().reject()
+
+    def _spec(self):
+        return self.op_combo.currentData()
+
+    def _on_operation_changed(self):
+        self._params_ready = False
+        self.params_label.setText("<i>parameters not set</i>")
+        self._update_matches()
+
+    def _edit_params(self):
+        spec = self._spec()
+        if spec.get_params():
+            self._params_ready = True
+            params = spec.recipe_params()
+            self.params_label.setText(", ".join(f"{k}={v}" for k, v in params.items()) or "no parameters")
+        self._update_matches()
+
+    def _sources(self):
+        if self._data_file_widget is None:
+            return []
+        if self.scope_combo.currentIndex() == 0:
+            source = self._data_file_widget.get_active_data_file()
+            return [] if source is None else [source]
+        return [self._data_file_widget.get_data_file(i) for i in range(self._data_file_widget.open_count)]
+
+    def _matches(self):
+        """ (source, var_name) of every matching variable. """
+        pattern = self.pattern_edit.text().strip()
+        if not pattern:
+            return []
+        matches = []
+        for source in self._sources():
+            names = batch.match_variables(source.model().get_variable_names(), pattern,
+                                          self.regex_check.isChecked())
+            matches.extend((source, name) for name in names)
+        return matches
+
+    def _update_matches(self):
+        try:
+            matches = self._matches()
+        except ValueError as ex:
+            self.match_label.setText(str(ex))
+            self.run_button.setEnabled(False)
+            return
+        n_files = len(set(id(source) for source, _ in matches))
+        self.match_label.setText(f"{len(matches)} variables in {n_files} files")
+        self.run_button.setEnabled(bool(matches) and self._params_ready and self._run is None)
+
+    def _build_items(self):
+        spec = self._spec()
+        params = spec.recipe_params()
+        template = self.template_edit.text().strip()
+        items = []
+        taken = defaultdict(set)
+        for source, var_name in self._matches():
+            if template:
+                file_name = os.path.splitext(os.path.basename(source.filename))[0]
+                out_name = batch.format_output_name(template, var_name, spec.operation, file_name)
+            else:
+                out_name = spec.default_var_name(var_name)
+            model = source.model()
+            if model.has_variable(out_name) or out_name in taken[id(model)]:
+                logger.warning(f"Variable name '{out_name}' already exists. Skipping '{var_name}'.")
+                continue
+            taken[id(model)].add(out_name)
+            recipe = Recipe(spec.operation, params, ((None, var_name),))
+            items.append(batch.BatchItem(model, var_name, out_name, recipe, source))
+        return items
+
+    def run(self):
+        try:
+            items = self._build_items()
+        except ValueError as ex:
+            QMessageBox.warning(self, "Batch maths", str(ex))
+            return
+        if not items:
+            QMessageBox.information(self, "Batch maths", "There is nothing to compute.")
+            return
+
+        logger.info(f"Computing {len(items)} variables with {self._spec().name}")
+        self._run = batch.BatchRun(items)
+        # Reading the inputs may evaluate derived variables.
+        run_in_background(self._run.submit, on_error=self._submit_failed)
+        self.run_button.setEnabled(False)
+        self._progress = QProgressDialog(f"Computing {len(items)} variables...", "Cancel", 0, len(items), self)
+        self._progress.setWindowModality(Qt.WindowModal)
+        self._progress.setMinimumDuration(0)
+        self._timer.start()
+
+    def _submit_failed(self, ex):
+        self._timer.stop()
+        self._progress.reset()
+        QMessageBox.warning(self, "Batch maths", f"Unable to start the batch: {ex}")
+        self._run = None
+        self._update_matches()
+
+    def _poll(self):
+        self._progress.setValue(self._run.done_count)
+        if self._progress.wasCanceled():
+            self._run.cancel()
+        if not self._run.done():
+            return
+        self._timer.stop()
+        self._progress.reset()
+
+        # Add the results of each file with a single refresh of its model.
+        sources = dict()
+        by_source = defaultdict(list)
+        for item, value in self._run.results():
+            sources[id(item.source)] = item.source
+            by_source[id(item.source)].append((item.output_name, item.recipe, value))
+        for key, recipes in by_source.items():
+            self._maths_widget.add_new_vars(recipes, sources[key])
+        logger.info(f"Added {sum(len(r) for r in by_source.values())} of {len(self._run)} variables")
+
+        self._run = None
+        self._update_matches()
@@ -16,6 +16,7 @@ import pyqtgraph as pg
 import numpy as np
 
 import graph_utils
+import timebase
 
 logger = get_logger(__name__)
 
@@ -131,6 +132,10 @@ class CustomPlotItem(QLabel):
     def name(self):
         return self.trace.name()
 
+    @property
+    def is_hidden(self):
+        return self._hidden
+
     def get_plot_spec(self):
         # For now, we'll just get the name of the trace, but this will become more complex in the
         # future when we start supporting derived signals.
@@ -141,15 +146,35 @@ class CustomPlotItem(QLabel):
         # We use "time_to_tick" here instead of "time_to_nearest_tick" because if a signal is sampled
         # at a lower frequency than the master signal, we want the sample-and-hold version of the
         # value, not the closest value.
-        self._tick = graph_utils.time_to_tick(self.trace.xData, time)
+        if hasattr(self.trace, 'timebase'):
+            self._tick = self.trace.timebase.tick_at(time)
+        else:
+            self._tick = graph_utils.time_to_tick(self.trace.xData, time)
         # print(f"on_time_changed called for {self.trace.name()} with time={time}, " + \
         #      f"corresponding tick={self._tick}")
         self.setText(self._generate_label())
 
     @pyqtSlot()
     def on_source_time_changed(self):
-        new_time = self.source.time
-        self.trace.setData(x=new_time, y=self.trace.yData)
+        if hasattr(self.trace, 'set_timebase'):
+            self.trace.set_timebase(timebase.for_source(self.source))
+        else:
+            self.trace.setData(x=self.source.time, y=self.trace.yData)
+
+    @pyqtSlot(str)
+    def on_derived_invalidated(self, name):
+        # A derived variable changes when one of its inputs does (e.g. the time offset of a file
+        # it is resampled from).
+        if name != self.var_name:
+            return
+        y = self.source.model().get_data_by_name(name)
+        if y is None:
+            return
+        if hasattr(self.trace, 'set_timebase'):
+            self.trace.set_timebase(self.trace.timebase, np.asarray(y))
+        else:
+            self.trace.setData(x=self.trace.xData, y=y)
+        self.setText(self._generate_label())
 
     def enterEvent(self, event):
         super().enterEvent(event)
@@ -242,8 +267,15 @@ class CustomPlotItem(QLabel):
         tick = min(tick, len(y) - 1)
         return y[tick]
 
-    def _generate_label(self):
+    @property
+    def display_name(self):
         prefix = ""
         if self.source.idx is not None:
             prefix = f"F{self.source.idx}:"
-        return f"{prefix}{self.trace.name()}: " + self._fmt_str.format(self._get_value(self._tick))
+        return f"{prefix}{self.trace.name()}"
+
+    def format_value(self, tick):
+        return self._fmt_str.format(self._get_value(tick))
+
+    def _generate_label(self):
+        return f"{self.display_name}: " + self.format_value(self._tick)
@@ -161,6 +161,11 @@ class DataFileWidget(QWidget):
             return None
         return self.get_data_file(idx).time
 
+    def get_timebase(self, idx=0):
+        if self.tabs.count() == 0:
+            return None
+        return self.get_data_file(idx).timebase
+
     @pyqtSlot(QPoint)
     def on_context_menu_request(self, pos):
         # We only want to bring up the context menu when an actual tab is right-clicked. Check that
@@ -1,21 +1,76 @@
 import os
 
+import numpy as np
 from PyQt5.QtWidgets import QFileDialog
 
-from geometry_helpers import (axis_angle_from_quat, create_arrow,
-                              create_sphere, create_triad)
+from geometry_helpers import (axis_angle_from_quat, axis_angles_from_quats,
+                              create_arrow, create_sphere, create_triad)
+from kinematics import POSE_FIELDS, pose_variable_name
+from logging_config import get_logger
+from maths.recipes import Recipe
 from robot_geometry import RobotModel
+from workers import run_in_background
+
+logger = get_logger(__name__)
+
+
+def read_pose_table(model, names, first=0):
+    '''
+    The variables `names` of `model` from tick `first` on, as the columns of one contiguous
+    (n_ticks x len(names)) array. Variables the model doesn't have are 0.
+    '''
+    table = np.zeros((model.tick_max + 1 - first, len(names)))
+    for i, name in enumerate(names):
+        data = model.get_data_by_name(name)
+        if data is not None:
+            table[:, i] = np.asarray(data, dtype=np.float64)[first:]
+    return table
+
+
+def rotations_to_axis_angles(table, first):
+    '''
+    Replace the quaternions in columns first:first + 4 of `table` with (angle, axis) (see
+    `axis_angles_from_quats`).
+    '''
+    axes, angles = axis_angles_from_quats(table[:, first:first + 4])
+    table[:, first] = angles
+    table[:, first + 1:first + 4] = axes
 
 
 class DataLinkedGeometry:
     def __init__(self, data_source):
         self._data_source = data_source
+        # The values shown at each tick, one row per tick (see `_build_pose_table`). Built on first
+        # use, and again when the data changes.
+        self._pose_table = None
+        # The variables read into the pose table.
+        self._pose_names = set()
+        model = data_source.model()
+        model.dataAppended.connect(self._extend_pose_table)
+        model.derivedInvalidated.connect(self._invalidate_pose_table)
+
+    def _build_pose_table(self, model, first=0):
+        ''' The rows of the pose table from tick `first` on. '''
+        raise NotImplementedError
+
+    def _read_pose_table(self, model, names, first):
+        ''' `read_pose_table`, noting the variables the table depends on. '''
+        self._pose_names.update(names)
+        return read_pose_table(model, names, first)
+
+    def _invalidate_pose_table(self, name):
+        if name in self._pose_names:
+            self._pose_table = None
 
-    def _get_value_at_tick(self, tick, varname): 
-        data = self._data_source.model().get_data_by_name(varname)
-        if data is None:
-            return 0
-        return data[tick]
+    def _extend_pose_table(self, n_old):
+        if self._pose_table is not None and self.has_source():
+            new_rows = self._build_pose_table(self._data_source.model(), n_old)
+            self._pose_table = np.concatenate((self._pose_table[:n_old], new_rows))
+
+    def _pose_at_tick(self, tick):
+        if self._pose_table is None:
+            self._pose_table = self._build_pose_table(self._data_source.model())
+        return self._pose_table[tick].tolist()
 
     def registerGeometry(self, register_fn, remove_fn):
         register_fn(self._geom)
@@ -43,25 +98,64 @@ class DataLinkedRobotModel(DataLinkedGeometry):
         
         self.has_floating_base =  data_source.model().has_key(self.base_pos_names[0])
 
+    def _build_pose_table(self, model, first=0):
+        # (angle, axis, position) of the base, then the joint positions in the order of `self._geom.joints`.
+        joint_names = [self._joint_pattern.format(joint) for joint in self._geom.joints]
+        table = self._read_pose_table(model, self.base_quat_names + self.base_pos_names + joint_names, first)
+        rotations_to_axis_angles(table, 0)
+        return table
+
+    def has_link(self, link):
+        ''' Whether `link` (a `RobotLink`) is part of this robot. '''
+        return self._geom.links.get(link.name) is link
+
+    def add_link_pose_variables(self, links):
+        '''
+        Add the world poses of `links` (names) to the source, as derived variables named by
+        `kinematics.pose_variable_name` with "fk" recipes. The poses are computed in the
+        background; variables added before are replaced.
+        '''
+        model = self._data_source.model()
+        base = self.base_quat_names + self.base_pos_names if self.has_floating_base else []
+        recipes = []
+        for link in links:
+            # Joints without a variable stay at 0.
+            joints = [joint.name for joint in self._geom.kinematics.chain(link) if joint.joint_type != 'fixed'
+                      and model.has_variable(self._joint_pattern.format(joint.name))]
+            inputs = tuple((None, name) for name in base + [self._joint_pattern.format(joint) for joint in joints])
+            for field in POSE_FIELDS:
+                params = {'urdf': self._geom.urdf_file, 'link': link, 'field': field,
+                          'joint_pattern': self._joint_pattern, 'joints': joints,
+                          'floating_base': self.has_floating_base}
+                recipes.append((pose_variable_name(link, field), Recipe("fk", params, inputs), None))
+
+        for name, _, _ in recipes:
+            if model.is_derived(name):
+                model.remove_derived_variable(name)
+        try:
+            model.add_derived_recipes(recipes)
+        except ValueError as ex:
+            logger.warning(str(ex))
+            return
+        run_in_background(model.materialize_derived, [name for name, _, _ in recipes])
+
     def update(self, tick):
         if self.has_source():
             # TODO: check that the box is checked, don't update if it's not
             self._geom.show()
+            pose = self._pose_at_tick(tick)
             # Base link
             self._geom.resetTransform()
 
             # Rotate
             if self.has_floating_base:
-                quat = [self._get_value_at_tick(tick, name) for name in self.base_quat_names]
-                axis, angle = axis_angle_from_quat(quat)
-                self._geom.rotate(angle, *axis)
+                self._geom.rotate(*pose[:4])
 
                 # Translate
-                self._geom.translate(*[self._get_value_at_tick(tick, name) for name in self.base_pos_names])
+                self._geom.translate(*pose[4:7])
 
             # Joints
-            for joint in self._geom.joints:
-                self._geom.setJointQ(joint, self._get_value_at_tick(tick, self._joint_pattern.format(joint)))
+            self._geom.setJointQs(pose[7:])
         else:
             self._geom.hide()
 
@@ -71,11 +165,14 @@ class DataLinkedSphere(DataLinkedGeometry):
         self._geom = create_sphere(radius, color)
         self._pos_names = [pos_pattern.format(name) for name in pos_names]
 
+    def _build_pose_table(self, model, first=0):
+        return self._read_pose_table(model, self._pos_names, first)
+
     def update(self, tick):
         if self.has_source():
             # TODO: check that the box is checked
             self._geom.show()
-            pos = [self._get_value_at_tick(tick, name) for name in self._pos_names]
+            pos = self._pose_at_tick(tick)
             self._geom.resetTransform()
             self._geom.translate(*pos)
         else:
@@ -105,20 +202,23 @@ class DataLinkedFrame(DataLinkedGeometry):
         self._pos_names = [pos_pattern.format(name) for name in pos_names]
         self._quat_names = [quat_pattern.format(name) for name in quat_names]
 
+    def _build_pose_table(self, model, first=0):
+        # (angle, axis, position)
+        table = self._read_pose_table(model, self._quat_names + self._pos_names, first)
+        rotations_to_axis_angles(table, 0)
+        return table
+
     def update(self, tick):
         if self.has_source():
             # TODO: check that the box is checked
             self._geom.show()
+            pose = self._pose_at_tick(tick)
             self._geom.resetTransform()
 
             # Rotate
-            quat = [self._get_value_at_tick(tick, name) for name in self._quat_names]
-            axis, angle = axis_angle_from_quat(quat)
-            self._geom.rotate(angle, *axis)
+            self._geom.rotate(*pose[:4])
 
             # Translate
-            pos = [self._get_value_at_tick(tick, name) for name in self._pos_names]
-            self._geom.resetTransform()
-            self._geom.translate(*pos)
+            self._geom.translate(*pose[4:7])
         else:
             self._geom.hide()
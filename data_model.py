@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from PyQt5.QtCore import QAbstractListModel, QModelIndex, QVariant, Qt
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QVariant, Qt, pyqtSignal
 
 import numpy as np
 from logging_config import get_logger
+from maths import derived_cache
+from maths.recipes import DerivedGraph
+from maths.streaming import AppendBuffer
+import timebase
 
 logger = get_logger(__name__)
 
@@ -34,6 +38,34 @@ class DataItem(object):
         return self._var_name
 
 
+def _make_data_item(var_name, data, time):
+    item = DataItem(var_name, data)
+    item._time = time
+    return item
+
+
+class DerivedItem(DataItem):
+    """
+        A derived variable whose data is computed from its recipe on first use
+    """
+
+    def __init__(self, var_name, graph):
+        super().__init__(var_name, None)
+        self._graph = graph
+
+    @property
+    def data(self):
+        return self._graph.value(self._var_name)
+
+    @property
+    def recipe(self):
+        return self._graph.recipe(self._var_name)
+
+    def __reduce__(self):
+        # Items are pickled for drag and drop. Send the data, not the graph.
+        return _make_data_item, (self._var_name, self.data, self._time)
+
+
 class SeparatorItem(DataItem):
     """
         Special DataItem that acts as a visual separator
@@ -48,41 +80,60 @@ class SeparatorItem(DataItem):
 
 
 class DataModel(QAbstractListModel):
+    # Emitted with the name of a derived variable whose value changed because one of its inputs did.
+    derivedInvalidated = pyqtSignal(str)
+    # Emitted with the previous number of samples after samples were appended (see `append_data`).
+    dataAppended = pyqtSignal(int)
+
     def __init__(self, data_loader, parent=None):
         QAbstractListModel.__init__(self, parent=parent)
 
         self._raw_data = data_loader.data_frame
+        # The raw columns (and plain derived variables) as `AppendBuffer`s once samples have been
+        # appended, so that appending doesn't copy the whole log (see `append_data`).
+        self._columns = None
+        self._plain_derived_buffers = {}
         self._data = []
         for var in sorted(self._raw_data.columns):
-            self._data.append(DataItem(var, self._raw_data[var].to_numpy()))
+            self._data.append(DataItem(var, self._raw_column(var)))
 
         # Add support for derived variables
         self._derived_data = {}  # Dictionary to store derived DataItems by name
         self._show_derived = False  # Flag to control visibility in VarListWidget
-
-        self._time = data_loader.time
-        self._avg_dt = np.mean(np.diff(self._time)).item()
+        # Recipes of the derived variables that are computed lazily.
+        self._derived_graph = DerivedGraph(self, on_invalidated=self.derivedInvalidated.emit)
+        # Identifies the loaded file in the on-disk cache of derived values (None if not a file).
+        self.source_fingerprint = derived_cache.file_fingerprint(data_loader.source)
+
+        # Fixed-rate logs are stored as (t0, dt, n) rather than as an explicit time array.
+        self._timebase = timebase.from_array(data_loader.time)
+        self._avg_dt = self._timebase.avg_dt
         try:
             freq = int(round(1 / self._avg_dt))
         except ZeroDivisionError:
             freq = 0
-        logger.info(f"Loaded {data_loader.source} which has a dt of {self._avg_dt:.6f} sec and a sampling rate of {freq} Hz")
+        logger.info(f"Loaded {data_loader.source} which has a dt of {self._avg_dt:.6f} sec and a sampling rate of {freq} Hz"
+                    + ("" if self._timebase.is_uniform else " (non-uniform sampling)"))
 
         self._time_offset = 0
+        self._shifted_timebase = self._timebase
+
+    @property
+    def timebase(self):
+        ''' The time axis of this source, including the time offset. '''
+        return self._shifted_timebase
 
     @property
     def time(self):
-        return self._time + self._time_offset
+        return self._shifted_timebase.array()
 
     @property
     def t_min(self):
-        # The `.item()` is necessary because we want a python type (float), not a numpy.dtype
-        return min(self.time).item()
+        return self._shifted_timebase.t_min
 
     @property
     def t_max(self):
-        # The `.item()` is necessary because we want a python type (float), not a numpy.dtype
-        return max(self.time).item()
+        return self._shifted_timebase.t_max
 
     @property
     def time_offset(self):
@@ -94,7 +145,7 @@ class DataModel(QAbstractListModel):
 
     @property
     def tick_max(self):
-        return self._time.shape[0] - 1
+        return len(self._timebase) - 1
 
     @property
     def avg_dt(self):
@@ -102,6 +153,54 @@ class DataModel(QAbstractListModel):
 
     def set_time_offset(self, time_offset):
         self._time_offset = time_offset
+        self._shifted_timebase = self._timebase.shifted(time_offset)
+        self._derived_graph.time_changed()
+
+    def append_data(self, data_frame, time):
+        '''
+        Append samples, e.g. from a live source. `data_frame` must have the same columns as the
+        loaded data. Derived variables are extended incrementally where possible.
+        '''
+        time = np.asarray(time, dtype=np.float64)
+        if len(time) != len(data_frame):
+            raise ValueError(f"Got {len(data_frame)} samples but {len(time)} timestamps")
+        missing = set(self._raw_data.columns) - set(data_frame.columns)
+        if missing:
+            raise ValueError(f"Appended data is missing the variables {sorted(missing)}")
+        if len(time) == 0:
+            return
+
+        n_old = len(self._timebase)
+        if self._columns is None:
+            self._columns = {var: AppendBuffer(self._raw_data[var].to_numpy()) for var in self._raw_data.columns}
+        for var, buffer in self._columns.items():
+            buffer.replace_tail(None, data_frame[var].to_numpy())
+        for item in self._data:
+            if type(item) is DataItem and item.var_name in self._columns:
+                item._data = self._columns[item.var_name].view()
+        # Plain derived variables have no values for the new samples.
+        for item in self._derived_data.values():
+            if type(item) is DataItem:
+                buffer = self._plain_derived_buffers.get(item.var_name)
+                if buffer is None:
+                    buffer = AppendBuffer(np.asarray(item.data, dtype=np.float64))
+                    self._plain_derived_buffers[item.var_name] = buffer
+                item._data = buffer.replace_tail(None, np.full(len(time), np.nan))
+        self._timebase = timebase.extend(self._timebase, time)
+        self._avg_dt = self._timebase.avg_dt
+        self._shifted_timebase = self._timebase.shifted(self._time_offset)
+        # The data no longer matches the file it was loaded from.
+        self.source_fingerprint = None
+
+        self._derived_graph.extend(n_old)
+        self.dataAppended.emit(n_old)
+
+    def time_to_tick(self, time):
+        ''' The last tick at or before `time` (sample-and-hold). '''
+        return self._shifted_timebase.tick_at(time)
+
+    def time_to_nearest_tick(self, time):
+        return self._shifted_timebase.nearest_tick(time)
 
     def rowCount(self, parent=QModelIndex()):
         return len(self._data)
@@ -140,31 +239,95 @@ class DataModel(QAbstractListModel):
             # Normal items are enabled and selectable
             return Qt.ItemIsEnabled | Qt.ItemIsSelectable
 
+    def _raw_column(self, name):
+        return self._columns[name].view() if self._columns is not None else self._raw_data[name].to_numpy()
+
     def has_key(self, name):
         return name in self._raw_data.index
 
     def get_data_by_name(self, name):
         # First check derived variables
         if name in self._derived_data:
-            return self._derived_data[name].data
+            try:
+                return self._derived_data[name].data
+            except Exception as ex:
+                logger.error(f"Unable to compute derived variable '{name}': {ex}")
+                return None
 
         # Then check raw data
+        if self._columns is not None and name in self._columns:
+            return self._columns[name].view()
         try:
             return self._raw_data[name]
         except KeyError:
             logger.warning(f"Unknown key: {name}")
             return None
 
+    def get_variable_names(self):
+        """Names of all variables (raw, then derived)"""
+        return sorted(self._raw_data.columns) + sorted(self._derived_data)
+
     def has_variable(self, name):
         """Check if a variable name already exists (raw or derived)"""
         return name in self._raw_data.columns or name in self._derived_data
 
+    def is_derived(self, name):
+        return name in self._derived_data
+
+    def get_recipe(self, name):
+        """The recipe of a derived variable, or None if it isn't derived from a recipe"""
+        return self._derived_graph.recipe(name)
+
+    def get_recipes(self, names):
+        """(name, recipe) of the derived variables in `names` and of those they depend on, dependencies first"""
+        return [(name, self._derived_graph.recipe(name)) for name in self._derived_graph.dependencies(names)]
+
+    def materialize_derived(self, names):
+        """Compute the derived variables in `names` that haven't been computed yet, in parallel"""
+        self._derived_graph.materialize([name for name in names if name in self._derived_graph])
+
     def add_derived_variable(self, name, data):
         """Add a derived variable to this model"""
         if self.has_variable(name):
             raise ValueError(f"Variable name '{name}' already exists in this data model")
 
-        self._derived_data[name] = DataItem(name, data)
+        self._add_derived_item(DataItem(name, data))
+
+    def add_derived_recipe(self, name, recipe):
+        """Add a derived variable that is computed from `recipe` when it is first used"""
+        if self.has_variable(name):
+            raise ValueError(f"Variable name '{name}' already exists in this data model")
+
+        self._derived_graph.add(name, recipe)
+        item = DerivedItem(name, self._derived_graph)
+        self._add_derived_item(item)
+        return item
+
+    def add_derived_recipes(self, recipes):
+        """Add several derived variables, given as (name, recipe, value or None), with a single refresh"""
+        names = [name for name, _, _ in recipes]
+        if len(set(names)) != len(names):
+            raise ValueError("Duplicate derived variable names")
+        for name in names:
+            if self.has_variable(name):
+                raise ValueError(f"Variable name '{name}' already exists in this data model")
+
+        items = []
+        for name, recipe, value in recipes:
+            self._derived_graph.add(name, recipe)
+            if value is not None:
+                self._derived_graph.preset(name, value)
+            item = DerivedItem(name, self._derived_graph)
+            self._derived_data[name] = item
+            items.append(item)
+
+        if self._show_derived:
+            self._refresh_data_list()
+        self._update_checkbox_if_available()
+        return items
+
+    def _add_derived_item(self, item):
+        self._derived_data[item.var_name] = item
 
         # If we're showing derived variables, update the model
         if self._show_derived:
@@ -177,6 +340,8 @@ class DataModel(QAbstractListModel):
         """Remove a derived variable from this model"""
         if name in self._derived_data:
             del self._derived_data[name]
+            self._plain_derived_buffers.pop(name, None)
+            self._derived_graph.remove(name)
             if self._show_derived:
                 self._refresh_data_list()
 
@@ -196,7 +361,7 @@ class DataModel(QAbstractListModel):
         # Start with raw data (sorted)
         self._data = []
         for var in sorted(self._raw_data.columns):
-            self._data.append(DataItem(var, self._raw_data[var].to_numpy()))
+            self._data.append(DataItem(var, self._raw_column(var)))
 
         # Add derived variables at the end (sorted)
         if self._show_derived and self._derived_data:
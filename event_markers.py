@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+Markers for the errors and warnings of the text log, on the plots and on the overview strip.
+
+The events are kept as sorted arrays of times and severities. A redraw only looks at the events
+in the visible x-range (found with `searchsorted`). If there are more of those than pixels, they
+are merged into one bin per pixel; each bin is drawn in the color of its most severe event, more
+opaque the more events it holds. All the markers of a plot are drawn by a single graphics item.
+'''
+
+import math
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import QLineF, QRectF, Qt
+from PyQt5.QtGui import QColor, QPen
+
+import text_log_decode as tld
+
+# The severities that are marked, and their colors.
+MARKER_COLORS = {
+    tld.Severity.Critical: QColor(128, 0, 0),
+    tld.Severity.Error: QColor(Qt.red),
+    tld.Severity.Warn: QColor(230, 172, 0),
+}
+MAX_SEVERITY = max(MARKER_COLORS)
+
+# Opacity of a bin holding a single event, and of the densest bin (and of unmerged markers).
+MIN_ALPHA = 90
+MAX_ALPHA = 255
+# Bins are drawn with one of this many opacities.
+ALPHA_LEVELS = 4
+
+
+def visible_range(times, x0, x1):
+    ''' (first, last) such that times[first:last] are the (sorted) `times` within [x0, x1]. '''
+    return int(np.searchsorted(times, x0, side='left')), int(np.searchsorted(times, x1, side='right'))
+
+
+def bin_events(times, severities, x0, x1, n_bins):
+    '''
+        Merge the events within [x0, x1] into `n_bins` bins of equal width. Returns the index,
+        most severe severity and number of events of each bin that holds any, in order.
+    '''
+    first, last = visible_range(times, x0, x1)
+    if first == last or n_bins < 1 or x1 <= x0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int64)
+    bins = np.minimum(((times[first:last] - x0) * (n_bins / (x1 - x0))).astype(np.int64), n_bins - 1)
+    # The times are sorted, so the events of a bin are next to each other.
+    starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    counts = np.diff(np.append(starts, len(bins)))
+    # The most severe event has the lowest severity value.
+    return bins[starts], np.minimum.reduceat(severities[first:last], starts), counts
+
+
+def bin_alphas(counts):
+    ''' Opacity of bins holding `counts` events, in ALPHA_LEVELS steps. '''
+    peak = math.log(max(int(counts.max()), 2)) if len(counts) else 1.
+    level = np.floor(np.log(counts) / peak * (ALPHA_LEVELS - 1) + 0.5)
+    return MIN_ALPHA + (level * (MAX_ALPHA - MIN_ALPHA) / (ALPHA_LEVELS - 1)).astype(np.int64)
+
+
+def draw_markers(painter, xs, severities, alphas, y0, y1):
+    ''' Vertical lines from y0 to y1 at `xs`, colored by severity. The most severe are drawn last. '''
+    for severity in sorted(MARKER_COLORS, reverse=True):
+        of_severity = severities == severity
+        for alpha in np.unique(alphas[of_severity]):
+            color = QColor(MARKER_COLORS[severity])
+            color.setAlpha(int(alpha))
+            pen = QPen(color)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawLines([QLineF(x, y0, x, y1) for x in xs[of_severity & (alphas == alpha)].tolist()])
+
+
+def select_events(ticks, severities, tb):
+    '''
+        Times (on the timebase `tb`) and severities of the events to mark, from the ticks and
+        severities of text log messages. Ticks outside of the timebase are dropped.
+    '''
+    keep = (severities <= MAX_SEVERITY) & (ticks >= 0) & (ticks < len(tb))
+    return np.asarray(tb.at(ticks[keep]), dtype=np.float64), severities[keep]
+
+
+class EventMarkerItem(pg.GraphicsObject):
+    """ The text log events of a plot, drawn as vertical lines across the view. """
+
+    def __init__(self):
+        pg.GraphicsObject.__init__(self)
+        self._times = np.empty(0)
+        self._severities = np.empty(0, dtype=np.int8)
+        self._bounding_rect = None
+        # Behind the traces.
+        self.setZValue(-100)
+
+    def __len__(self):
+        return len(self._times)
+
+    def set_events(self, times=None, severities=None):
+        """ Show the events at `times` (in any order) with `severities`. None clears the markers. """
+        if times is None:
+            times, severities = np.empty(0), np.empty(0, dtype=np.int8)
+        times = np.asarray(times, dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        self._times = times[order]
+        self._severities = np.asarray(severities, dtype=np.int8)[order]
+        self.update()
+
+    def dataBounds(self, axis, frac=1.0, orthoRange=None):
+        # The markers follow the view; they shouldn't change its range.
+        return None
+
+    def viewTransformChanged(self):
+        self.prepareGeometryChange()
+        self._bounding_rect = None
+        pg.GraphicsObject.viewTransformChanged(self)
+
+    def boundingRect(self):
+        if self._bounding_rect is None:
+            rect = self.viewRect()
+            self._bounding_rect = QRectF() if rect is None else rect
+        return self._bounding_rect
+
+    def paint(self, painter, *args):
+        rect = self.viewRect()
+        if rect is None or not len(self._times):
+            return
+        x0, x1, y0, y1 = rect.left(), rect.right(), rect.top(), rect.bottom()
+        pixel = self.pixelWidth()
+        n_pixels = max(int(round((x1 - x0) / pixel)), 1) if pixel else 1
+        first, last = visible_range(self._times, x0, x1)
+        if last - first <= n_pixels:
+            xs = self._times[first:last]
+            severities = self._severities[first:last]
+            alphas = np.full(len(xs), MAX_ALPHA)
+        else:
+            bins, severities, counts = bin_events(self._times, self._severities, x0, x1, n_pixels)
+            xs = x0 + (bins + 0.5) * ((x1 - x0) / n_pixels)
+            alphas = bin_alphas(counts)
+        draw_markers(painter, xs, severities, alphas, y0, y1)
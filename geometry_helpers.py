@@ -15,6 +15,23 @@ def axis_angle_from_quat(quat):
         axis = np.array([0, 0, 1])
     return axis, angle
 
+def axis_angles_from_quats(quats):
+    '''
+    Batch version of `axis_angle_from_quat` for an (n, 4) array of quaternions. Returns an (n, 3)
+    array of axes and an (n,) array of angles (in degrees). Quaternions of zero or NaN norm (e.g. samples
+    logged before a pose was known) are treated as the identity.
+    '''
+    quats = np.array(quats, dtype=np.float64).reshape(-1, 4)
+    invalid = ~(np.linalg.norm(quats, axis=1) > 0)
+    quats[invalid] = [0, 0, 0, 1]
+
+    rotvecs = Rotation.from_quat(quats).as_rotvec(degrees=True)
+    angles = np.linalg.norm(rotvecs, axis=1)
+    axes = np.tile([0., 0., 1.], (len(quats), 1))
+    rotating = angles > 1e-5
+    axes[rotating] = rotvecs[rotating] / angles[rotating, np.newaxis]
+    return axes, angles
+
 def create_arrow(color=(1., 1., 1., 1.), width=2, pos=(0, 0, 0), vec=(0, 0, 0)):
     # Not much of an arrow at the moment, but it will have to do for now.
     pos = np.array(pos)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QEvent
+from PyQt5.QtGui import QCursor
+from PyQt5.QtWidgets import QToolTip
+import pyqtgraph as pg
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class HoverReadout(QObject):
+    """
+        Snap-to-sample readout for a SubPlotWidget.
+
+        While enabled, the sample closest to the mouse (in screen space) across all of the visible
+        traces of the subplot is highlighted and its trace name, time and value are shown in a
+        tooltip. Each trace is searched through its timebase and LOD envelope, so the cost of a
+        lookup is roughly logarithmic in the length of the trace.
+    """
+
+    # Samples further than this from the mouse are ignored.
+    SNAP_RADIUS_PX = 20
+    # Mouse move events are rate limited to roughly the display refresh rate.
+    RATE_LIMIT_HZ = 60
+
+    def __init__(self, subplot):
+        QObject.__init__(self, subplot)
+        self._subplot = subplot
+        self._proxy = None
+
+        self._marker = pg.ScatterPlotItem(size=10, pen=pg.mkPen(width=2), brush=None)
+        self._marker.setZValue(1000)
+        self._marker.hide()
+        subplot.pw.addItem(self._marker, ignoreBounds=True)
+
+    @property
+    def enabled(self):
+        return self._proxy is not None
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        if enabled:
+            self._proxy = pg.SignalProxy(self._subplot.pw.scene().sigMouseMoved,
+                                         rateLimit=self.RATE_LIMIT_HZ, slot=self._on_mouse_moved)
+            # On the view itself: switching the render backend replaces its viewport.
+            self._subplot.pw.installEventFilter(self)
+        else:
+            self._proxy.disconnect()
+            self._proxy = None
+            self._subplot.pw.removeEventFilter(self)
+            self._hide()
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Leave:
+            self._hide()
+        return False
+
+    def _hide(self):
+        self._marker.hide()
+        QToolTip.hideText()
+
+    def find_nearest(self, x, y, x_scale, y_scale):
+        """
+            Returns (label, tick, distance) for the visible sample closest to (x, y), where the
+            scales convert data units to pixels. Returns None if there is no sample within
+            SNAP_RADIUS_PX.
+        """
+        best = None
+        x_window = self.SNAP_RADIUS_PX / x_scale
+        for label in self._subplot.traces:
+            trace = label.trace
+            if label.is_hidden or not hasattr(trace, 'lod'):
+                continue
+            first, last = trace.timebase.tick_range(x - x_window, x + x_window)
+            result = trace.lod.nearest(trace.timebase, first, last, x, y, x_scale, y_scale)
+            if result is not None and (best is None or result[1] < best[2]):
+                best = (label, *result)
+
+        if best is None or best[2] > self.SNAP_RADIUS_PX:
+            return None
+        return best
+
+    def _on_mouse_moved(self, event):
+        scene_pos = event[0]
+        view_box = self._subplot.pw.getViewBox()
+        if not view_box.sceneBoundingRect().contains(scene_pos):
+            self._hide()
+            return
+
+        pos = view_box.mapSceneToView(scene_pos)
+        px_width, px_height = view_box.viewPixelSize()
+        if px_width <= 0 or px_height <= 0:
+            return
+
+        nearest = self.find_nearest(pos.x(), pos.y(), 1. / px_width, 1. / px_height)
+        if nearest is None:
+            self._hide()
+            return
+
+        label, tick, _ = nearest
+        time = label.trace.timebase.at(tick).item()
+        value = label.trace.yData[tick]
+        self._marker.setData([time], [value], pen=pg.mkPen(label.trace.opts['pen'].color(), width=2))
+        self._marker.show()
+        QToolTip.showText(QCursor.pos(),
+                          f"{label.display_name}\nt = {time:.6f}\n{label.format_value(tick)}",
+                          self._subplot.pw)
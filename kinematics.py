@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+'''
+Forward kinematics of a URDF robot for every tick of a log at once.
+
+The transforms of a joint are computed for all the ticks with a few array operations, and the
+world transforms of the links are built by walking the tree down from the base, so each joint is
+visited once however many ticks there are. Joints are interpreted as in `robot_geometry.RobotLink`
+(revolute and prismatic positions are clamped to their limits).
+
+The poses are available to recipes as the "fk" operation, with one derived variable per field of
+the pose of a link (see `pose_variable_name`).
+'''
+
+import collections
+import threading
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from logging_config import get_logger
+from maths.recipes import operation
+
+logger = get_logger(__name__)
+
+# Ticks that are processed at a time, to bound the memory used by the (n, 4, 4) transforms.
+CHUNK_TICKS = 1 << 16
+
+# The fields of the pose of a link: its position, then its orientation as a quaternion (x, y, z, w).
+POSE_FIELDS = ("x", "y", "z", "qx", "qy", "qz", "qw")
+
+Joint = collections.namedtuple("Joint", ["name", "joint_type", "parent", "child", "origin", "axis", "lower",
+                                         "upper"])
+
+
+def _cross_matrix(axis):
+    ''' The matrix K such that K @ v is the cross product of the unit vector along `axis` with v. '''
+    x, y, z = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    return np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+
+
+def _joint_terms(joint, q):
+    '''
+    The transforms of `joint` at the positions `q` as a weighted sum of constant matrices: returns
+    the (n, m) weights and the m (4, 4) matrices.
+    '''
+    q = np.asarray(q, dtype=np.float64)
+    if joint.joint_type in ('revolute', 'prismatic') and joint.lower is not None:
+        q = np.clip(q, joint.lower, joint.upper)
+    origin = np.asarray(joint.origin, dtype=np.float64)
+    if joint.joint_type in ('revolute', 'continuous'):
+        # Rodrigues: origin @ R(q) = origin + sin(q) * origin @ K + (1 - cos(q)) * origin @ K^2.
+        k = np.zeros((4, 4))
+        k[:3, :3] = _cross_matrix(joint.axis)
+        return np.stack((np.ones_like(q), np.sin(q), 1 - np.cos(q)), axis=1), [origin, origin @ k, origin @ k @ k]
+    if joint.joint_type == 'prismatic':
+        # The translation moves along the axis (in the frame of the origin).
+        offset = np.zeros((4, 4))
+        offset[:3, 3] = origin[:3, :3] @ joint.axis
+        return np.stack((np.ones_like(q), q), axis=1), [origin, offset]
+    return np.ones((len(q), 1)), [origin]
+
+
+def joint_transforms(joint, q):
+    ''' (n, 4, 4) transforms of the child link of `joint` relative to its parent, at the positions `q`. '''
+    weights, terms = _joint_terms(joint, q)
+    return (weights @ np.reshape(terms, (-1, 16))).reshape(-1, 4, 4)
+
+
+def quaternions_from_matrices(rotations):
+    ''' The (n, 4) quaternions (x, y, z, w) of the (n, 3, 3) rotation matrices `rotations`. '''
+    # As in `scipy.spatial.transform.Rotation.from_matrix`, without its validation of each matrix:
+    # each rotation has four (unnormalized) quaternions, the most accurate being the one for the
+    # largest of the diagonal elements and the trace. The elements are made contiguous first.
+    m00, m01, m02, m10, m11, m12, m20, m21, m22 = np.reshape(rotations, (-1, 9)).T.copy()
+    candidates = np.array([
+        (1 + m00 - m11 - m22, m10 + m01, m20 + m02, m21 - m12),
+        (m01 + m10, 1 - m00 + m11 - m22, m21 + m12, m02 - m20),
+        (m02 + m20, m12 + m21, 1 - m00 - m11 + m22, m10 - m01),
+        (m21 - m12, m02 - m20, m10 - m01, 1 + m00 + m11 + m22)])
+    quats = np.choose(np.array((m00, m11, m22, m00 + m11 + m22)).argmax(axis=0), candidates)
+    return (quats / np.sqrt((quats * quats).sum(axis=0))).T
+
+
+def base_transforms(pos, quat):
+    '''
+    (n, 4, 4) transforms of a floating base at the positions `pos` (n, 3) with the orientations
+    `quat` (n, 4, as x, y, z, w). Quaternions of zero or NaN norm are treated as the identity.
+    '''
+    quat = np.array(quat, dtype=np.float64).reshape(-1, 4)
+    quat[~(np.linalg.norm(quat, axis=1) > 0)] = [0, 0, 0, 1]
+    transforms = np.zeros((len(quat), 4, 4))
+    transforms[:, :3, :3] = Rotation.from_quat(quat).as_matrix()
+    transforms[:, :3, 3] = pos
+    transforms[:, 3, 3] = 1
+    return transforms
+
+
+class KinematicTree(object):
+    """ The joints of a robot, and the links they connect. """
+
+    def __init__(self, base_link, joints):
+        self.base_link = base_link
+        self.joints = list(joints)
+        self._parent_joints = {joint.child: joint for joint in self.joints}
+
+    @classmethod
+    def from_urdf(cls, robot_info):
+        ''' The tree of a robot loaded with `urdfpy.URDF.load`. '''
+        joints = []
+        for joint in robot_info.joints:
+            limit = joint.limit
+            joints.append(Joint(joint.name, joint.joint_type, joint.parent, joint.child,
+                                np.asarray(joint.origin, dtype=np.float64), np.asarray(joint.axis, dtype=np.float64),
+                                None if limit is None else limit.lower, None if limit is None else limit.upper))
+        return cls(robot_info.base_link.name, joints)
+
+    @property
+    def links(self):
+        return [self.base_link] + [joint.child for joint in self.joints]
+
+    @property
+    def movable_joints(self):
+        return [joint.name for joint in self.joints if joint.joint_type != 'fixed']
+
+    def chain(self, link):
+        ''' The joints from the base to `link`, in order. Raises KeyError for an unknown link. '''
+        chain = []
+        while link != self.base_link:
+            joint = self._parent_joints[link]
+            chain.append(joint)
+            link = joint.parent
+        return chain[::-1]
+
+    def link_transforms(self, links, n_ticks, joint_positions, base=None):
+        '''
+        World transforms ((n_ticks, 4, 4) arrays) of `links`, as a dict. `joint_positions` maps
+        joint names to arrays of n_ticks positions (joints that aren't in it stay at 0). `base`
+        holds the transforms of the base link, which is at the origin if None.
+        '''
+        transforms = {self.base_link: base}
+        for link in links:
+            for joint in self.chain(link):
+                # Links shared by several chains are only computed once.
+                if joint.child in transforms:
+                    continue
+                q = joint_positions.get(joint.name)
+                q = np.zeros(n_ticks) if q is None else q
+                parent = transforms[joint.parent]
+                child = joint_transforms(joint, q)
+                transforms[joint.child] = child if parent is None else parent @ child
+        if transforms[self.base_link] is None:
+            transforms[self.base_link] = np.broadcast_to(np.eye(4), (n_ticks, 4, 4))
+        return {link: transforms[link] for link in links}
+
+
+def link_poses(tree, links, n_ticks, joint_positions, base_pos=None, base_quat=None):
+    '''
+    The world poses of `links` at every tick, as a dict of (len(POSE_FIELDS), n_ticks) arrays. The
+    arguments are as for `KinematicTree.link_transforms`; the base is floating if `base_pos` and
+    `base_quat` ((n_ticks, 3) and (n_ticks, 4) arrays) are given.
+    '''
+    poses = {link: np.empty((len(POSE_FIELDS), n_ticks)) for link in links}
+    for start in range(0, n_ticks, CHUNK_TICKS):
+        end = min(start + CHUNK_TICKS, n_ticks)
+        base = None if base_pos is None else base_transforms(base_pos[start:end], base_quat[start:end])
+        chunk = {name: np.asarray(q)[start:end] for name, q in joint_positions.items()}
+        for link, transforms in tree.link_transforms(links, end - start, chunk, base).items():
+            poses[link][:3, start:end] = transforms[:, :3, 3].T
+            poses[link][3:, start:end] = quaternions_from_matrices(transforms[:, :3, :3]).T
+    logger.debug(f"Computed the poses of {len(links)} links for {n_ticks} ticks")
+    return poses
+
+
+def pose_variable_name(link, field):
+    ''' The name of the derived variable holding the `field` (see POSE_FIELDS) of the pose of `link`. '''
+    return f"fk.{link}.{field}"
+
+
+# Kinematic trees by URDF file, for the "fk" operation. Robot models register the tree of the file
+# they loaded; other files are loaded on first use.
+_trees = {}
+# (key, poses, inputs) of the last evaluation of "fk": the fields of a pose are separate recipes,
+# but they are computed together.
+_last_poses = (None, None, None)
+_poses_lock = threading.Lock()
+_lock = threading.Lock()
+
+
+def register_tree(urdf, tree):
+    with _lock:
+        _trees[urdf] = tree
+
+
+def tree_of_urdf(urdf):
+    with _lock:
+        tree = _trees.get(urdf)
+    if tree is None:
+        from urdfpy import URDF
+        tree = KinematicTree.from_urdf(URDF.load(urdf))
+        register_tree(urdf, tree)
+    return tree
+
+
+@operation("fk")
+def forward_kinematics(inputs, tb, *, urdf, link, field, joint_pattern, joints, floating_base=False):
+    '''
+    The `field` (see POSE_FIELDS) of the world pose of `link` of the robot described by the file
+    `urdf`. The inputs are the orientation (x, y, z, w) and position of the base if it is floating,
+    then the positions of `joints`, read from the variables `joint_pattern.format(joint)`. The
+    other joints stay at 0.
+    '''
+    global _last_poses
+    inputs = [np.asarray(data, dtype=np.float64) for data in inputs]
+    n_base = 7 if floating_base else 0
+    if len(inputs) != n_base + len(joints):
+        raise ValueError(f"Expected {n_base + len(joints)} inputs for the joints named '{joint_pattern}', "
+                         f"got {len(inputs)}")
+
+    n_ticks = len(inputs[0]) if inputs else len(tb)
+    # The inputs are identified by their memory, which can't be reused while `_last_poses` holds them.
+    key = (urdf, link, tuple(joints), floating_base, n_ticks,
+           tuple((data.__array_interface__['data'][0], data.shape, data.strides) for data in inputs))
+    # The other fields wait for the one being computed rather than computing it again.
+    with _poses_lock:
+        last_key, poses, _ = _last_poses
+        if last_key != key:
+            tree = tree_of_urdf(urdf)
+            base = (np.column_stack(inputs[4:7]), np.column_stack(inputs[:4])) if floating_base else (None, None)
+            poses = link_poses(tree, [link], n_ticks, dict(zip(joints, inputs[n_base:])), *base)[link]
+            _last_poses = (key, poses, inputs)
+    return poses[POSE_FIELDS.index(field)]
@@ -1,12 +1,13 @@
 # This Python file uses the following encoding: utf-8
 import pyqtgraph as pg
-from PyQt5.QtCore import (QCoreApplication, QPoint, QSettings, QSize, Qt,
+from PyQt5.QtCore import (QCoreApplication, QPoint, QSettings, QSize, QStandardPaths, Qt,
                           pyqtSlot)
 from PyQt5.QtGui import QIcon, QKeyEvent
 from PyQt5.QtWidgets import (QAction, QApplication, QFileDialog, QLabel,
                              QMainWindow, QMessageBox, QSplitter)
 
 from data_file_widget import DataFileWidget
+from playback import PlaybackWidget
 from plot_manager import PlotManager
 from visualizer_3d_widget import DockedVisualizer3DWidget
 from docked_phase_plot_widget import DockedPhasePlotWidget # Added for Phase Plot
@@ -28,7 +29,9 @@ from pathlib import Path
 
 import commentjson as json
 
+import render_backend
 from imports import install_and_import
+from maths import derived_cache
 from maths_widget import DockedMathsWidget
 from preferences_dialog import PreferencesDialog
 from shortcuts_help_dialog import ShortcutsHelpDialog
@@ -104,6 +107,8 @@ class PyPlot(QMainWindow):
         # Depends on plot_manager, so needs to be created near the end.
         self.setup_menu_bar()
 
+        self.statusBar().addPermanentWidget(PlaybackWidget(self.plot_manager.playback))
+
         tick_time_indicator = TimeTickWidget()
         self.plot_manager.tickValueChanged.connect(tick_time_indicator.update_tick)
         self.plot_manager.timeValueChanged.connect(tick_time_indicator.update_time)
@@ -112,6 +117,7 @@ class PyPlot(QMainWindow):
         self._settings = QSettings()
 
         self._read_settings()
+        self._configure_derived_cache()
 
     def setup_menu_bar(self):
         self.setup_file_menu()
@@ -177,10 +183,17 @@ class PyPlot(QMainWindow):
         append_plotlist_action.setStatusTip('Append the plotlist contents to the current tab')
         append_plotlist_action.triggered.connect(lambda: self.load_plotlist(True))
 
+        hover_readout_action = QAction("snap hover readout", self)
+        hover_readout_action.setShortcut("Ctrl+h")
+        hover_readout_action.setCheckable(True)
+        hover_readout_action.setStatusTip('Show the value of the sample closest to the mouse')
+        hover_readout_action.toggled.connect(self.plot_manager.set_hover_readout_enabled)
+
         main_menu = self.menuBar()
         plot_menu = main_menu.addMenu('&Plot')
         plot_menu.addAction(add_plot_action)
         plot_menu.addAction(new_tab_action)
+        plot_menu.addAction(hover_readout_action)
         plot_menu.addSeparator()
         plot_menu.addAction(save_plotlist_action)
         plot_menu.addAction(load_plotlist_action)
@@ -293,7 +306,7 @@ class PyPlot(QMainWindow):
         if is_checked:
             # Create (or unhide) the widget
             if not self.maths_widget:
-                self.maths_widget = DockedMathsWidget(self)
+                self.maths_widget = DockedMathsWidget(self, self.data_file_widget, self.plot_manager)
                 self.addDockWidget(Qt.BottomDockWidgetArea, self.maths_widget)
 
                 def on_close():
@@ -408,7 +421,8 @@ class PyPlot(QMainWindow):
                 event.key() == Qt.Key_Left or
                 event.key() == Qt.Key_Right or
                 event.key() == Qt.Key_Up or
-                event.key() == Qt.Key_Down) or \
+                event.key() == Qt.Key_Down or
+                event.key() == Qt.Key_Space) or \
                 (event.key() == Qt.Key_A and event.modifiers() & Qt.ControlModifier):
             # __import__("ipdb").set_trace()
             self.plot_manager.handle_key_press(event)
@@ -446,12 +460,32 @@ class PyPlot(QMainWindow):
             self.data_file_widget.open_file(filename)
             self._set_last_dir("last_log_dir", os.path.dirname(filename))
 
+    def _configure_derived_cache(self):
+        self._settings.beginGroup("Preferences")
+        size_mb = int(self._settings.value(derived_cache.SETTING_NAME, derived_cache.DEFAULT_SIZE_MB))
+        self._settings.endGroup()
+        if size_mb <= 0:
+            derived_cache.set_cache(None)
+            return
+
+        cache = derived_cache.get_cache()
+        if cache is not None:
+            cache.set_limit(size_mb << 20)
+            return
+        directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "derived")
+        try:
+            derived_cache.set_cache(derived_cache.DiskCache(directory, size_mb << 20))
+        except OSError as ex:
+            logger.warning(f"Unable to use {directory} for caching derived variables: {ex}")
+
     def update_settings(self):
         prefs = PreferencesDialog(parent=self)
         if prefs.exec():
             prefs.saveSettings()
             # Update all existing plot widgets with new settings
             self.plot_manager.update_all_cursor_settings()
+            self.plot_manager.update_all_render_backends()
+            self._configure_derived_cache()
             # Update phase plot markers if phase plot widget exists
             if self.phase_plot_widget and hasattr(self.phase_plot_widget, 'update_all_marker_settings'):
                 self.phase_plot_widget.update_all_marker_settings()
@@ -599,6 +633,8 @@ def get_main_parser():
     main_parser.add_argument('-f', '--logfile').complete = LOG_FILES
     main_parser.add_argument('-p', '--plotlist', type=argparse.FileType('r'), action='append').complete = shtab.FILE
     main_parser.add_argument('-a', '--analysis', type=argparse.FileType('r'), action='append').complete = shtab.FILE
+    main_parser.add_argument('-r', '--render-backend', choices=render_backend.BACKENDS,
+                             help="Override the plot rendering backend (e.g. for benchmarking)")
     return main_parser
 
 
@@ -610,12 +646,15 @@ if __name__ == "__main__":
     resource_dir, _ = os.path.split(os.path.realpath(__file__))
     MainEventThread.setWindowIcon(QIcon(resource_dir + "/logo.png"))
 
-    MainApplication = PyPlot()
-
     # <Begin> Parse args here
     parser = get_main_parser()
-    parser.set_defaults(func=MainApplication.load_from_cli)
     args = parser.parse_args()
+    # The render backend must be selected before any plots are created.
+    if args.render_backend is not None:
+        render_backend.set_override(args.render_backend)
+
+    MainApplication = PyPlot()
+    args.func = MainApplication.load_from_cli
 
     if args.logfile is None and (args.plotlist is not None or args.analysis is not None):
         logger.error("If a plotlist (or set of plotlists) is specified from the command-line, a file must "
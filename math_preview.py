@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+Live preview of a math operation while its parameters are being chosen.
+
+Only the visible x-window of the subplot is computed, plus a warm-up margin on either side so that
+filters and running windows have settled by the edge of the view. When the window holds many more
+samples than there are pixels, the input is decimated first if the operation allows it (see
+`MathSpecBase.preview_params`).
+'''
+
+from PyQt5.QtCore import Qt, QTimer
+
+import numpy as np
+import pyqtgraph as pg
+
+from maths.recipes import get_operation
+from logging_config import get_logger
+import timebase
+
+logger = get_logger(__name__)
+
+
+class MathPreview(object):
+    # Samples computed per horizontal pixel when the input can be decimated.
+    POINTS_PER_PIXEL = 4
+    DEBOUNCE_MS = 100
+
+    def __init__(self, subplot, source, var_name, spec):
+        self._plot_item = subplot.pw.getPlotItem()
+        self._model = source.model()
+        self._var_name = var_name
+        self._spec = spec
+        self._params = None
+        self._item = None
+
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(self._compute)
+        self._plot_item.getViewBox().sigXRangeChanged.connect(self._schedule)
+
+    def update(self, params):
+        """ Show the preview for the recipe parameters `params` (debounced). """
+        self._params = params
+        self._schedule()
+
+    def _schedule(self, *args):
+        if self._params is not None:
+            self._timer.start()
+
+    def _window(self, tb):
+        view = self._plot_item.getViewBox()
+        x0, x1 = view.viewRange()[0]
+        # A margin of None means that the operation needs all of the preceding data.
+        margin = self._spec.preview_margin(self._params, tb)
+        visible_first, _ = tb.tick_range(x0, x1)
+        first = 0 if margin is None else tb.tick_range(x0 - margin, x1)[0]
+        _, last = tb.tick_range(x0, x1 + (margin or 0.))
+        return first, last, visible_first, max(int(view.width()), 1)
+
+    def _compute(self):
+        tb = self._model.timebase
+        data = self._model.get_data_by_name(self._var_name)
+        if data is None or len(tb) == 0:
+            return
+        first, last, visible_first, width = self._window(tb)
+        if last - first < 2:
+            return
+
+        params = self._params
+        stride = max(1, (last - first) // (self.POINTS_PER_PIXEL * width))
+        if stride > 1:
+            decimated_params = self._spec.preview_params(params, stride, tb.avg_dt)
+            if decimated_params is None:
+                stride = 1
+            else:
+                params = decimated_params
+
+        ticks = slice(first, last, stride)
+        window_tb = timebase.from_array(tb.at(np.arange(first, last, stride)))
+        try:
+            y = np.asarray(get_operation(self._spec.operation)([np.asarray(data)[ticks]], window_tb, **params))
+        except Exception as ex:
+            logger.debug(f"Preview of {self._spec.operation} failed: {ex}")
+            return
+
+        # Don't show the warm-up before the view.
+        keep = (visible_first - first) // stride
+        x, y = window_tb.array()[keep:], y[keep:]
+        if self._item is None:
+            # Add the item before giving it data: while it is being added it briefly has no view box,
+            # which `clipToView` can't handle.
+            self._item = pg.PlotDataItem(pen=pg.mkPen(color='k', width=1, style=Qt.DashLine),
+                                         clipToView=True, autoDownsample=True, downsampleMethod='peak')
+            self._plot_item.addItem(self._item, ignoreBounds=True)
+        self._item.setData(x, y)
+
+    def remove(self):
+        self._timer.stop()
+        self._params = None
+        try:
+            self._plot_item.getViewBox().sigXRangeChanged.disconnect(self._schedule)
+        except TypeError:
+            pass
+        if self._item is not None:
+            self._plot_item.removeItem(self._item)
+            self._item = None
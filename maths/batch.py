@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+'''
+Applying a math operation to many variables at once.
+
+Variables are selected with a wildcard or regular expression. Each selected variable is evaluated
+in a separate process of a shared process pool so that independent variables are computed
+concurrently, without contending for the GIL. `BatchRun` reads the inputs, submits the jobs and
+tracks them so the caller can report progress and collect the results.
+'''
+
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import fnmatch
+import multiprocessing
+import os
+import re
+import threading
+
+import numpy as np
+
+from logging_config import get_logger
+from maths.recipes import Recipe, get_operation
+
+logger = get_logger(__name__)
+
+MAX_PROCESSES = os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ The process pool shared by all batch runs (created on first use). """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a process that runs Qt and several threads isn't safe.
+            _pool = ProcessPoolExecutor(max_workers=MAX_PROCESSES,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def match_variables(names, pattern, regex=False):
+    """ The names matching `pattern`, a wildcard pattern or (if `regex`) a regular expression. """
+    if regex:
+        try:
+            expr = re.compile(pattern)
+        except re.error as ex:
+            raise ValueError(f"Invalid regular expression '{pattern}': {ex}") from None
+        return [name for name in names if expr.search(name)]
+    return [name for name in names if fnmatch.fnmatchcase(name, pattern)]
+
+
+def format_output_name(template, var_name, operation, file_name=""):
+    """ Output name from `template`, which may use the fields {var}, {op} and {file}. """
+    try:
+        return template.format(var=var_name, op=operation, file=file_name)
+    except (KeyError, IndexError, ValueError) as ex:
+        raise ValueError(f"Invalid name template '{template}': {ex}") from None
+
+
+def run_operation(operation, data, tb, params):
+    """ Evaluate a single-input recipe operation. Runs in the worker processes. """
+    return np.asarray(get_operation(operation)([data], tb, **params))
+
+
+@dataclass
+class BatchItem:
+    model: object
+    var_name: str
+    output_name: str
+    recipe: Recipe
+    # Not used by the batch itself; lets the caller tell where the result belongs.
+    source: object = None
+
+
+class BatchRun(object):
+    """
+        The jobs of one batch. `submit` reads the inputs, evaluating derived ones, and submits the
+        jobs to the process pool, so it is best called off the GUI thread.
+    """
+
+    def __init__(self, items, pool=None):
+        self.items = list(items)
+        self._pool = pool
+        self._futures = []
+        self._submitted = False
+        self._cancelled = False
+
+    def _read_input(self, item):
+        model = item.model
+        # Derived inputs were computed by `submit`; this raises the error of one that failed.
+        model.materialize_derived([item.var_name])
+        data = model.get_data_by_name(item.var_name)
+        if data is None:
+            raise KeyError(f"Unknown variable '{item.var_name}'")
+        return np.asarray(data)
+
+    def submit(self):
+        """ Read the inputs of the jobs and submit them. Jobs whose input can't be read fail. """
+        derived = defaultdict(list)
+        for item in self.items:
+            if item.model.is_derived(item.var_name):
+                derived[id(item.model)].append(item)
+        for model_items in derived.values():
+            try:
+                # In parallel, rather than one at a time.
+                model_items[0].model.materialize_derived([item.var_name for item in model_items])
+            except Exception:
+                # Reported for each item that reads a variable that failed.
+                pass
+
+        pool = self._pool or get_pool()
+        futures = []
+        for item in self.items:
+            if self._cancelled:
+                future = Future()
+                future.cancel()
+            else:
+                try:
+                    data = self._read_input(item)
+                except Exception as ex:
+                    future = Future()
+                    future.set_exception(ex)
+                else:
+                    future = pool.submit(run_operation, item.recipe.operation, data, item.model.timebase,
+                                         item.recipe.params)
+            futures.append(future)
+        self._futures = futures
+        self._submitted = True
+        if self._cancelled:
+            self.cancel()
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def done_count(self):
+        return sum(future.done() for future in self._futures)
+
+    def done(self):
+        return self._submitted and all(future.done() for future in self._futures)
+
+    def cancel(self):
+        self._cancelled = True
+        for future in self._futures:
+            future.cancel()
+
+    def results(self):
+        """ (item, value) pairs of the jobs that succeeded. Failures are logged and skipped. """
+        results = []
+        for item, future in zip(self.items, self._futures):
+            if future.cancelled():
+                continue
+            try:
+                results.append((item, future.result()))
+            except Exception as ex:
+                logger.error(f"Unable to compute '{item.output_name}': {ex}")
+        return results
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+On-disk cache of derived-variable values, so they survive closing and reopening a log.
+
+Values are keyed by a fingerprint of the source file (path, size and modification time), the
+operation, its parameters and (recursively) the inputs of the recipe. Each value is stored as a
+`.npy` file in the cache directory and is memory-mapped when it is read back, so a cached value
+costs no time to load and only occupies memory once its pages are touched.
+
+The total size of the directory is capped; the least recently used files are deleted first. The
+recency is kept in the modification time of the files, so it carries over to the next session.
+
+The cache is disabled until `set_cache` is called (`main.py` does that from the preferences).
+'''
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Bump to invalidate all existing cache files, e.g. when the result of an operation changes.
+CACHE_VERSION = 1
+
+# Name of the setting (in the "Preferences" group) holding the size cap in MiB. 0 disables the cache.
+SETTING_NAME = "maths/derived_cache_mb"
+DEFAULT_SIZE_MB = 2048
+
+_SUFFIX = ".npy"
+
+_cache = None
+
+
+def get_cache():
+    ''' The cache used by derived variables, or None if caching is disabled. '''
+    return _cache
+
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def file_fingerprint(path):
+    ''' Identifies the current contents of the file `path`, or None if it isn't a file. '''
+    try:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return (path, st.st_size, st.st_mtime_ns)
+
+
+def key_digest(key):
+    ''' File name stem for `key`, which must have a deterministic repr (tuples, strings, numbers). '''
+    return hashlib.sha1(repr((CACHE_VERSION, key)).encode()).hexdigest()
+
+
+class DiskCache(object):
+    ''' Arrays stored in `directory`, with at most `limit` bytes in total. '''
+
+    def __init__(self, directory, limit):
+        self.directory = directory
+        self.limit = int(limit)
+        self._lock = threading.Lock()
+        # File name -> size, least recently used first.
+        self._entries = OrderedDict()
+        self._nbytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(_SUFFIX) and entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime_ns, entry.name, st.st_size))
+            elif entry.name.endswith(".tmp"):
+                # Left behind by a write that didn't finish.
+                self._unlink(entry.name)
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._nbytes += size
+        self._evict()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def set_limit(self, limit):
+        ''' Cap the total size at `limit` bytes, evicting the least recently used values if needed. '''
+        self.limit = int(limit)
+        self._evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _unlink(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError as ex:
+            # e.g. on Windows, while the file is still memory-mapped.
+            logger.debug(f"Unable to remove {name} from the derived cache: {ex}")
+
+    def get(self, key):
+        ''' The array stored for `key` (memory-mapped, read-only), or None. '''
+        name = key_digest(key) + _SUFFIX
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = self._path(name)
+        try:
+            value = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError) as ex:
+            logger.warning(f"Discarding unreadable derived cache file {name}: {ex}")
+            self._discard(name)
+            return None
+        return value
+
+    def put(self, key, value):
+        ''' Store `value` for `key`, evicting the least recently used values if needed. '''
+        value = np.asarray(value)
+        if value.dtype.hasobject or value.nbytes > self.limit:
+            return
+        name = key_digest(key) + _SUFFIX
+        tmp_name = f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(self._path(tmp_name), 'wb') as f:
+                np.save(f, value)
+            os.replace(self._path(tmp_name), self._path(name))
+            size = os.path.getsize(self._path(name))
+        except OSError as ex:
+            logger.warning(f"Unable to write to the derived cache: {ex}")
+            self._unlink(tmp_name)
+            return
+        with self._lock:
+            self._nbytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+        self._evict()
+
+    def _discard(self, name):
+        with self._lock:
+            self._nbytes -= self._entries.pop(name, 0)
+        self._unlink(name)
+
+    def _evict(self):
+        evict = []
+        with self._lock:
+            while self._nbytes > self.limit and self._entries:
+                name, size = self._entries.popitem(last=False)
+                self._nbytes -= size
+                evict.append(name)
+        for name in evict:
+            self._unlink(name)
+        if evict:
+            logger.debug(f"Evicted {len(evict)} values from the derived cache")
+
+    def clear(self):
+        with self._lock:
+            names = list(self._entries)
+            self._entries.clear()
+            self._nbytes = 0
+        for name in names:
+            self._unlink(name)
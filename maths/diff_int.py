@@ -1,9 +1,24 @@
 import numpy as np
 
 from maths.maths_base import MathSpecBase
+from maths.recipes import operation
+
+
+@operation("differentiate")
+def differentiate(inputs, tb):
+    data, = inputs
+    return np.concatenate(([0], np.diff(data) / np.diff(tb.array())))
+
+
+@operation("integrate")
+def integrate(inputs, tb):
+    data, = inputs
+    return np.cumsum(data * np.concatenate(([0], np.diff(tb.array()))))
 
 
 class DifferentiateSpec(MathSpecBase):
+    operation = "differentiate"
+
     def __init__(self, parent):
         MathSpecBase.__init__(self, parent=parent, name="differentiate")
 
@@ -13,14 +28,16 @@ class DifferentiateSpec(MathSpecBase):
     def get_params(self):
         return True
 
-    def do_math(self, data, dt):
-        return np.concatenate(([0], np.diff(data.data) / np.diff(data.time)))
+    def recipe_params(self):
+        return {}
 
     def default_var_name(self, vname):
         return f"Diff({vname})"
 
 
 class IntegrateSpec(MathSpecBase):
+    operation = "integrate"
+
     def __init__(self, parent):
         MathSpecBase.__init__(self, parent=parent, name="integrate")
 
@@ -30,8 +47,8 @@ class IntegrateSpec(MathSpecBase):
     def get_params(self):
         return True
 
-    def do_math(self, data, dt):
-        return np.cumsum(data.data * np.concatenate(([0], np.diff(data.time))))
+    def recipe_params(self):
+        return {}
 
     def default_var_name(self, vname):
         return f"Int({vname})"
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+'''
+Compiled expression engine for the maths widget.
+
+An expression such as "sqrt(x0^2 + x1^2) * 0.5" is parsed once into a small program of NumPy
+ufunc calls. The program is then run over the input arrays in cache-sized blocks, with every
+intermediate result written into a per-thread scratch buffer that is reused from block to block.
+Long arrays are split across several threads (NumPy releases the GIL inside ufuncs). Peak memory
+is therefore the output array plus a few blocks per thread, regardless of the number of operators.
+
+If numexpr is installed it is used instead, since it does the same thing in compiled code.
+
+The syntax follows the one previously accepted through py_expression_eval: the usual arithmetic
+operators (with both `^` and `**` for powers), comparisons, `and`/`or`/`not`, the constants `PI`
+and `E` and the functions in `FUNCTIONS`.
+'''
+
+import ast
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from logging_config import get_logger
+from maths.recipes import operation
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+logger = get_logger(__name__)
+
+# Number of elements per block. 16k float64 values (128 kB) per buffer keeps the working set of a
+# typical expression within the L2 cache.
+BLOCK_SIZE = 1 << 14
+# Arrays shorter than this are evaluated on the calling thread.
+MIN_PARALLEL_SIZE = 1 << 18
+MAX_THREADS = min(8, os.cpu_count() or 1)
+
+CONSTANTS = {'PI': math.pi, 'E': math.e}
+
+
+def _where(cond, a, b, out):
+    np.copyto(out, b)
+    np.copyto(out, a, where=cond.astype(bool, copy=False) if isinstance(cond, np.ndarray) else bool(cond))
+    return out
+
+
+def _log(x, base=None, out=None):
+    np.log(x, out=out)
+    if base is not None:
+        np.divide(out, np.log(base), out=out)
+    return out
+
+
+class _UfuncCall(object):
+    """ Calls an element-wise NumPy ufunc, writing the result into `out`. """
+
+    def __init__(self, func):
+        self._func = func
+
+    def __call__(self, *args, out):
+        return self._func(*args, out=out)
+
+
+# name: (implementation, numexpr name or None, allowed argument counts)
+FUNCTIONS = {
+    'sin': (_UfuncCall(np.sin), 'sin', (1,)),
+    'cos': (_UfuncCall(np.cos), 'cos', (1,)),
+    'tan': (_UfuncCall(np.tan), 'tan', (1,)),
+    'asin': (_UfuncCall(np.arcsin), 'arcsin', (1,)),
+    'acos': (_UfuncCall(np.arccos), 'arccos', (1,)),
+    'atan': (_UfuncCall(np.arctan), 'arctan', (1,)),
+    'atan2': (_UfuncCall(np.arctan2), 'arctan2', (2,)),
+    'sinh': (_UfuncCall(np.sinh), 'sinh', (1,)),
+    'cosh': (_UfuncCall(np.cosh), 'cosh', (1,)),
+    'tanh': (_UfuncCall(np.tanh), 'tanh', (1,)),
+    'sqrt': (_UfuncCall(np.sqrt), 'sqrt', (1,)),
+    'exp': (_UfuncCall(np.exp), 'exp', (1,)),
+    'log': (_log, None, (1, 2)),
+    'abs': (_UfuncCall(np.abs), 'abs', (1,)),
+    'ceil': (_UfuncCall(np.ceil), None, (1,)),
+    'floor': (_UfuncCall(np.floor), None, (1,)),
+    'round': (_UfuncCall(np.rint), None, (1,)),
+    'min': (_UfuncCall(np.minimum), None, (2,)),
+    'max': (_UfuncCall(np.maximum), None, (2,)),
+    'pow': (_UfuncCall(np.power), None, (2,)),
+    # `if(condition, a, b)`. 'if' is a reserved word in Python, so it is renamed before parsing.
+    'where': (_where, None, (3,)),
+}
+
+_BIN_OPS = {
+    ast.Add: (np.add, '+'),
+    ast.Sub: (np.subtract, '-'),
+    ast.Mult: (np.multiply, '*'),
+    ast.Div: (np.true_divide, '/'),
+    ast.Mod: (np.mod, '%'),
+    ast.Pow: (np.power, '**'),
+}
+
+_COMPARE_OPS = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+_BOOL_OPS = {
+    ast.And: np.logical_and,
+    ast.Or: np.logical_or,
+}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+class _Compiler(object):
+    """
+        Turns a Python AST into a list of instructions `(func, args, out_slot)`.
+
+        Arguments are ('var', name), ('const', value) or ('tmp', slot). Temporary slots are
+        recycled as soon as their value has been consumed, so the number of scratch buffers is the
+        maximum number of intermediate results that are alive at the same time.
+    """
+
+    def __init__(self):
+        self.program = []
+        self.variables = []
+        self.n_slots = 0
+        self._free = []
+        self.numexpr_ok = True
+
+    def _alloc(self):
+        if self._free:
+            return self._free.pop()
+        self.n_slots += 1
+        return self.n_slots - 1
+
+    def _release(self, *args):
+        for kind, value in args:
+            if kind == 'tmp':
+                self._free.append(value)
+
+    def _emit(self, func, args, elementwise=True):
+        # A ufunc can safely write over one of its inputs. Other functions might read an input
+        # after the output has been (partially) written, so they always get a fresh slot.
+        if elementwise:
+            self._release(*args)
+            slot = self._alloc()
+        else:
+            slot = self._alloc()
+            self._release(*args)
+        self.program.append((func, args, slot))
+        return ('tmp', slot)
+
+    def visit(self, node):
+        """ Returns (argument, numexpr source) for `node`. """
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return ('const', float(node.value)), repr(float(node.value))
+
+        if isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                return ('const', CONSTANTS[node.id]), repr(CONSTANTS[node.id])
+            if node.id not in self.variables:
+                self.variables.append(node.id)
+            return ('var', node.id), node.id
+
+        if isinstance(node, ast.UnaryOp):
+            operand, src = self.visit(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand, src
+            if isinstance(node.op, ast.USub):
+                return self._emit(_UfuncCall(np.negative), (operand,)), f"(-{src})"
+            if isinstance(node.op, ast.Not):
+                self.numexpr_ok = False
+                return self._emit(_UfuncCall(np.logical_not), (operand,)), ""
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+            func, op = _BIN_OPS[type(node.op)]
+            left, l_src = self.visit(node.left)
+            right, r_src = self.visit(node.right)
+            return self._emit(_UfuncCall(func), (left, right)), f"({l_src} {op} {r_src})"
+
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARE_OPS:
+            # Logical expressions are always evaluated with NumPy since numexpr is strict about
+            # mixing booleans and numbers.
+            self.numexpr_ok = False
+            left, _ = self.visit(node.left)
+            right, _ = self.visit(node.comparators[0])
+            return self._emit(_UfuncCall(_COMPARE_OPS[type(node.ops[0])]), (left, right)), ""
+
+        if isinstance(node, ast.BoolOp) and type(node.op) in _BOOL_OPS:
+            self.numexpr_ok = False
+            func = _UfuncCall(_BOOL_OPS[type(node.op)])
+            arg, _ = self.visit(node.values[0])
+            for value in node.values[1:]:
+                rhs, _ = self.visit(value)
+                arg = self._emit(func, (arg, rhs))
+            return arg, ""
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name = node.func.id
+            if name not in FUNCTIONS:
+                raise ExpressionError(f"Unknown function '{name}'. Available functions: "
+                                      + ", ".join(sorted(FUNCTIONS)))
+            func, ne_name, n_args = FUNCTIONS[name]
+            if len(node.args) not in n_args:
+                raise ExpressionError(f"'{name}' takes {' or '.join(map(str, n_args))} argument(s)")
+            visited = [self.visit(arg) for arg in node.args]
+            args = tuple(arg for arg, _ in visited)
+            if ne_name is None:
+                self.numexpr_ok = False
+                src = ""
+            else:
+                src = f"{ne_name}({', '.join(s for _, s in visited)})"
+            return self._emit(func, args, elementwise=isinstance(func, _UfuncCall)), src
+
+        raise ExpressionError(f"Unsupported syntax: '{ast.unparse(node)}'")
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="expression")
+    return _executor
+
+
+class CompiledExpression(object):
+    def __init__(self, text):
+        self._text = text
+        try:
+            tree = ast.parse(self._to_python_syntax(text), mode='eval')
+        except SyntaxError as ex:
+            raise ExpressionError(f"Invalid expression '{text}': {ex.msg}") from ex
+
+        compiler = _Compiler()
+        self._result, self._numexpr_src = compiler.visit(tree)
+        self._program = compiler.program
+        self._n_slots = compiler.n_slots
+        self._variables = compiler.variables
+        self._use_numexpr = numexpr is not None and compiler.numexpr_ok
+
+    @staticmethod
+    def _to_python_syntax(text):
+        # '^' is a power in py_expression_eval syntax (and binds tighter than the other operators,
+        # like '**'). 'if' is a reserved word in Python.
+        text = text.strip().replace('^', '**')
+        return re.sub(r'\bif\s*\(', 'where(', text)
+
+    @property
+    def text(self):
+        return self._text
+
+    def variables(self):
+        """ Names of the variables used in the expression, in order of appearance. """
+        return list(self._variables)
+
+    def evaluate(self, values, out=None):
+        """ Evaluate the expression for the supplied {name: array} values. Returns a float64 array. """
+        missing = set(self._variables).difference(values)
+        if missing:
+            raise ExpressionError(f"No value supplied for: {', '.join(sorted(missing))}")
+        if not self._variables:
+            raise ExpressionError("The expression must use at least one variable")
+
+        arrays = {name: np.asarray(values[name]) for name in self._variables}
+        lengths = {len(a) for a in arrays.values()}
+        if len(lengths) != 1:
+            raise ExpressionError("All variables in the expression must have the same length")
+        n = lengths.pop()
+
+        if out is None:
+            out = np.empty(n, dtype=np.float64)
+
+        if self._use_numexpr:
+            numexpr.evaluate(self._numexpr_src, local_dict=arrays, out=out, casting='unsafe')
+            return out
+
+        if self._result[0] != 'tmp':
+            # The expression is a single variable or constant.
+            out[:] = self._resolve(self._result, arrays, None, 0, n)
+            return out
+
+        n_threads = min(MAX_THREADS, max(1, n // MIN_PARALLEL_SIZE))
+        if n_threads == 1:
+            self._run(arrays, out, 0, n)
+            return out
+
+        # Give each thread an equal, block aligned, contiguous share of the array.
+        n_blocks = -(-n // BLOCK_SIZE)
+        bounds = [min(n, (n_blocks * i // n_threads) * BLOCK_SIZE) for i in range(n_threads + 1)]
+        futures = [_get_executor().submit(self._run, arrays, out, start, end)
+                   for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        for future in futures:
+            future.result()
+        return out
+
+    @staticmethod
+    def _resolve(arg, arrays, buffers, start, end):
+        kind, value = arg
+        if kind == 'var':
+            return arrays[value][start:end]
+        if kind == 'const':
+            return value
+        return buffers[value][:end - start]
+
+    def _run(self, arrays, out, start, end):
+        buffers = [np.empty(BLOCK_SIZE, dtype=np.float64) for _ in range(self._n_slots)]
+        last = len(self._program) - 1
+        for block_start in range(start, end, BLOCK_SIZE):
+            block_end = min(block_start + BLOCK_SIZE, end)
+            size = block_end - block_start
+            for idx, (func, args, slot) in enumerate(self._program):
+                resolved = [self._resolve(arg, arrays, buffers, block_start, block_end) for arg in args]
+                # The final instruction writes straight into the output array.
+                target = out[block_start:block_end] if idx == last else buffers[slot][:size]
+                func(*resolved, out=target)
+
+
+def compile_expression(text):
+    """ Parse and compile `text`. Raises ExpressionError if the expression isn't valid. """
+    return CompiledExpression(text)
+
+
+@operation("expression")
+def evaluate_expression(inputs, tb, text, variables):
+    """ Recipe operation: `inputs` are the values of `variables`, in order. """
+    return compile_expression(text).evaluate(dict(zip(variables, inputs)))
@@ -1,6 +1,6 @@
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QSpinBox, QComboBox, QDoubleSpinBox, QCheckBox, QFormLayout, \
-    QDialogButtonBox
+    QDialogButtonBox, QLineEdit
 
 try:
     from PyQt5.QtGui import QDialog
@@ -8,9 +8,11 @@ except ImportError:
     from PyQt5.QtWidgets import QDialog
 
 from dataclasses import dataclass
-from scipy import signal
+import fnmatch
 
 from maths.maths_base import MathSpecBase
+from maths import filter_engine
+from maths.recipes import operation
 
 
 @dataclass
@@ -21,11 +23,19 @@ class FilterParams:
     filtfilt: bool
 
 
+@operation("filter", batched=True)
+def butter_filter(inputs, tb, order, type, cutoff, filtfilt):
+    data, = inputs
+    return filter_engine.apply_filter(data, tb, order, type, cutoff, filtfilt)
+
+
 class FilterSpec(MathSpecBase):
-    filter_types = ("low", "high")
+    filter_types = filter_engine.FILTER_TYPES
+    operation = "filter"
 
     def __init__(self, parent):
         MathSpecBase.__init__(self, parent=parent, name="filter")
+        self._pattern = ""
 
     def button_callback(self, checked):
         self.create_message_box()
@@ -54,6 +64,10 @@ class FilterSpec(MathSpecBase):
         form.addRow("cutoff [hz]", filt_cutoff)
         filt_filt = QCheckBox("filt-filt")
         form.addRow(filt_filt)
+        # Filter many signals at once, e.g. "joint_*_vel".
+        var_pattern = QLineEdit(self._pattern)
+        var_pattern.setPlaceholderText("selected variable, or a wildcard pattern")
+        form.addRow("variables", var_pattern)
 
         # Add some standard buttons (Cancel/Ok) at the bottom of the dialog
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
@@ -62,24 +76,44 @@ class FilterSpec(MathSpecBase):
         button_box.accepted.connect(param_dialog.accept)
         button_box.rejected.connect(param_dialog.reject)
 
+        def read_params():
+            return FilterParams(filt_order.value(), filt_types.currentText(),
+                                filt_cutoff.value(), filt_filt.isChecked())
+
+        self.connect_preview(param_dialog, read_params,
+                             (filt_order.valueChanged, filt_types.currentIndexChanged,
+                              filt_cutoff.valueChanged, filt_filt.toggled))
+
         # Show the dialog as modal
         if param_dialog.exec() == QDialog.Accepted:
             # This is where the various values should be collected and stored.
-            self._params = FilterParams(filt_order.value(), filt_types.currentText(),
-                                        filt_cutoff.value(), filt_filt.isChecked())
+            self._params = read_params()
+            self._pattern = var_pattern.text().strip()
 
             return True
 
         return False
 
-    def do_math(self, data, dt):
-        fs = 1 / dt
-        Wn = self._params.cutoff / (0.5 * fs)
-        b, a = signal.butter(self._params.order, Wn, btype=self._params.type)
-        if self._params.filtfilt:
-            return signal.filtfilt(b, a, data.data, method='gust')
-        else:
-            return signal.lfilter(b, a, data.data)
+    def recipe_params(self):
+        return dict(order=self._params.order, type=self._params.type,
+                    cutoff=self._params.cutoff, filtfilt=self._params.filtfilt)
+
+    def preview_margin(self, params, tb):
+        # A few time constants of the filter.
+        if params['cutoff'] <= 0:
+            return 0.
+        return 3. * params['order'] / params['cutoff']
+
+    def preview_params(self, params, stride, dt):
+        # Decimating is fine as long as the cutoff stays well below the Nyquist frequency.
+        if params['type'] == "low" and params['cutoff'] < 0.2 / (stride * dt):
+            return params
+        return None
+
+    def selected_var_names(self, selected, model):
+        if not self._pattern:
+            return [selected.var_name]
+        return fnmatch.filter(model.get_variable_names(), self._pattern)
 
     def default_var_name(self, vname):
         return f"Filter({vname},{self._params.order},{self._params.type},{self._params.cutoff})"
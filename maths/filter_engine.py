@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+Butterworth filtering of many signals at once.
+
+Filters are designed as second-order sections, which stay numerically stable for high orders where
+the (b, a) polynomial form does not, and designs are cached. A 2-D block of signals (one column per
+signal) is split into chunks of columns that are filtered on worker threads; SciPy releases the
+GIL while filtering, so the chunks run in parallel.
+
+Logs that aren't uniformly sampled are linearly resampled onto a uniform grid (with the median
+sample period) before filtering and back onto their own timestamps afterwards.
+'''
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import os
+import threading
+
+import numpy as np
+from scipy import signal
+
+from logging_config import get_logger
+from maths import resample
+import timebase
+
+logger = get_logger(__name__)
+
+FILTER_TYPES = ("low", "high")
+MAX_THREADS = min(8, os.cpu_count() or 1)
+# Blocks with fewer samples than this (in total) are filtered on the calling thread.
+MIN_PARALLEL_SIZE = 1 << 20
+
+
+@lru_cache(maxsize=64)
+def design_sos(order, btype, cutoff, fs):
+    """ Second-order sections of a Butterworth filter. The result is shared; don't modify it. """
+    sos = signal.butter(order, cutoff, btype=btype, fs=fs, output='sos')
+    return sos
+
+
+def _filter_chunk(sos, data, filtfilt):
+    if filtfilt:
+        return signal.sosfiltfilt(sos, data, axis=0)
+    return signal.sosfilt(sos, data, axis=0)
+
+
+def filter_columns(sos, data, filtfilt=False, max_threads=None):
+    """ Filter every column of `data` (or a 1-D signal) with the second-order sections `sos`. """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1 or data.size < MIN_PARALLEL_SIZE:
+        return _filter_chunk(sos, data, filtfilt)
+
+    n_cols = data.shape[1]
+    n_threads = min(max_threads or MAX_THREADS, n_cols)
+    if n_threads <= 1:
+        return _filter_chunk(sos, data, filtfilt)
+
+    out = np.empty(data.shape)
+    bounds = np.linspace(0, n_cols, n_threads + 1).astype(int)
+
+    def run(i):
+        lo, hi = bounds[i], bounds[i + 1]
+        out[:, lo:hi] = _filter_chunk(sos, data[:, lo:hi], filtfilt)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(run, range(n_threads)))
+    return out
+
+
+# Uniform grids of the last few non-uniform timebases. Reusing the grid object lets
+# `maths.resample` reuse its cached mappings as well.
+_grids = OrderedDict()
+_grids_lock = threading.Lock()
+_MAX_GRIDS = 8
+
+
+def _uniform_grid(tb):
+    with _grids_lock:
+        entry = _grids.get(id(tb))
+        if entry is not None and entry[0] is tb:
+            return entry[1]
+
+    time = tb.array()
+    dt = float(np.median(np.diff(time)))
+    grid = timebase.UniformTimebase(tb.t0, dt, int(np.floor((tb.t_max - tb.t0) / dt + 1e-9)) + 1)
+    with _grids_lock:
+        _grids[id(tb)] = (tb, grid)
+        while len(_grids) > _MAX_GRIDS:
+            _grids.popitem(last=False)
+    return grid
+
+
+def apply_filter(data, tb, order, type, cutoff, filtfilt):
+    """
+        Filter `data` (a signal or a block of columns) sampled on the timebase `tb`. The cutoff
+        frequency is in Hz.
+    """
+    if tb.is_uniform or len(tb) < 2:
+        sos = design_sos(order, type, cutoff, 1. / tb.avg_dt)
+        return filter_columns(sos, data, filtfilt)
+
+    grid = _uniform_grid(tb)
+    logger.debug(f"Resampling {len(tb)} non-uniform samples onto {len(grid)} samples for filtering")
+    sos = design_sos(order, type, cutoff, 1. / grid.dt)
+    uniform = resample.resample(data, tb, grid, resample.LINEAR)
+    return resample.resample(filter_columns(sos, uniform, filtfilt), grid, tb, resample.LINEAR)
@@ -6,13 +6,20 @@ from PyQt5.QtGui import QMouseEvent, QKeyEvent
 
 import abc
 
-from data_model import DataItem
+from logging_config import get_logger
+from math_preview import MathPreview
+from maths.recipes import Recipe
 from var_list_widget import VarListWidget
 
+logger = get_logger(__name__)
+
 
 class MathSpecBase(QObject):
     __metaclass__ = abc.ABCMeta
 
+    # Name of the recipe operation (see `maths.recipes`) implemented by this spec.
+    operation = None
+
     def __init__(self, parent, name):
         QObject.__init__(self, parent=parent)
 
@@ -22,6 +29,9 @@ class MathSpecBase(QObject):
         self.button.clicked.connect(self.button_callback)
 
         self._msg_box = None
+        # (source, var_name) of the variable being worked on while the parameters are chosen.
+        self._preview_target = None
+        self._preview = None
 
     @property
     def name(self):
@@ -36,13 +46,50 @@ class MathSpecBase(QObject):
         pass
 
     @abc.abstractmethod
-    def do_math(self, data, dt):
+    def recipe_params(self):
+        """ Parameters of the recipe operation, as selected in `get_params`. """
         pass
 
     @abc.abstractmethod
     def default_var_name(self, vname):
         pass
 
+    def preview_margin(self, params, tb):
+        """ Seconds of data around the view needed for a preview to settle (None for all before). """
+        return 0.
+
+    def preview_params(self, params, stride, dt):
+        """ `params` for the input decimated by `stride`, or None if every sample is needed. """
+        return None
+
+    def connect_preview(self, dialog, read_params, signals):
+        """
+            Show a live preview on the plot while `dialog` is open. `read_params` returns the
+            parameters shown by the dialog and `signals` are emitted when they change.
+        """
+        plot_manager = getattr(self.parent(), 'plot_manager', None)
+        if self._preview_target is None or plot_manager is None:
+            return
+        source, var_name = self._preview_target
+        subplot = plot_manager.preview_subplot(var_name, source.model())
+        if subplot is None:
+            return
+        preview = MathPreview(subplot, source, var_name, self)
+
+        def update(*args):
+            self._params = read_params()
+            preview.update(self.recipe_params())
+
+        for sig in signals:
+            sig.connect(update)
+        dialog.finished.connect(lambda _: preview.remove())
+        self._preview = preview
+        update()
+
+    def selected_var_names(self, selected, model):
+        """ Variables the operation is applied to. Specs may select several, e.g. by pattern. """
+        return [selected.var_name]
+
     def create_message_box(self):
         self._msg_box = QMessageBox(self.parent())
         self._msg_box.setWindowTitle(self._name)
@@ -71,8 +118,18 @@ class MathSpecBase(QObject):
                 self._msg_box.close()
                 self._msg_box = None
 
-            if self.get_params():
-                val = self.do_math(selected, vlist.model().avg_dt)
+            self._preview_target = (vlist, selected.var_name)
+            has_params = self.get_params()
+            self._preview_target = None
+            self._preview = None
+            if has_params:
+                var_names = self.selected_var_names(selected, vlist.model())
+                if len(var_names) != 1 or var_names[0] != selected.var_name:
+                    self.add_many_vars(var_names, vlist)
+                    return super().eventFilter(obj, event)
+
+                # The variable is stored as a recipe and only computed when it is first used.
+                recipe = Recipe(self.operation, self.recipe_params(), ((None, selected.var_name),))
 
                 # Loop until user provides a unique name or cancels
                 default_vname = self.default_var_name(selected.var_name)
@@ -92,11 +149,29 @@ class MathSpecBase(QObject):
                         continue
                     else:
                         # Name is unique, create the variable
-                        data_item = DataItem(vname, val)
-                        data_item._time = selected._time
-                        self.parent().add_new_var(data_item, vlist)
+                        self.parent().add_new_var(vname, recipe, vlist)
                         break
             else:
                 print("User cancelled operation!")
 
         return super().eventFilter(obj, event)
+
+    def add_many_vars(self, var_names, vlist):
+        """ Apply the operation to each of `var_names`, using the default names for the results. """
+        model = vlist.model()
+        params = self.recipe_params()
+        added = []
+        for var_name in var_names:
+            vname = self.default_var_name(var_name)
+            if model.has_variable(vname):
+                logger.warning(f"Variable name '{vname}' already exists. Skipping '{var_name}'.")
+                continue
+            self.parent().add_new_var(vname, Recipe(self.operation, params, ((None, var_name),)), vlist,
+                                      materialize=False)
+            added.append(vname)
+        if not added:
+            logger.warning(f"No variables were added by {self._name}")
+            return
+        logger.info(f"Added {len(added)} variables with {self._name}")
+        # Compute them together in the background (batched operations use a single call).
+        self.parent().materialize_vars(added, vlist)
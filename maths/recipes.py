@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+'''
+Derived variables stored as recipes.
+
+A recipe is an operation name, its parameters and the variables it reads. `DerivedGraph` keeps the
+recipes of one `DataModel` together with the edges to the variables they depend on. A derived
+variable is only computed the first time its data is requested and the result is memoized.
+
+Memoized values are dropped when one of their inputs changes (a time offset only matters to
+recipes that resample variables from another source) and, least recently used first, whenever the
+memoized values of all sources together exceed `cache_limit()`. Either way the value is simply
+recomputed from its recipe the next time it is needed.
+
+When samples are appended to a model, memoized values are extended incrementally where the
+operation allows it (see `maths.streaming`) instead of being dropped.
+
+Values of recipes over data loaded from a file are also kept in the on-disk cache of
+`maths.derived_cache` (when it is enabled), so reopening a log doesn't recompute them.
+'''
+
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import importlib
+import os
+import threading
+
+import numpy as np
+
+from logging_config import get_logger
+from maths import derived_cache, resample
+
+logger = get_logger(__name__)
+
+# Operations available to recipes, by name. Each one is called as `fn(inputs, timebase, **params)`
+# where `inputs` are the input arrays, already sampled on `timebase`.
+OPERATIONS = {}
+# Single-input operations that also accept a 2-D block with one signal per column. Recipes that
+# only differ by their input are then evaluated together.
+BATCHED_OPERATIONS = set()
+
+# Modules that register the built-in operations. They are imported on first use.
+_BUILTIN_OPERATION_MODULES = ("maths.diff_int", "maths.filter", "maths.running_window",
+                              "maths.running_minmax", "maths.expression", "kinematics")
+
+
+def operation(name, batched=False):
+    """ Decorator registering `fn` as the recipe operation `name`. """
+    def register(fn):
+        OPERATIONS[name] = fn
+        if batched:
+            BATCHED_OPERATIONS.add(name)
+        return fn
+    return register
+
+
+def get_operation(name):
+    if name not in OPERATIONS:
+        for module in _BUILTIN_OPERATION_MODULES:
+            importlib.import_module(module)
+    try:
+        return OPERATIONS[name]
+    except KeyError:
+        raise ValueError(f"Unknown operation '{name}'") from None
+
+
+@dataclass
+class Recipe:
+    operation: str
+    params: dict = field(default_factory=dict)
+    # (DataModel, var_name) pairs. A model of None refers to the model the recipe belongs to.
+    inputs: tuple = ()
+    # How inputs from other models are brought onto the timebase of the recipe's model.
+    resample: str = resample.HOLD
+
+
+def recipe_to_dict(recipe, file_of_model=None):
+    """
+        A JSON-friendly description of `recipe` (e.g. for plotlists). Inputs from the recipe's own
+        model are stored by name; `file_of_model` maps the models of other inputs to an identifier
+        understood by `recipe_from_dict`.
+    """
+    inputs = []
+    for model, var_name in recipe.inputs:
+        if model is None:
+            inputs.append(var_name)
+        elif file_of_model is None:
+            raise ValueError(f"Input '{var_name}' is from another file which can't be referenced")
+        else:
+            inputs.append({'var': var_name, 'file': file_of_model(model)})
+    return {'operation': recipe.operation, 'params': dict(recipe.params), 'inputs': inputs,
+            'resample': recipe.resample}
+
+
+def recipe_from_dict(spec, model_of_file=None):
+    inputs = []
+    for entry in spec['inputs']:
+        if isinstance(entry, str):
+            inputs.append((None, entry))
+        elif model_of_file is None:
+            raise ValueError(f"Input '{entry['var']}' is from another file which can't be resolved")
+        else:
+            inputs.append((model_of_file(entry['file']), entry['var']))
+    return Recipe(spec['operation'], dict(spec.get('params', {})), tuple(inputs),
+                  spec.get('resample', resample.HOLD))
+
+
+def _default_cache_limit():
+    # A quarter of the physical memory, if we can find out how much there is.
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 4
+    except (AttributeError, ValueError, OSError):
+        return 1 << 30
+
+
+class _MemoCache(object):
+    """ Least-recently-used bookkeeping of the memoized values of all graphs. """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.limit = _default_cache_limit()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def touch(self, graph, name):
+        with self._lock:
+            if (graph, name) in self._entries:
+                self._entries.move_to_end((graph, name))
+
+    def add(self, graph, name, nbytes):
+        with self._lock:
+            self._nbytes += nbytes - self._entries.pop((graph, name), 0)
+            self._entries[(graph, name)] = nbytes
+            evict = []
+            while self._nbytes > self.limit and len(self._entries) > 1:
+                key, size = self._entries.popitem(last=False)
+                self._nbytes -= size
+                evict.append(key)
+        for victim_graph, victim_name in evict:
+            logger.debug(f"Evicting the memoized value of '{victim_name}'")
+            victim_graph._drop_value(victim_name)
+
+    def discard(self, graph, name):
+        with self._lock:
+            self._nbytes -= self._entries.pop((graph, name), 0)
+
+
+_memo = _MemoCache()
+
+
+def cache_limit():
+    return _memo.limit
+
+
+def set_cache_limit(nbytes):
+    """ The total size of memoized derived variables (all sources) before the oldest are evicted. """
+    _memo.limit = int(nbytes)
+
+
+def memoized_bytes():
+    return _memo.nbytes
+
+
+class DerivedGraph(object):
+    """
+        The recipes of the derived variables of one `DataModel`.
+
+        `on_invalidated` is called with the name of every derived variable whose memoized value was
+        dropped because one of its inputs changed.
+    """
+
+    def __init__(self, model, on_invalidated=None):
+        self._model = model
+        self._on_invalidated = on_invalidated
+        self._recipes = {}
+        self._values = {}
+        # Bumped on invalidation so a value computed from stale inputs is not memoized.
+        self._generation = defaultdict(int)
+        # var_name -> {(graph, name)} of the recipes that read `var_name` from this model.
+        self._dependents = defaultdict(set)
+        # (graph, name) of the recipes that resample between this model and another one.
+        self._time_dependents = set()
+        # name -> (incremental operator, AppendBuffer, timebase was uniform) of the values that
+        # were extended after samples were appended to the model.
+        self._streams = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self._recipes
+
+    def names(self):
+        return list(self._recipes)
+
+    def recipe(self, name):
+        return self._recipes.get(name)
+
+    def is_memoized(self, name):
+        return name in self._values
+
+    def dependencies(self, names):
+        """ `names` and the derived variables of this graph they depend on, dependencies first. """
+        ordered = []
+
+        def visit(name):
+            if name in ordered or name not in self._recipes:
+                return
+            for model, var_name in self._recipes[name].inputs:
+                if self._input_graph(model) is self:
+                    visit(var_name)
+            ordered.append(name)
+
+        for name in names:
+            visit(name)
+        return ordered
+
+    def materialize(self, names, max_workers=None):
+        """
+            Compute the values of `names` (and the variables they depend on) that aren't memoized.
+
+            Variables are evaluated in waves on a thread pool: every variable in a wave only
+            depends on raw data or on variables of earlier waves, so nothing is computed twice.
+            Within a wave, recipes of a batched operation with the same parameters are evaluated
+            in a single call.
+        """
+        depth = {}
+        for name in self.dependencies(names):
+            if self.is_memoized(name):
+                depth[name] = -1
+                continue
+            depth[name] = 1 + max((depth.get(var_name, -1) for model, var_name in self._recipes[name].inputs
+                                   if self._input_graph(model) is self), default=-1)
+        waves = defaultdict(list)
+        for name, d in depth.items():
+            if d >= 0:
+                waves[d].append(name)
+        if not waves:
+            return
+
+        max_workers = max_workers or min(8, os.cpu_count() or 1)
+        logger.debug(f"Materializing {sum(len(w) for w in waves.values())} derived variables in {len(waves)} waves")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for d in sorted(waves):
+                futures = []
+                for names in self._batches(waves[d]):
+                    if len(names) > 1:
+                        futures.append(executor.submit(self._evaluate_batch, names))
+                    else:
+                        futures.append(executor.submit(self.value, names[0]))
+                # Wait for the wave, raising any error here.
+                for future in futures:
+                    future.result()
+
+    def _batches(self, names):
+        groups = defaultdict(list)
+        for name in names:
+            recipe = self._recipes[name]
+            if (recipe.operation in BATCHED_OPERATIONS and len(recipe.inputs) == 1
+                    and self._input_graph(recipe.inputs[0][0]) is self):
+                groups[(recipe.operation, repr(sorted(recipe.params.items())))].append(name)
+            else:
+                groups[name].append(name)
+        return list(groups.values())
+
+    def _input_graph(self, model):
+        return self if model is None or model is self._model else model._derived_graph
+
+    def add(self, name, recipe):
+        with self._lock:
+            self._recipes[name] = recipe
+        for model, var_name in recipe.inputs:
+            graph = self._input_graph(model)
+            with graph._lock:
+                graph._dependents[var_name].add((self, name))
+                if graph is not self:
+                    graph._time_dependents.add((self, name))
+                    self._time_dependents.add((self, name))
+
+    def remove(self, name):
+        """
+            Remove the recipe of `name`. The values of the recipes that depend on it are dropped:
+            they can't be evaluated until a variable called `name` is added again.
+        """
+        with self._lock:
+            recipe = self._recipes.pop(name, None)
+            self._generation[name] += 1
+            self._drop_value(name)
+        if recipe is None:
+            return
+        for model, var_name in recipe.inputs:
+            graph = self._input_graph(model)
+            with graph._lock:
+                graph._dependents[var_name].discard((self, name))
+                graph._time_dependents.discard((self, name))
+        self._time_dependents.discard((self, name))
+        self.invalidate(name)
+
+    def value(self, name):
+        """ The data of derived variable `name`, computed from its recipe if it isn't memoized. """
+        with self._lock:
+            value = self._values.get(name)
+            generation = self._generation[name]
+            recipe = self._recipes[name]
+        if value is not None:
+            _memo.touch(self, name)
+            return value
+
+        return self._store(name, self._evaluate(name, recipe), generation)
+
+    def preset(self, name, value):
+        """ Memoize a value of `name` that was computed elsewhere (e.g. in a worker process). """
+        with self._lock:
+            generation = self._generation[name]
+        value = np.asarray(value)
+        self._save_to_disk(name, value)
+        return self._store(name, value, generation)
+
+    def _store(self, name, value, generation):
+        with self._lock:
+            if self._generation[name] != generation or name not in self._recipes:
+                # The inputs changed while we were busy. Hand out the value but don't keep it.
+                return value
+            self._values[name] = value
+        _memo.add(self, name, value.nbytes)
+        return value
+
+    def _cache_key(self, name):
+        """ Identifies the value of `name` in the on-disk cache, or None if it can't be cached. """
+        fingerprint = getattr(self._model, 'source_fingerprint', None)
+        recipe = self._recipes.get(name)
+        if fingerprint is None or recipe is None:
+            return None
+        inputs = []
+        for model, var_name in recipe.inputs:
+            graph = self._input_graph(model)
+            key = graph._cache_key(var_name) if var_name in graph else var_name
+            if key is None:
+                return None
+            if graph is not self:
+                other_fingerprint = getattr(graph._model, 'source_fingerprint', None)
+                if other_fingerprint is None:
+                    return None
+                offset = graph._model.time_offset - self._model.time_offset
+                key = (other_fingerprint, key, offset, recipe.resample)
+            inputs.append(key)
+        return (fingerprint, recipe.operation, tuple(sorted(recipe.params.items())), tuple(inputs))
+
+    def _load_from_disk(self, name):
+        cache = derived_cache.get_cache()
+        key = None if cache is None else self._cache_key(name)
+        if key is None:
+            return None
+        value = cache.get(key)
+        if value is not None and len(value) != len(self._model.timebase):
+            return None
+        if value is not None:
+            logger.debug(f"Loaded '{name}' from the derived cache")
+        return value
+
+    def _save_to_disk(self, name, value):
+        cache = derived_cache.get_cache()
+        key = None if cache is None else self._cache_key(name)
+        if key is not None:
+            cache.put(key, value)
+
+    def _evaluate(self, name, recipe):
+        value = self._load_from_disk(name)
+        if value is not None:
+            return value
+        fn = get_operation(recipe.operation)
+        inputs = self._gather_inputs(name, recipe)
+        logger.debug(f"Evaluating '{name}' ({recipe.operation})")
+        value = np.asarray(fn(inputs, self._model.timebase, **recipe.params))
+        self._save_to_disk(name, value)
+        return value
+
+    def _evaluate_batch(self, names):
+        """ Evaluate single-input recipes that share their operation and parameters in one call. """
+        recipe = self._recipes[names[0]]
+        fn = get_operation(recipe.operation)
+        with self._lock:
+            generations = [self._generation[name] for name in names]
+        remaining = []
+        for name, generation in zip(names, generations):
+            value = self._load_from_disk(name)
+            if value is None:
+                remaining.append((name, generation))
+            else:
+                self._store(name, value, generation)
+        if not remaining:
+            return
+        names, generations = zip(*remaining)
+        block = np.column_stack([self._gather_inputs(name, self._recipes[name])[0] for name in names])
+        logger.debug(f"Evaluating {len(names)} variables at once ({recipe.operation})")
+        result = np.asarray(fn([block], self._model.timebase, **recipe.params))
+        for j, (name, generation) in enumerate(zip(names, generations)):
+            value = np.ascontiguousarray(result[:, j])
+            self._save_to_disk(name, value)
+            self._store(name, value, generation)
+
+    def _gather_inputs(self, name, recipe):
+        reference_tb = self._model.timebase
+        inputs = []
+        for model, var_name in recipe.inputs:
+            graph = self._input_graph(model)
+            model = self._model if model is None else model
+            # Recipes are read through their graph so that their evaluation errors propagate.
+            data = graph.value(var_name) if var_name in graph else model.get_data_by_name(var_name)
+            if data is None:
+                raise KeyError(f"'{name}' depends on unknown variable '{var_name}'")
+            data = np.asarray(data)
+            if model is not self._model:
+                data = resample.resample(data, model.timebase, reference_tb, recipe.resample)
+            inputs.append(data)
+        return inputs
+
+    def _drop_value(self, name):
+        with self._lock:
+            self._values.pop(name, None)
+            self._streams.pop(name, None)
+        _memo.discard(self, name)
+
+    def invalidate(self, var_name):
+        """ Drop the memoized values that depend on `var_name` (raw or derived) of this model. """
+        with self._lock:
+            if var_name in self._recipes:
+                self._generation[var_name] += 1
+                self._drop_value(var_name)
+            dependents = list(self._dependents.get(var_name, ()))
+        if var_name in self._recipes and self._on_invalidated is not None:
+            self._on_invalidated(var_name)
+        for graph, name in dependents:
+            graph.invalidate(name)
+
+    def extend(self, n_old):
+        """
+            Samples were appended to the model after its first `n_old` ticks. Memoized values are
+            extended incrementally where their operation allows it; the others are dropped.
+        """
+        from maths import streaming
+
+        with self._lock:
+            other_graphs = [(graph, name) for graph, name in self._time_dependents if graph is not self]
+        for graph, name in other_graphs:
+            graph.invalidate(name)
+
+        tb = self._model.timebase
+        # Only the times of the new samples (the operators look up the few older ones they need).
+        time = tb.at(np.arange(n_old, len(tb)))
+        # Variables whose values before `n_old` didn't change while extending them.
+        extended = set()
+        for name in self.dependencies(self.names()):
+            with self._lock:
+                recipe = self._recipes[name]
+                value = self._values.get(name)
+                generation = self._generation[name]
+                stream = self._streams.get(name)
+            if (value is None or any(self._input_graph(model) is not self for model, _ in recipe.inputs)
+                    or any(var in self._recipes and var not in extended for _, var in recipe.inputs)):
+                self.invalidate(name)
+                continue
+
+            inputs = [np.asarray(self._model.get_data_by_name(var)) for _, var in recipe.inputs]
+            try:
+                if stream is None or stream[2] != tb.is_uniform:
+                    op = streaming.create(recipe.operation, recipe.params, tb)
+                    if op is None:
+                        raise NotImplementedError
+                    op.prime([data[:n_old] for data in inputs], tb, value)
+                    stream = (op, streaming.AppendBuffer(value), tb.is_uniform)
+                op, buffer, _ = stream
+                start, values = op.extend([data[n_old:] for data in inputs], time)
+            except NotImplementedError:
+                self.invalidate(name)
+                continue
+            value = buffer.replace_tail(start, values)
+            with self._lock:
+                if self._generation[name] != generation:
+                    continue
+                self._values[name] = value
+                self._streams[name] = stream
+            _memo.add(self, name, value.nbytes)
+            if start is None or start >= n_old:
+                extended.add(name)
+            if self._on_invalidated is not None:
+                self._on_invalidated(name)
+
+    def time_changed(self):
+        """ The time offset of the model changed; recipes that resample across models are stale. """
+        with self._lock:
+            dependents = list(self._time_dependents)
+        for graph, name in dependents:
+            graph.invalidate(name)
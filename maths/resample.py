@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+Resampling of signals onto the timebase of another source.
+
+The mapping from a source timebase onto a reference timebase (an index per reference sample, plus
+an interpolation weight for linear resampling) is computed once with a vectorized `searchsorted`
+(or with plain arithmetic when both timebases are uniform) and cached. Resampling any number of
+signals between the same two sources then only costs a gather per signal.
+'''
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+HOLD = "sample-and-hold"
+LINEAR = "linear"
+METHODS = (HOLD, LINEAR)
+
+# Maximum number of (source, reference, method) mappings kept around.
+MAX_CACHED_MAPPINGS = 16
+
+# See `graph_utils.time_to_tick`.
+_TICK_EPS = 1e-9
+
+
+class ResampleMapping(object):
+    def __init__(self, index, weight=None):
+        self.index = index
+        self.weight = weight
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + (0 if self.weight is None else self.weight.nbytes)
+
+    def apply(self, data):
+        """ Resample `data`: a signal, or a 2-D block with one signal per column. """
+        data = np.asarray(data)
+        if self.weight is None:
+            return np.take(data, self.index, axis=0)
+        lo = np.take(data, self.index, axis=0).astype(np.float64, copy=False)
+        hi = np.take(data, self.index + 1, axis=0)
+        # lo + w * (hi - lo), computed in place.
+        out = np.subtract(hi, lo, dtype=np.float64)
+        out *= self.weight if data.ndim == 1 else self.weight[:, np.newaxis]
+        out += lo
+        return out
+
+
+def _hold_index(source_tb, reference_tb):
+    n = len(source_tb)
+    if source_tb.is_uniform and reference_tb.is_uniform:
+        ticks = (reference_tb.array() - source_tb.t0 + _TICK_EPS) / source_tb.dt
+        index = np.floor(ticks, out=ticks).astype(np.int64)
+    else:
+        index = np.searchsorted(source_tb.array(), reference_tb.array() + _TICK_EPS, side='left') - 1
+    np.clip(index, 0, n - 1, out=index)
+    return index
+
+
+def _linear_mapping(source_tb, reference_tb):
+    n = len(source_tb)
+    if n < 2:
+        return ResampleMapping(np.zeros(len(reference_tb), dtype=np.int64))
+
+    ref_time = reference_tb.array()
+    if source_tb.is_uniform and reference_tb.is_uniform:
+        position = (ref_time - source_tb.t0) / source_tb.dt
+        index = np.floor(position).astype(np.int64)
+        np.clip(index, 0, n - 2, out=index)
+        weight = position - index
+    else:
+        src_time = source_tb.array()
+        index = np.searchsorted(src_time, ref_time, side='right') - 1
+        np.clip(index, 0, n - 2, out=index)
+        t_lo = src_time[index]
+        weight = (ref_time - t_lo) / (src_time[index + 1] - t_lo)
+    # No extrapolation: hold the first/last value outside of the source's time range.
+    np.clip(weight, 0., 1., out=weight)
+    return ResampleMapping(index, weight)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_mapping(source_tb, reference_tb, method=HOLD):
+    """ The (cached) mapping of `source_tb` onto `reference_tb`. """
+    if method not in METHODS:
+        raise ValueError(f"Unknown resampling method '{method}'. Expected one of {METHODS}")
+
+    # Timebases are immutable (a new object is created when a time offset changes), so their
+    # identity is a sufficient key. The cache entry keeps them alive so the ids can't be reused.
+    key = (id(source_tb), id(reference_tb), method)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            return entry[2]
+
+    if method == HOLD:
+        mapping = ResampleMapping(_hold_index(source_tb, reference_tb))
+    else:
+        mapping = _linear_mapping(source_tb, reference_tb)
+    logger.debug(f"Computed {method} mapping of {len(source_tb)} samples onto {len(reference_tb)} samples")
+
+    with _cache_lock:
+        _cache[key] = (source_tb, reference_tb, mapping)
+        while len(_cache) > MAX_CACHED_MAPPINGS:
+            _cache.popitem(last=False)
+    return mapping
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def same_timebase(tb_a, tb_b):
+    if tb_a is tb_b:
+        return True
+    if len(tb_a) != len(tb_b) or tb_a.is_uniform != tb_b.is_uniform:
+        return False
+    if tb_a.is_uniform:
+        return tb_a.t0 == tb_b.t0 and tb_a.dt == tb_b.dt
+    return False
+
+
+def resample(data, source_tb, reference_tb, method=HOLD):
+    """ Resample `data` (sampled on `source_tb`) onto `reference_tb`. """
+    if same_timebase(source_tb, reference_tb):
+        return data
+    return get_mapping(source_tb, reference_tb, method).apply(data)
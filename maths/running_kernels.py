@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+Running-window kernels.
+
+Windows are centered on each sample and are either a number of ticks or a duration. Duration
+windows are applied to the actual timestamps, so they stay correct for logs with jitter or
+dropouts. Every window is described by a pair of (start, end) index arrays. From those:
+ - the mean is computed from cumulative sums in O(n), regardless of the window size;
+ - the median uses the skip list behind pandas' rolling median (O(n log w)). For odd tick windows
+   SciPy's 1-D median filter is faster, but it is only O(n log w) from SciPy 1.14 on (older
+   versions sort every window, O(n w)), so it is used with those versions only. Time windows,
+   even windows, samples near the edges of the log and columns with NaN values always go through
+   pandas.
+
+Both accept a 1-D array or a 2-D array with one column per signal (samples along axis 0); all
+columns are processed in a single pass. NaN samples are ignored.
+'''
+
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+import scipy
+from scipy import ndimage
+
+# Slack on the window edges so that samples exactly half a window away are included despite
+# rounding of the timestamps.
+_TIME_EPS = 1e-9
+
+# Whether `ndimage.median_filter` has its O(n log w) path for 1-D arrays.
+_FAST_MEDIAN_FILTER = tuple(int(part) for part in scipy.__version__.split('.')[:2]) >= (1, 14)
+
+
+class _FixedBounds(BaseIndexer):
+    """ Window bounds that were computed up front. """
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.start, self.end
+
+
+def tick_window_bounds(n, window):
+    """ [start, end) of a window of `window` ticks centered on each of `n` samples. """
+    window = max(int(window), 1)
+    idx = np.arange(n, dtype=np.int64)
+    # Same alignment as np.convolve(..., mode='same') and signal.medfilt.
+    start = np.clip(idx - window // 2, 0, n)
+    end = np.clip(idx + (window - 1) // 2 + 1, 0, n)
+    return start, end
+
+
+def time_window_bounds(time, window):
+    """ [start, end) of the samples within +/- `window` / 2 of each timestamp in `time`. """
+    time = np.asarray(time, dtype=np.float64)
+    half = 0.5 * window + _TIME_EPS
+    start = np.searchsorted(time, time - half, side='left').astype(np.int64)
+    end = np.searchsorted(time, time + half, side='right').astype(np.int64)
+    return start, end
+
+
+def window_bounds(n, window, time=None):
+    """ Window bounds in ticks, or in seconds over the timestamps `time` if given. """
+    if time is None:
+        return tick_window_bounds(n, window)
+    if len(time) != n:
+        raise ValueError(f"Expected {n} timestamps but got {len(time)}")
+    return time_window_bounds(time, window)
+
+
+def _as_2d(data):
+    data = np.asarray(data)
+    if data.ndim == 1:
+        return data[:, np.newaxis], True
+    if data.ndim != 2:
+        raise ValueError(f"Expected a 1-D or 2-D array, got {data.ndim} dimensions")
+    return data, False
+
+
+def running_mean(data, window, time=None):
+    """ Centered running mean of `data` over `window` ticks (or seconds if `time` is given). """
+    data, squeeze = _as_2d(data)
+    start, end = window_bounds(len(data), window, time)
+
+    finite = np.isfinite(data)
+    all_finite = finite.all()
+    values = np.where(finite, data, 0.).astype(np.float64, copy=False)
+    counts = finite.sum(axis=0)
+    # Remove the mean of each column first so the cumulative sums don't lose precision on long
+    # logs with a large offset.
+    center = values.sum(axis=0) / np.maximum(counts, 1)
+    values -= center
+    if not all_finite:
+        values[~finite] = 0.
+
+    csum = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(values, axis=0, out=csum[1:])
+    total = csum[end] - csum[start]
+    if all_finite:
+        n = (end - start)[:, np.newaxis]
+    else:
+        ccount = np.zeros((len(values) + 1, values.shape[1]), dtype=np.int64)
+        np.cumsum(finite, axis=0, out=ccount[1:])
+        n = ccount[end] - ccount[start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = total / n + center
+    if not all_finite:
+        result[n == 0] = np.nan
+    return result[:, 0] if squeeze else result
+
+
+def _rolling_median(data, start, end):
+    indexer = _FixedBounds(start=start, end=end)
+    return pd.DataFrame(data).rolling(indexer, min_periods=1).median().to_numpy()
+
+
+def running_median(data, window, time=None):
+    """ Centered running median of `data` over `window` ticks (or seconds if `time` is given). """
+    data, squeeze = _as_2d(data)
+    n = len(data)
+    # SciPy takes the upper of the two middle values for even windows; pandas averages them.
+    if time is not None or n <= window or int(window) % 2 == 0 or not _FAST_MEDIAN_FILTER:
+        result = _rolling_median(data, *window_bounds(n, window, time))
+        return result[:, 0] if squeeze else result
+
+    window = max(int(window), 1)
+    result = np.empty(data.shape, dtype=np.float64)
+    head, tail = window // 2, (window - 1) // 2
+    finite = np.isfinite(data).all(axis=0)
+    for col in range(data.shape[1]):
+        if finite[col]:
+            # The 1-D filter is much faster than filtering the 2-D block at once.
+            result[:, col] = ndimage.median_filter(data[:, col], size=window, mode='nearest')
+        else:
+            result[:, col] = _rolling_median(data[:, col], *tick_window_bounds(n, window))[:, 0]
+
+    # The filter pads the edges; the windows there only cover the samples that exist instead.
+    bounds = tick_window_bounds(window, window)
+    if head:
+        result[:head] = _rolling_median(data[:window], *bounds)[:head]
+    if tail:
+        result[-tail:] = _rolling_median(data[-window:], *bounds)[-tail:]
+    return result[:, 0] if squeeze else result
@@ -15,6 +15,7 @@ import numpy as np
 from scipy.ndimage.filters import maximum_filter1d, minimum_filter1d
 
 from maths.maths_base import MathSpecBase
+from maths.recipes import operation
 
 
 class MinMaxType(Enum):
@@ -29,7 +30,24 @@ class RunningMinMaxParams:
     is_ticks: bool
 
 
+@operation("running_minmax")
+def running_minmax(inputs, tb, type, window_sz, is_ticks):
+    data, = inputs
+    # First, determine the window size. if it's a time, we need to convert to ticks
+    if not is_ticks:
+        window_sz = round(window_sz / tb.avg_dt)
+
+    if MinMaxType[type.upper()] == MinMaxType.MIN:
+        func = minimum_filter1d
+    else:
+        func = maximum_filter1d
+
+    offset = math.ceil(0.5 * window_sz) - 1
+    return func(data, size=int(window_sz), mode='nearest', origin=offset)
+
+
 class RunningMinMaxSpec(MathSpecBase):
+    operation = "running_minmax"
 
     def __init__(self, parent):
         MathSpecBase.__init__(self, parent=parent, name="running min/max")
@@ -81,31 +99,37 @@ class RunningMinMaxSpec(MathSpecBase):
         button_box.accepted.connect(param_dialog.accept)
         button_box.rejected.connect(param_dialog.reject)
 
+        def read_params():
+            return RunningMinMaxParams(window_type.itemData(window_type.currentIndex()),
+                                       window_size.value(), window_tick.isChecked())
+
+        self.connect_preview(param_dialog, read_params,
+                             (window_type.currentIndexChanged, window_tick.toggled, window_size.valueChanged))
+
         # Show the dialog as modal
         if param_dialog.exec() == QDialog.Accepted:
             # This is where the various values should be collected and stored.
-            self._params = RunningMinMaxParams(window_type.itemData(window_type.currentIndex()),
-                                               window_size.value(), window_tick.isChecked())
+            self._params = read_params()
 
             return True
 
         return False
 
-    def do_math(self, data, dt):
-        # First, determine the winodw size. if it's a time, we need to conver to ticks
-        window_sz = self._params.window_sz
-        if not self._params.is_ticks:
-            window_sz = round(self._params.window_sz / dt)
-        else:
+    def recipe_params(self):
+        if self._params.is_ticks:
             self._params.window_sz = int(self._params.window_sz)
-
-        if self._params.type == MinMaxType.MIN:
-            func = minimum_filter1d
-        else:
-            func = maximum_filter1d
-
-        offset = math.ceil(0.5 * window_sz) - 1
-        return func(data.data, size=int(window_sz), mode='nearest', origin=offset)
+        return dict(type=self._params.type.name.lower(), window_sz=self._params.window_sz,
+                    is_ticks=self._params.is_ticks)
+
+    def preview_margin(self, params, tb):
+        if params['is_ticks']:
+            return params['window_sz'] * tb.avg_dt
+        return params['window_sz']
+
+    def preview_params(self, params, stride, dt):
+        if not params['is_ticks']:
+            return params
+        return {**params, 'window_sz': max(1, round(params['window_sz'] / stride))}
 
     def default_var_name(self, vname):
         return f"RunningMinMax({vname},{self._params.type.name.lower()},{self._params.window_sz},{int(self._params.is_ticks)}) "
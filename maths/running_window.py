@@ -11,10 +11,10 @@ from dataclasses import dataclass
 
 from enum import Enum
 import math
-import numpy as np
-from scipy import signal
 
 from maths.maths_base import MathSpecBase
+from maths import running_kernels
+from maths.recipes import operation
 
 
 class WindowTypes(Enum):
@@ -29,7 +29,28 @@ class RunningWindowParams:
     is_ticks: bool
 
 
+@operation("running_window")
+def running_window(inputs, tb, type, window_sz, is_ticks):
+    data, = inputs
+    time = None
+    if not is_ticks:
+        if tb.is_uniform:
+            # All samples within half a window on either side.
+            window_sz = 2 * math.floor(0.5 * window_sz / tb.dt + 1e-9) + 1
+        else:
+            # Apply the window to the actual timestamps.
+            time = tb.array()
+    elif window_sz % 2 == 0 and WindowTypes[type.upper()] == WindowTypes.MEDIAN:
+        window_sz += 1
+
+    if WindowTypes[type.upper()] == WindowTypes.MEAN:
+        return running_kernels.running_mean(data, window_sz, time)
+    else:
+        return running_kernels.running_median(data, window_sz, time)
+
+
 class RunningWindowSpec(MathSpecBase):
+    operation = "running_window"
 
     def __init__(self, parent):
         MathSpecBase.__init__(self, parent=parent, name="running mean/median")
@@ -81,32 +102,37 @@ class RunningWindowSpec(MathSpecBase):
         button_box.accepted.connect(param_dialog.accept)
         button_box.rejected.connect(param_dialog.reject)
 
+        def read_params():
+            return RunningWindowParams(window_type.itemData(window_type.currentIndex()),
+                                       window_size.value(), window_tick.isChecked())
+
+        self.connect_preview(param_dialog, read_params,
+                             (window_type.currentIndexChanged, window_tick.toggled, window_size.valueChanged))
+
         # Show the dialog as modal
         if param_dialog.exec() == QDialog.Accepted:
             # This is where the various values should be collected and stored.
-            self._params = RunningWindowParams(window_type.itemData(window_type.currentIndex()),
-                                               window_size.value(), window_tick.isChecked())
+            self._params = read_params()
 
             return True
 
         return False
 
-    def do_math(self, data, dt):
-        # First, determine the winodw size. if it's a time, we need to conver to ticks
-        window_sz = self._params.window_sz
-        if not self._params.is_ticks:
-            window_sz = round(self._params.window_sz / dt)
-        else:
+    def recipe_params(self):
+        if self._params.is_ticks:
             self._params.window_sz = int(self._params.window_sz)
-
-        if self._params.type == WindowTypes.MEAN:
-            val = np.convolve(data.data, np.ones(int(window_sz)) / float(window_sz), mode='same')
-        else:
-            if window_sz % 2 == 0:
-                window_sz += 1
-            val = signal.medfilt(data.data, int(window_sz))
-
-        return val
+        return dict(type=self._params.type.name.lower(), window_sz=self._params.window_sz,
+                    is_ticks=self._params.is_ticks)
+
+    def preview_margin(self, params, tb):
+        if params['is_ticks']:
+            return params['window_sz'] * tb.avg_dt
+        return params['window_sz']
+
+    def preview_params(self, params, stride, dt):
+        if not params['is_ticks']:
+            return params
+        return {**params, 'window_sz': max(1, round(params['window_sz'] / stride))}
 
     def default_var_name(self, vname):
         return f"RunningWindow({vname},{self._params.type.name.lower()},{self._params.window_sz},{int(self._params.is_ticks)})"
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental evaluation of recipe operations for sources that grow while they are open.
+
+When samples are appended to a source, a derived variable is extended from the state its operator
+carried over from the previous update instead of being recomputed over the whole log:
+ - differentiation and integration carry the last sample (and the running integral);
+ - causal filters carry the state of their second-order sections (`sosfilt`'s `zi`);
+ - element-wise expressions and forward kinematics simply evaluate the new samples;
+ - running windows (mean, median, min and max) re-run their batch kernel over the new samples plus
+   the window's reach into the old ones. Centered windows near the old end of the log now have
+   more samples to cover, so those outputs are replaced as well. On non-uniform timebases, mean
+   and median windows in seconds reach as far as the timestamps say; min/max windows in seconds
+   are sized from the average step of the whole log, so they are recomputed whenever that changes
+   their size in ticks.
+
+`extend` returns `(start, values)`: the derived array from index `start` onwards is replaced by
+`values`. Operators only see the times of the samples they need. The cost of an update is
+O(appended + window), plus a one-off O(n) for operators whose state has to be built from the
+history (a filter's state). Operations without an incremental
+form (e.g. filt-filt, whose backward pass depends on the future) have no operator; their values
+are recomputed from the recipe when they are next needed.
+'''
+
+import math
+
+import numpy as np
+from scipy import signal
+
+from maths import filter_engine
+from maths.recipes import get_operation
+import timebase
+
+# Incremental operators by recipe operation. Each one is constructed as `cls(params, tb)` and may
+# raise `NotImplementedError` if those parameters can't be evaluated incrementally.
+STREAMING_OPERATIONS = {}
+
+
+def streaming_operation(name):
+    """ Class decorator registering an incremental operator for the recipe operation `name`. """
+    def register(cls):
+        STREAMING_OPERATIONS[name] = cls
+        return cls
+    return register
+
+
+def create(operation, params, tb):
+    """ An incremental operator for `operation`, or None if there is none for these parameters. """
+    cls = STREAMING_OPERATIONS.get(operation)
+    if cls is None:
+        return None
+    try:
+        return cls(params, tb)
+    except NotImplementedError:
+        return None
+
+
+class Incremental(object):
+    """ Base class of the incremental operators. """
+
+    def __init__(self, params, tb):
+        self.params = params
+
+    def prime(self, inputs, tb, value):
+        """
+            Take over from a full evaluation: `value` was computed from `inputs`, the first ticks of
+            the timebase `tb`.
+        """
+        raise NotImplementedError
+
+    def extend(self, inputs, time):
+        """
+            New samples of the inputs at `time` -> (start, values). Raises `NotImplementedError` if
+            the values can't be extended this time; they are then recomputed.
+        """
+        raise NotImplementedError
+
+
+@streaming_operation("differentiate")
+class Differentiate(Incremental):
+    def prime(self, inputs, tb, value):
+        self._last = (inputs[0][-1], tb.at(len(inputs[0]) - 1))
+
+    def extend(self, inputs, time):
+        data, = inputs
+        last_data, last_time = self._last
+        values = np.diff(data, prepend=last_data) / np.diff(time, prepend=last_time)
+        self._last = (data[-1], time[-1])
+        return None, values
+
+
+@streaming_operation("integrate")
+class Integrate(Incremental):
+    def prime(self, inputs, tb, value):
+        self._last_time = tb.at(len(inputs[0]) - 1)
+        self._total = value[-1]
+
+    def extend(self, inputs, time):
+        data, = inputs
+        values = self._total + np.cumsum(data * np.diff(time, prepend=self._last_time))
+        self._last_time = time[-1]
+        self._total = values[-1]
+        return None, values
+
+
+@streaming_operation("filter")
+class Filter(Incremental):
+    def __init__(self, params, tb):
+        super().__init__(params, tb)
+        # The backward pass of filt-filt depends on every later sample, and non-uniform logs are
+        # filtered on a grid that changes as the log grows.
+        if params['filtfilt'] or not tb.is_uniform:
+            raise NotImplementedError
+        self._sos = filter_engine.design_sos(params['order'], params['type'], params['cutoff'], 1. / tb.dt)
+
+    def prime(self, inputs, tb, value):
+        zi = np.zeros((self._sos.shape[0], 2))
+        _, self._zi = signal.sosfilt(self._sos, np.asarray(inputs[0], dtype=np.float64), zi=zi)
+
+    def extend(self, inputs, time):
+        values, self._zi = signal.sosfilt(self._sos, np.asarray(inputs[0], dtype=np.float64), zi=self._zi)
+        return None, values
+
+
+@streaming_operation("expression")
+class Expression(Incremental):
+    def prime(self, inputs, tb, value):
+        pass
+
+    def extend(self, inputs, time):
+        return None, np.asarray(get_operation("expression")(inputs, None, **self.params))
+
+
+@streaming_operation("fk")
+class ForwardKinematics(Incremental):
+    def prime(self, inputs, tb, value):
+        pass
+
+    def extend(self, inputs, time):
+        return None, np.asarray(get_operation("fk")(inputs, time, **self.params))
+
+
+class _Window(Incremental):
+    """
+        A batch kernel whose output at a sample only depends on the inputs in a window around it:
+        `left` ticks before and `right` after, or, for windows in seconds on non-uniform timebases,
+        `half` seconds on either side. The samples that later outputs can reach are kept to extend
+        the output.
+    """
+
+    def __init__(self, params, tb):
+        super().__init__(params, tb)
+        self._operation = get_operation(self.operation)
+        self.half = self.time_reach(params, tb)
+        if self.half is None:
+            # Run the kernel with the window in ticks, as computed for the log when it was primed.
+            self.params = dict(params, window_sz=self.window_ticks(params, tb), is_ticks=True)
+            self.left, self.right = self.reach(self.params['window_sz'])
+
+    @staticmethod
+    def time_reach(params, tb):
+        """ Half the window in seconds if the kernel applies it to the timestamps, else None. """
+        return None
+
+    def _kept(self, time):
+        """ The first of the samples at `time` (the end of the log) that later outputs can reach. """
+        if self.half is None:
+            return max(len(time) - (self.left + self.right), 0)
+        # Outputs up to half a window before the end can still change; their windows reach back
+        # another half window.
+        return int(np.searchsorted(time, time[-1] - 2 * self.half, side='left'))
+
+    def _changed(self, tail_time, time):
+        """
+            (start, lo) in the kept samples: outputs from `start` on have some of the new samples
+            at `time` in their window, and their windows start at `lo`.
+        """
+        if self.half is None:
+            start = max(len(tail_time) - self.right, 0)
+            return start, max(start - self.left, 0)
+        start = int(np.searchsorted(tail_time, time[0] - self.half, side='left'))
+        first_time = tail_time[start] if start < len(tail_time) else time[0]
+        return start, int(np.searchsorted(tail_time, first_time - self.half, side='left'))
+
+    def prime(self, inputs, tb, value):
+        self._n = len(inputs[0])
+        if self.half is None:
+            first = max(self._n - (self.left + self.right), 0)
+        else:
+            first = tb.tick_range(tb.at(self._n - 1) - 2 * self.half, tb.at(self._n - 1))[0] if self._n else 0
+        self._tail = (np.asarray(inputs[0][first:]), tb.at(np.arange(first, self._n)))
+
+    def extend(self, inputs, time):
+        data, = inputs
+        tail_data, tail_time = self._tail
+        start, lo = self._changed(tail_time, time)
+        segment = np.concatenate((tail_data[lo:], data))
+        segment_time = np.concatenate((tail_time[lo:], time))
+        values = self._operation([segment], timebase.ArrayTimebase(segment_time), **self.params)
+
+        first = self._kept(segment_time)
+        start += self._n - len(tail_data)
+        self._n += len(data)
+        self._tail = (segment[first:], segment_time[first:])
+        return start, np.asarray(values)[start - (self._n - len(segment)):]
+
+
+@streaming_operation("running_window")
+class RunningWindow(_Window):
+    operation = "running_window"
+
+    @staticmethod
+    def time_reach(params, tb):
+        if params['is_ticks'] or tb.is_uniform:
+            return None
+        # With a margin over the kernel's own tolerance; outputs that didn't change are recomputed
+        # to the same values.
+        return 0.5 * params['window_sz'] + 1e-6
+
+    @staticmethod
+    def window_ticks(params, tb):
+        window_sz = params['window_sz']
+        if not params['is_ticks']:
+            return 2 * math.floor(0.5 * window_sz / tb.dt + 1e-9) + 1
+        if window_sz % 2 == 0 and params['type'].upper() == "MEDIAN":
+            return window_sz + 1
+        return window_sz
+
+    @staticmethod
+    def reach(window):
+        window = max(int(window), 1)
+        return window // 2, (window - 1) // 2
+
+
+@streaming_operation("running_minmax")
+class RunningMinMax(_Window):
+    operation = "running_minmax"
+
+    def __init__(self, params, tb):
+        super().__init__(params, tb)
+        # The batch operation converts a window in seconds to round(window / avg_dt) ticks of the
+        # whole log, which changes on a non-uniform timebase as the log grows. The values are
+        # then recomputed, so they match a full evaluation.
+        self._window_sz = params['window_sz'] if not params['is_ticks'] and not tb.is_uniform else None
+
+    def _check_window(self, n, t_last):
+        if self._window_sz is not None and n > 1:
+            if round(self._window_sz * (n - 1) / (t_last - self._t0)) != self.params['window_sz']:
+                raise NotImplementedError
+
+    def prime(self, inputs, tb, value):
+        super().prime(inputs, tb, value)
+        self._t0 = tb.at(0)
+        # `tb` may already cover the new samples; the value was computed for the first `_n`.
+        self._check_window(self._n, tb.at(self._n - 1))
+
+    def extend(self, inputs, time):
+        self._check_window(self._n + len(time), time[-1])
+        return super().extend(inputs, time)
+
+    @staticmethod
+    def window_ticks(params, tb):
+        if params['is_ticks']:
+            return params['window_sz']
+        return round(params['window_sz'] / tb.avg_dt)
+
+    @staticmethod
+    def reach(window):
+        # The window trails the sample (see `running_minmax`).
+        window = max(int(window), 1)
+        return window - 1, 0
+
+
+class AppendBuffer(object):
+    """ An array that grows by doubling its capacity, so appending is amortized O(appended). """
+
+    def __init__(self, value):
+        value = np.asarray(value)
+        self._array = np.empty(max(2 * len(value), 16), dtype=value.dtype)
+        self._array[:len(value)] = value
+        self._n = len(value)
+
+    def __len__(self):
+        return self._n
+
+    def view(self):
+        return self._array[:self._n]
+
+    def replace_tail(self, start, values):
+        """ Replace the values from `start` (the end if None) on with `values`. Returns the new view. """
+        start = self._n if start is None else start
+        end = start + len(values)
+        if end > len(self._array):
+            grown = np.empty(max(2 * len(self._array), end), dtype=self._array.dtype)
+            grown[:start] = self._array[:start]
+            self._array = grown
+        self._array[start:end] = values
+        self._n = end
+        return self.view()
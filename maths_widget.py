@@ -1,44 +1,44 @@
 # -*- coding: utf-8 -*-
 from PyQt5.QtCore import Qt, QVariant, QMimeData, QObject, QEvent
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, \
-    QListWidget, QListWidgetItem, QLineEdit, QPushButton, QInputDialog
+    QListWidget, QListWidgetItem, QLineEdit, QPushButton, QInputDialog, QComboBox, QLabel
 from PyQt5.QtGui import QDrag, QMouseEvent
 
 from PyQt5.QtWidgets import QMessageBox, QApplication
 
 from dataclasses import dataclass
 import math
-import numpy as np
+import os
 import pickle
 import time
 
-from imports import install_and_import
-
 from var_list_widget import VarListWidget
 
 from maths.filter import FilterSpec
 from maths.diff_int import DifferentiateSpec, IntegrateSpec
 from maths.running_window import RunningWindowSpec
 from maths.running_minmax import RunningMinMaxSpec
+from maths.expression import compile_expression, ExpressionError
+from maths.recipes import Recipe
+from batch_math_dialog import BatchMathDialog
+from maths import resample
 
-from data_model import DataItem
 from docked_widget import DockedWidget
 from logging_config import get_logger
-
-py_expression_eval = install_and_import("py_expression_eval")
-from py_expression_eval import Parser
+from workers import run_in_background
 
 logger = get_logger(__name__)
 
 
 class DockedMathsWidget(DockedWidget):
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, data_file_widget=None, plot_manager=None):
         DockedWidget.__init__(self, "Maths", parent=parent)
 
         self.setAllowedAreas(Qt.BottomDockWidgetArea | Qt.RightDockWidgetArea)
 
-        self.setWidget(MathsWidget(parent=self))
+        self.setWidget(MathsWidget(parent=self, data_file_widget=data_file_widget,
+                                   plot_manager=plot_manager))
 
 
 
@@ -48,14 +48,17 @@ class DockedMathsWidget(DockedWidget):
 @dataclass
 class VarInfo:
     var_name: str
-    data: np.ndarray
     source: int
 
 
 class MathsWidget(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, data_file_widget=None, plot_manager=None):
         QWidget.__init__(self, parent=parent)
 
+        self._data_file_widget = data_file_widget
+        # Used by the maths specs to preview results on the plots.
+        self.plot_manager = plot_manager
+
         self.setMinimumWidth(320)
         self.resize(640, 480)
 
@@ -94,28 +97,28 @@ class MathsWidget(QWidget):
 
         entry_layout.addWidget(evaluate_button)
 
+        # Expressions may use variables from several files. They are evaluated on the timebase of
+        # the reference file and the other variables are resampled onto it.
+        options_layout = QHBoxLayout()
+        options_layout.addWidget(QLabel("timebase:"))
+        self.reference_combo = QComboBox()
+        self.reference_combo.addItem("file of first variable", None)
+        self.reference_combo.setToolTip("File whose timebase is used when an expression uses variables from several files")
+        options_layout.addWidget(self.reference_combo, 1)
+        options_layout.addWidget(QLabel("resample:"))
+        self.resample_combo = QComboBox()
+        self.resample_combo.addItems(resample.METHODS)
+        options_layout.addWidget(self.resample_combo)
+
         math_layout.addLayout(io_layout)
         math_layout.addLayout(entry_layout)
+        math_layout.addLayout(options_layout)
 
         # We'll be lazy for now and store data in this dictionary. We'll fix this later.
         self._vars = {}
 
-        self.parser = Parser()
-        # We need to overwrite some of the functionality so that it works for our numpy arrays:
-        # TODO(rose@): Make this more complex so we can use scalars and arrays interchangeably
-        self.parser.ops1['sin'] = np.sin
-        self.parser.ops1['cos'] = np.cos
-        self.parser.ops1['tan'] = np.tan
-        self.parser.ops1['asin'] = np.arcsin
-        self.parser.ops1['acos'] = np.arccos
-        self.parser.ops1['atan'] = np.arctan
-        self.parser.ops1['sqrt'] = np.sqrt
-        self.parser.ops1['ceil'] = np.ceil
-        self.parser.ops1['floor'] = np.floor
-        self.parser.ops1['round'] = np.round
-        # Here is where we would add additional functions to the list. Probably the best thing
-        # would be if we had some object that would provide the additional functions so they are
-        # accessible to plotlists as well.
+        # Expressions are compiled with `maths.expression`. Additional functions can be added to
+        # `maths.expression.FUNCTIONS` so they are accessible to plotlists as well.
 
         self._current_cb = None
 
@@ -129,6 +132,7 @@ class MathsWidget(QWidget):
                       ("filter", FilterSpec(self)),
                       ("running min/max", RunningMinMaxSpec(self)),
                       ("running mean/median", RunningWindowSpec(self)))
+        self._math_funcs = math_funcs
 
         n_rows = math.ceil(math.sqrt(len(math_funcs)))
         n_cols = math.ceil(len(math_funcs) / n_rows)
@@ -141,9 +145,20 @@ class MathsWidget(QWidget):
             math_button = QPushButton(mf)
             math_button.clicked.connect(cb.button_callback)
             button_layout.addWidget(math_button, r, c)
+
+        # Apply an operation to many variables at once.
+        i = len(math_funcs)
+        batch_button = QPushButton("batch...")
+        batch_button.setEnabled(self._data_file_widget is not None)
+        batch_button.clicked.connect(self.show_batch_dialog)
+        button_layout.addWidget(batch_button, math.floor(i / n_cols), i % n_cols)
         button_layout.setRowStretch(0, 600)
         return button_layout
 
+    def show_batch_dialog(self):
+        dialog = BatchMathDialog(self._math_funcs, self, self._data_file_widget, parent=self)
+        dialog.exec()
+
     def eventFilter(self, obj, event):
         vlist = None
         if type(obj) is VarListWidget:
@@ -177,7 +192,7 @@ class MathsWidget(QWidget):
         new_item = QListWidgetItem(list_name)
         new_item.setData(Qt.ToolTipRole, vidx)
         # self._vars[f"x{self.var_in.count()}"] = e.source().model().get_data_by_name(var_name)
-        var_info = VarInfo(var_name, selected.data, e.source())
+        var_info = VarInfo(var_name, e.source())
         self._vars[vidx] = var_info
         # Add this to the list of input variables.
         self.var_in.addItem(new_item)
@@ -185,10 +200,30 @@ class MathsWidget(QWidget):
         # TODO(rose@) - Remove this variable from self._vars also.
         remove_row = lambda: self.var_in.takeItem(self.var_in.row(new_item))
         e.source().onClose.connect(remove_row)
+        self._add_reference_source(e.source())
         e.accept()
 
+    def _add_reference_source(self, source):
+        for i in range(1, self.reference_combo.count()):
+            if self.reference_combo.itemData(i) is source:
+                return
+        prefix = f"F{source.idx}: " if source.idx is not None else ""
+        self.reference_combo.addItem(f"{prefix}{os.path.basename(source.filename)}", source)
+
+        def remove_source():
+            for i in range(1, self.reference_combo.count()):
+                if self.reference_combo.itemData(i) is source:
+                    self.reference_combo.removeItem(i)
+                    return
+
+        source.onClose.connect(remove_source)
+
     def evaluate_math(self):
-        expr = self.parser.parse(self.math_entry.text())
+        try:
+            expr = compile_expression(self.math_entry.text())
+        except ExpressionError as ex:
+            logger.error(str(ex))
+            return
         e_vars = expr.variables()
 
         # Ensure all variables in the expression are available in the variable list.
@@ -200,20 +235,16 @@ class MathsWidget(QWidget):
                           f"{set(e_vars).difference(vars_from_list)}")
             return
 
-        # Ensure that all variables in the expression are also from the same file:
-        f_idx = [self._vars[v].source.idx for v in e_vars]
-        if len(set(f_idx)) > 1:
-            logger.warning("All variables in the expression must be from the same file.")
-            logger.warning(f"Variables are from the following files: {set(f_idx)}.")
-            return
+        # Variables from other files are resampled onto the timebase of the reference file.
+        reference = self.reference_combo.currentData()
+        if reference is None:
+            reference = self._vars[e_vars[0]].source
+        method = self.resample_combo.currentText()
 
-        try:
-            # Collect the required variables:
-            e_data = {v: self._vars[v].data for v in e_vars}
-            val = expr.evaluate(e_data)
-        except Exception as ex:
-            logger.error(f"Some sort of error! -- {ex}")
-            return
+        # The variable is stored as a recipe and only evaluated when it is first used.
+        inputs = tuple((self._recipe_input_model(self._vars[v].source, reference), self._vars[v].var_name)
+                       for v in e_vars)
+        recipe = Recipe("expression", dict(text=self.math_entry.text(), variables=e_vars), inputs, method)
 
         # Generate default name and get user input with conflict checking
         default_vname = self.math_entry.text()
@@ -221,7 +252,7 @@ class MathsWidget(QWidget):
             default_vname = default_vname.replace(v, self._vars[v].var_name)
         default_vname = default_vname.replace(' ', '')
 
-        source_model = self._vars[e_vars[0]].source.model()
+        source_model = reference.model()
 
         # Loop until user provides a unique name or cancels
         while True:
@@ -242,18 +273,41 @@ class MathsWidget(QWidget):
         # Clear the math entry box when the formula is evaluated successfully.
         self.math_entry.clear()
 
-        data_item = DataItem(vname, val)
-        # NOTE(rose@): If all of the variables are from the same file, then picking the time for
-        #              the first file is sufficient.
-        data_item._time = self._vars[e_vars[0]].source.time
+        self.add_new_var(vname, recipe, reference)
 
-        self.add_new_var(data_item, self._vars[e_vars[0]].source)
+    @staticmethod
+    def _recipe_input_model(source, reference):
+        # Variables from the reference file are referred to without a model. The others are
+        # resampled onto the reference timebase when the recipe is evaluated.
+        return None if source is reference else source.model()
 
-    def add_new_var(self, data_item, source):
+    def add_new_var(self, var_name, recipe, source, materialize=True):
         # Add the derived variable to the source file's DataModel
         # This is the clean architecture - derived variables belong to their source file
-        source.model().add_derived_variable(data_item.var_name, data_item.data)
+        data_item = source.model().add_derived_recipe(var_name, recipe)
         logger.debug(f"Added derived variable '{data_item.var_name}' to source DataModel")
+        self._register_var(data_item, source)
+        if materialize:
+            self.materialize_vars([var_name], source)
+
+    def materialize_vars(self, var_names, source):
+        """
+            Compute new derived variables in the background, so that a recipe that can't be
+            evaluated is reported now rather than only logged when the variable is first used.
+        """
+        def report(ex):
+            QMessageBox.warning(self, "Maths", f"Unable to compute {', '.join(var_names)}:\n{ex}")
+
+        run_in_background(source.model().materialize_derived, var_names, on_error=report)
+
+    def add_new_vars(self, recipes, source):
+        """ Add several derived variables, as (name, recipe, value or None), in one model refresh. """
+        for data_item in source.model().add_derived_recipes(recipes):
+            self._register_var(data_item, source)
+        logger.debug(f"Added {len(recipes)} derived variables to source DataModel")
+
+    def _register_var(self, data_item, source):
+        data_item._time = source.time
 
         # Create UI item in math widget (visual display unchanged)
         list_name = f"y{self.var_out.count()}"
@@ -264,7 +318,7 @@ class MathsWidget(QWidget):
 
         # Store locally for math widget management (use original source, not self)
         # Now the source will be able to find the variable via its DataModel
-        self._vars[list_name] = VarInfo(data_item.var_name, data_item.data, source)
+        self._vars[list_name] = VarInfo(data_item.var_name, source)
 
         # Clean up derived variable when source closes
         remove_row = lambda: self.var_out.takeItem(self.var_out.row(new_item))
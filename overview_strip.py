@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, QPointF, QRectF, QVariant
+from PyQt5.QtGui import QPainter, QPixmap, QPolygonF, QColor, QPen, QPalette
+from PyQt5.QtWidgets import QWidget, QMenu, QAction
+
+import pickle
+import numpy as np
+
+from logging_config import get_logger
+from trace_lod import TraceLOD
+import event_markers
+import timebase
+import workers
+
+logger = get_logger(__name__)
+
+
+def compute_overview(y, time_base, n_points):
+    """ The envelope of a whole signal at roughly `n_points` resolution. Runs in the background. """
+    lod = TraceLOD(y)
+    x, y = lod.envelope(time_base, 0, len(lod), n_points)
+    if not np.isfinite(y).any():
+        return None
+    return x, y, np.nanmin(y).item(), np.nanmax(y).item()
+
+
+class OverviewStrip(QWidget):
+    """
+        A minimap of the whole log that sits under the range slider.
+
+        Signals can be dragged onto the strip from the variable list. Each one is drawn over the
+        full time range of the log from a coarse min/max envelope, which is computed once per
+        signal in the background. The traces are only re-rendered when the strip is resized (or
+        the set of signals changes); the highlighted window follows the range slider and can be
+        dragged (or a new one selected) to drive the slider.
+
+        The errors and warnings of the text log are shown as a density strip along the bottom.
+    """
+
+    COLORS = ('#377eb8', '#e41a1c', '#4daf4a', '#984ea3', '#ff7f00', '#a65628')
+    # Number of envelope points computed per signal. This is plenty for any reasonable screen.
+    OVERVIEW_POINTS = 2048
+    STRIP_HEIGHT = 40
+    EVENTS_HEIGHT = 6
+
+    def __init__(self, range_slider, parent=None):
+        QWidget.__init__(self, parent)
+        self.setFixedHeight(self.STRIP_HEIGHT)
+        self.setAcceptDrops(True)
+        self.setToolTip("Drag signals here from the variable list to show them over the whole log.\n"
+                        + "Drag the highlighted window (or select a new one) to change the plotted range.")
+
+        self._range_slider = range_slider
+        self._range_slider.startValueChanged.connect(lambda _: self.update())
+        self._range_slider.endValueChanged.connect(lambda _: self.update())
+
+        # Each entry is [source, var_name, overview]. The overview is None until it has been computed.
+        self._signals = []
+        self._pixmap = None
+        # Sorted times, and severities, of the text log events.
+        self._event_times = np.empty(0)
+        self._event_severities = np.empty(0, dtype=np.int8)
+
+        self._drag_mode = None
+        self._drag_anchor = None
+        self._drag_window = None
+
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self._show_menu)
+
+    @property
+    def signal_names(self):
+        return [name for _, name, _ in self._signals]
+
+    def add_signal(self, name, source):
+        if any(src is source and var == name for src, var, _ in self._signals):
+            return
+        y_data = source.model().get_data_by_name(name)
+        if y_data is None:
+            return
+        new_source = not any(src is source for src, _, _ in self._signals)
+        entry = [source, name, None]
+        self._signals.append(entry)
+
+        # The envelope is computed without the time offset so it doesn't need to be recomputed
+        # when the offset changes.
+        time_base = timebase.for_source(source).shifted(0.)
+
+        def on_done(overview):
+            if entry in self._signals:
+                entry[2] = overview
+                self._invalidate()
+
+        workers.run_in_background(compute_overview, np.asarray(y_data), time_base, self.OVERVIEW_POINTS,
+                                  on_done=on_done)
+
+        if new_source:
+            if hasattr(source, 'timeChanged'):
+                source.timeChanged.connect(self._invalidate)
+            if hasattr(source, 'onClose'):
+                source.onClose.connect(lambda src=source: self.remove_source(src))
+
+    def remove_source(self, source):
+        self._signals = [entry for entry in self._signals if entry[0] is not source]
+        self._invalidate()
+
+    def set_events(self, times, severities):
+        """ Show the density of text log events at `times` (None clears them). """
+        if times is None:
+            times, severities = np.empty(0), np.empty(0, dtype=np.int8)
+        order = np.argsort(times, kind='stable')
+        self._event_times = np.asarray(times, dtype=np.float64)[order]
+        self._event_severities = np.asarray(severities, dtype=np.int8)[order]
+        self._invalidate()
+
+    def clear(self):
+        self._signals = []
+        self._invalidate()
+
+    def update_limits(self):
+        """ Must be called when the limits of the range slider change. """
+        self._invalidate()
+
+    def _invalidate(self):
+        self._pixmap = None
+        self.update()
+
+    def _show_menu(self, point):
+        menu = QMenu(self)
+        clear_action = QAction("Clear overview", menu)
+        clear_action.triggered.connect(self.clear)
+        clear_action.setEnabled(bool(self._signals))
+        menu.addAction(clear_action)
+        menu.exec_(self.mapToGlobal(point))
+
+    def _limits(self):
+        t_min, t_max = self._range_slider.min(), self._range_slider.max()
+        if t_min is None or t_max is None or t_max <= t_min:
+            return None
+        return t_min, t_max
+
+    def _time_to_x(self, time, limits):
+        return (time - limits[0]) / (limits[1] - limits[0]) * self.width()
+
+    def _x_to_time(self, x, limits):
+        return limits[0] + x / max(self.width(), 1) * (limits[1] - limits[0])
+
+    def _render(self):
+        pixmap = QPixmap(self.size())
+        pixmap.fill(self.palette().color(QPalette.Base))
+        limits = self._limits()
+        if limits is None:
+            return pixmap
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        height = self.height() - 2
+        for idx, (source, _, overview) in enumerate(self._signals):
+            if overview is None:
+                continue
+            x, y, y_min, y_max = overview
+            x = self._time_to_x(x + getattr(source, 'time_offset', 0.), limits)
+            # Each signal is scaled to the full height of the strip.
+            span = (y_max - y_min) or 1.
+            y = 1 + height * (1. - (np.nan_to_num(y, nan=y_min) - y_min) / span)
+            painter.setPen(QPen(QColor(self.COLORS[idx % len(self.COLORS)]), 1))
+            painter.drawPolyline(QPolygonF([QPointF(px, py) for px, py in zip(x.tolist(), y.tolist())]))
+
+        # One bin of events per pixel.
+        bins, severities, counts = event_markers.bin_events(self._event_times, self._event_severities,
+                                                            limits[0], limits[1], self.width())
+        if len(bins):
+            event_markers.draw_markers(painter, bins + 0.5, severities, event_markers.bin_alphas(counts),
+                                       self.height() - 1 - self.EVENTS_HEIGHT, self.height() - 1)
+        painter.end()
+        return pixmap
+
+    def resizeEvent(self, event):
+        self._pixmap = None
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        if self._pixmap is None or self._pixmap.size() != self.size():
+            self._pixmap = self._render()
+
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self._pixmap)
+
+        limits = self._limits()
+        window = self._drag_window or (self._range_slider.start(), self._range_slider.end())
+        if limits is not None and None not in window:
+            x0 = self._time_to_x(window[0], limits)
+            x1 = self._time_to_x(window[1], limits)
+            highlight = self.palette().color(QPalette.Highlight)
+            fill = QColor(highlight)
+            fill.setAlpha(60)
+            painter.setPen(QPen(highlight, 1))
+            painter.setBrush(fill)
+            painter.drawRect(QRectF(x0, 0, max(x1 - x0, 1.), self.height() - 1))
+
+        painter.setPen(self.palette().color(QPalette.Mid))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawRect(0, 0, self.width() - 1, self.height() - 1)
+        painter.end()
+
+    def mousePressEvent(self, event):
+        limits = self._limits()
+        if event.button() != Qt.LeftButton or limits is None:
+            return super().mousePressEvent(event)
+
+        t_click = self._x_to_time(event.pos().x(), limits)
+        start, end = self._range_slider.start(), self._range_slider.end()
+        if start <= t_click <= end:
+            # Drag the existing window
+            self._drag_mode = 'pan'
+            self._drag_anchor = (t_click, start, end)
+        else:
+            # Select a new window
+            self._drag_mode = 'select'
+            self._drag_anchor = t_click
+        event.accept()
+
+    def mouseMoveEvent(self, event):
+        limits = self._limits()
+        if self._drag_mode is None or limits is None:
+            return super().mouseMoveEvent(event)
+
+        t_mouse = self._x_to_time(event.pos().x(), limits)
+        if self._drag_mode == 'pan':
+            t_click, start, end = self._drag_anchor
+            # Keep the window inside the limits of the slider
+            delta = min(max(t_mouse - t_click, limits[0] - start), limits[1] - end)
+            self._set_slider_range(start + delta, end + delta)
+        else:
+            t_mouse = min(max(t_mouse, limits[0]), limits[1])
+            self._drag_window = (min(self._drag_anchor, t_mouse), max(self._drag_anchor, t_mouse))
+            self.update()
+        event.accept()
+
+    def mouseReleaseEvent(self, event):
+        limits = self._limits()
+        if self._drag_mode == 'select' and limits is not None:
+            if self._drag_window is not None and self._drag_window[1] > self._drag_window[0]:
+                self._set_slider_range(*self._drag_window)
+            else:
+                # A click outside of the window re-centers it on the click.
+                half_width = 0.5 * (self._range_slider.end() - self._range_slider.start())
+                center = min(max(self._drag_anchor, limits[0] + half_width), limits[1] - half_width)
+                self._set_slider_range(center - half_width, center + half_width)
+        self._drag_mode = None
+        self._drag_anchor = None
+        self._drag_window = None
+        self.update()
+        super().mouseReleaseEvent(event)
+
+    def _set_slider_range(self, start, end):
+        start, end = float(start), float(end)
+        # Move the handle on the leading side first so the two never cross.
+        if start > self._range_slider.start():
+            self._range_slider.setEnd(end)
+            self._range_slider.setStart(start)
+        else:
+            self._range_slider.setStart(start)
+            self._range_slider.setEnd(end)
+
+    def dragEnterEvent(self, e):
+        if e.mimeData().hasFormat("application/x-DataItem"):
+            e.acceptProposedAction()
+        else:
+            e.ignore()
+
+    def dropEvent(self, e):
+        if not e.mimeData().hasFormat("application/x-DataItem") or not hasattr(e.source(), 'model'):
+            e.ignore()
+            return
+        bstream = e.mimeData().retrieveData("application/x-DataItem", QVariant.ByteArray)
+        try:
+            selected = pickle.loads(bstream)
+        except Exception as ex:
+            logger.exception(f"Error unpickling DataItem: {ex}")
+            e.ignore()
+            return
+        self.add_signal(selected.var_name, e.source())
+        e.accept()
@@ -57,12 +57,12 @@ class PhasePlotCustomItem(CustomPlotItem):
     def on_time_changed(self, time):
         """Override to update phase plot values at current time"""
         # Convert time to tick index for both X and Y sources
-        import graph_utils
+        import timebase
 
         # Get tick indices for both sources (they might be different if sources have different sampling rates)
         try:
             # Use the X source time for tick calculation (similar to CustomPlotItem)
-            self._tick = graph_utils.time_to_tick(self.phase_plot_item.source_x.time, time)
+            self._tick = timebase.for_source(self.phase_plot_item.source_x).tick_at(time)
         except Exception as e:
             print(f"Error in time_to_tick conversion: {e}")
             self._tick = 0
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+'''
+Playback of the loaded data in real time, or faster or slower.
+
+A frame timer moves the cursor of the `PlotManager` to the time that playback should have reached
+by now on the wall clock. Everything that follows the cursor (the plots, the tick/time label, the
+text log and the 3D view) is updated once per frame at most. When a frame takes longer than the
+frame interval, the ticks in between are skipped instead of being played late.
+'''
+
+import time
+
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QComboBox, QHBoxLayout, QLabel, QStyle, QToolButton, QWidget
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Frames per second that playback aims for.
+FRAME_RATE = 60
+# Playback speeds offered, as multiples of real time.
+SPEEDS = (0.1, 0.25, 0.5, 1., 2., 4., 10.)
+# The achieved frame rate is measured over periods of this many seconds.
+FRAME_RATE_PERIOD = 0.5
+
+
+class PlaybackController(QObject):
+    """ Plays the data by moving the cursor of `plot_manager` with a frame timer. """
+
+    playingChanged = pyqtSignal(bool)
+    # Emitted while playing with the number of frames per second achieved.
+    frameRateMeasured = pyqtSignal(float)
+
+    def __init__(self, plot_manager, clock=time.perf_counter):
+        QObject.__init__(self, plot_manager)
+        self._plot_manager = plot_manager
+        self._clock = clock
+        self._speed = 1.
+
+        # Playback is at time `_anchor_time` at the wall-clock time `_anchor_clock`.
+        self._anchor_time = 0.
+        self._anchor_clock = 0.
+        # The cursor time set by the last frame, to notice when the cursor is moved by something else.
+        self._last_time = None
+        self._frames = 0
+        self._frames_clock = 0.
+
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setInterval(round(1000 / FRAME_RATE))
+        self._timer.timeout.connect(self.advance)
+
+    @property
+    def is_playing(self):
+        return self._timer.isActive()
+
+    @property
+    def speed(self):
+        return self._speed
+
+    def set_speed(self, speed):
+        if self.is_playing:
+            # Carry on from the current cursor position at the new speed.
+            self._anchor(self._plot_manager.time)
+        self._speed = speed
+
+    def play(self):
+        time_base = self._plot_manager.timebase
+        if self.is_playing or time_base is None:
+            return
+        start = self._plot_manager.time
+        if start >= time_base.t_max or start < time_base.t_min:
+            start = time_base.t_min
+        self._anchor(start)
+        self._frames = 0
+        self._frames_clock = self._anchor_clock
+        self._timer.start()
+        self.playingChanged.emit(True)
+
+    def pause(self):
+        if self.is_playing:
+            self._timer.stop()
+            self.playingChanged.emit(False)
+
+    def toggle(self):
+        if self.is_playing:
+            self.pause()
+        else:
+            self.play()
+
+    def _anchor(self, t):
+        self._anchor_time = t
+        self._anchor_clock = self._clock()
+        self._last_time = None
+
+    def advance(self):
+        ''' Move the cursor to where playback should be now (called for each frame). '''
+        time_base = self._plot_manager.timebase
+        if time_base is None:
+            self.pause()
+            return
+        now = self._clock()
+        if self._last_time is not None and self._plot_manager.time != self._last_time:
+            # The cursor was moved (e.g. with the arrow keys): carry on from there.
+            self._anchor_time, self._anchor_clock = self._plot_manager.time, now
+        target = min(self._anchor_time + (now - self._anchor_clock) * self._speed, time_base.t_max)
+        # Ticks between the previous frame and this one are skipped.
+        if time_base.nearest_tick(target) != self._plot_manager.tick or self._last_time is None:
+            self._plot_manager.set_tick_from_time(target)
+        self._last_time = self._plot_manager.time
+
+        self._frames += 1
+        if now - self._frames_clock >= FRAME_RATE_PERIOD:
+            self.frameRateMeasured.emit(self._frames / (now - self._frames_clock))
+            self._frames = 0
+            self._frames_clock = now
+
+        if target >= time_base.t_max:
+            self.pause()
+
+
+class PlaybackWidget(QWidget):
+    """ Play/pause button, speed selection and achieved frame rate of a `PlaybackController`. """
+
+    def __init__(self, controller, parent=None):
+        QWidget.__init__(self, parent)
+        self._controller = controller
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self._play_button = QToolButton()
+        self._play_button.setToolTip("Play / pause (Space)")
+        self._play_button.clicked.connect(controller.toggle)
+        layout.addWidget(self._play_button)
+
+        self._speed_box = QComboBox()
+        self._speed_box.setToolTip("Playback speed")
+        for speed in SPEEDS:
+            self._speed_box.addItem(f"{speed:g}x", speed)
+        self._speed_box.setCurrentIndex(SPEEDS.index(controller.speed))
+        self._speed_box.currentIndexChanged.connect(
+            lambda idx: controller.set_speed(self._speed_box.itemData(idx)))
+        layout.addWidget(self._speed_box)
+
+        self._frame_rate_label = QLabel()
+        self._frame_rate_label.setToolTip("Frames per second achieved by playback")
+        layout.addWidget(self._frame_rate_label)
+
+        controller.playingChanged.connect(self._update_playing)
+        controller.frameRateMeasured.connect(lambda fps: self._frame_rate_label.setText(f"{fps:.0f} fps"))
+        self._update_playing(controller.is_playing)
+
+    def _update_playing(self, playing):
+        icon = QStyle.SP_MediaPause if playing else QStyle.SP_MediaPlay
+        self._play_button.setIcon(self.style().standardIcon(icon))
+        if not playing:
+            self._frame_rate_label.clear()
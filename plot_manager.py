@@ -6,10 +6,13 @@ from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTabWidget, QInputDialog, QLin
 
 from QRangeSlider import QRangeSlider
 from sub_plot_widget import SubPlotWidget
+from x_range_controller import XRangeController
+from overview_strip import OverviewStrip
+from playback import PlaybackController
+from maths.recipes import recipe_from_dict
 from logging_config import get_logger
 
 import math
-import graph_utils
 
 logger = get_logger(__name__)
 
@@ -44,6 +47,9 @@ class PlotManager(QWidget):
 
         self._tick = 0
         self._time = 0
+        self._hover_readout_enabled = False
+        # Times and severities of the text log events marked on the plots.
+        self._text_log_events = (None, None)
 
         self.range_slider = QRangeSlider()
         self.range_slider.show()
@@ -57,6 +63,9 @@ class PlotManager(QWidget):
         self.range_slider.endValueChanged.connect(self.update_plot_xrange)
         central_layout.addWidget(self.range_slider)
 
+        self.overview = OverviewStrip(self.range_slider, self)
+        central_layout.addWidget(self.overview)
+
         self.tabs = QTabWidget()
         self.tabs.setTabsClosable(True)
         self.tabs.setTabBarAutoHide(False)
@@ -70,6 +79,8 @@ class PlotManager(QWidget):
 
         self.add_plot_tab()
 
+        self.playback = PlaybackController(self)
+
     @property
     def tab_count(self):
         return self.tabs.count()
@@ -81,6 +92,7 @@ class PlotManager(QWidget):
     def add_plot_tab(self):
         tab_count = self.tabs.count()
         paw = PlotAreaWidget(self)
+        paw.x_range_controller().rangeChanged.connect(self._on_tab_xrange_changed)
         self.tabs.addTab(paw, f"plot{tab_count + 1}")
         self.tabs.setCurrentWidget(paw)
 
@@ -94,6 +106,45 @@ class PlotManager(QWidget):
             if hasattr(plot_area_widget, 'update_all_cursor_settings'):
                 plot_area_widget.update_all_cursor_settings()
 
+    def update_all_render_backends(self, backend=None):
+        """Switch the rendering backend of all SubPlotWidgets in all tabs"""
+        for i in range(self.tabs.count()):
+            self.tabs.widget(i).update_all_render_backends(backend)
+
+    @property
+    def text_log_events(self):
+        return self._text_log_events
+
+    def set_text_log_events(self, times, severities):
+        """ Mark text log events on all SubPlotWidgets and on the overview (None clears them). """
+        self._text_log_events = (times, severities)
+        for i in range(self.tabs.count()):
+            self.tabs.widget(i).set_events(times, severities)
+        self.overview.set_events(times, severities)
+
+    @property
+    def hover_readout_enabled(self):
+        return self._hover_readout_enabled
+
+    @property
+    def tick(self):
+        return self._tick
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def timebase(self):
+        ''' The time axis of the first open file (which the cursor snaps to), or None. '''
+        return self._get_timebase()
+
+    def set_hover_readout_enabled(self, enabled):
+        """Enable/disable the snap-to-sample hover readout for all SubPlotWidgets in all tabs"""
+        self._hover_readout_enabled = enabled
+        for i in range(self.tabs.count()):
+            self.tabs.widget(i).set_hover_readout_enabled(enabled)
+
     def handle_key_press(self, event):
         """
         This is the main keypress event handler. It will handle distribution of the various
@@ -106,6 +157,8 @@ class PlotManager(QWidget):
             self.move_cursor(key == Qt.Key_Right, event.modifiers())
         elif key == Qt.Key_A and event.modifiers() == Qt.ControlModifier:
             self.tabs.currentWidget().autoscale_y_axes()
+        elif key == Qt.Key_Space:
+            self.playback.toggle()
 
     @pyqtSlot(QPoint)
     def on_context_menu_request(self, pos):
@@ -152,22 +205,22 @@ class PlotManager(QWidget):
         self.set_tick(self._tick + mult * (1 if positive else -1))
 
     def set_tick(self, tick):
-        time_series = self._get_time()
+        time_base = self._get_timebase()
         # If there's no file open, it probably doesn't make sense to move the cursor anyway.
-        if time_series is not None:
-            tick = max(0, min(tick, len(time_series) - 1))
-            time = time_series[tick]
+        if time_base is not None:
+            tick = max(0, min(tick, len(time_base) - 1))
+            time = time_base.at(tick).item()
             self.set_tick_from_time(time)
 
     def set_tick_from_time(self, t_cursor):
         self._time = t_cursor
-        time_series = self._get_time()
-        if time_series is None:
+        time_base = self._get_timebase()
+        if time_base is None:
             # Default to a psuedo tick count here
             self._tick = int(round(t_cursor * _DEFAULT_FREQ))
         else:
-            self._tick = graph_utils.time_to_nearest_tick(time_series, t_cursor)
-            self._time = time_series[self._tick]
+            self._tick = time_base.nearest_tick(t_cursor)
+            self._time = time_base.at(self._tick).item()
         self.tickValueChanged.emit(self._tick)
         self.timeValueChanged.emit(self._time)
 
@@ -196,8 +249,22 @@ class PlotManager(QWidget):
         self.range_slider.setEnd(new_end)
 
     def update_plot_xrange(self, val):
+        # The slider emits on every pixel of a drag. Each tab's controller coalesces these requests
+        # and applies only the latest one, once per frame.
+        start, end = self.range_slider.start(), self.range_slider.end()
         for idx in range(self.tabs.count()):
-            self.tabs.widget(idx).update_plot_xrange(val)
+            self.tabs.widget(idx).x_range_controller().request_range(start, end)
+
+    @pyqtSlot(float, float)
+    def _on_tab_xrange_changed(self, start, end):
+        # Keep the slider in sync if the range of a tab was changed from somewhere else (e.g. the
+        # mouse wheel). Setting the slider to its current value is a no-op, so this can't loop.
+        if self.sender() is not self.tabs.currentWidget().x_range_controller():
+            return
+        if start != self.range_slider.start():
+            self.range_slider.setStart(max(start, self.range_slider.min()))
+        if end != self.range_slider.end():
+            self.range_slider.setEnd(min(end, self.range_slider.max()))
 
     # Originally these methods were located in the top level file (main.py)
     # These should probably be cleaned up a bit. We could make the dataFileWidget
@@ -209,12 +276,20 @@ class PlotManager(QWidget):
             self.range_slider.setStart(t_min)
         if self.range_slider.max() < self.range_slider.end():
             self.range_slider.setEnd(t_max)
+        self.overview.update_limits()
 
     def get_plot_info_for_active_tab(self):
         # Inject the name of the current tab into the plot info.
         return {**{"name": self.tabs.tabText(self.tabs.currentIndex())},
                 **self.tabs.currentWidget().get_plot_info()}
 
+    def preview_subplot(self, var_name, model):
+        """ The subplot of the active tab showing `var_name` (of `model`), else its first subplot. """
+        plot_area = self.tabs.currentWidget()
+        if plot_area is None:
+            return None
+        return plot_area.find_subplot(var_name, model)
+
     def generate_plots_for_active_tab(self, plot_info, data_source, append):
         tab_name = plot_info['name']
         if tab_name and not append:  # Don't rename if appending to a tab
@@ -224,6 +299,22 @@ class PlotManager(QWidget):
     def _get_time(self, idx=0):
         return self._controller.data_file_widget.get_time(idx)
 
+    def _get_timebase(self, idx=0):
+        return self._controller.data_file_widget.get_timebase(idx)
+
+    def file_index_of_model(self, model):
+        """ Index of the open file whose DataModel is `model` (used to store recipes in plotlists). """
+        for source in self._controller.data_file_widget.get_sources().values():
+            if source.model() is model:
+                return source.idx
+        raise ValueError("The file is no longer open")
+
+    def model_of_file_index(self, idx):
+        source = self._controller.data_file_widget.get_data_file(idx)
+        if source is None:
+            raise ValueError(f"There is no open file with index {idx}")
+        return source.model()
+
 
 class PlotAreaWidget(QWidget):
     def __init__(self, plot_manager):
@@ -234,6 +325,9 @@ class PlotAreaWidget(QWidget):
 
         self.plot_area = QVBoxLayout(self)
 
+        # All subplots in this tab share a single x-range which is owned by this controller.
+        self._x_range = XRangeController(self)
+
         self.add_subplot()
         self.add_subplot()
 
@@ -242,6 +336,9 @@ class PlotAreaWidget(QWidget):
     def plot_manager(self):
         return self._plot_manager
 
+    def x_range_controller(self):
+        return self._x_range
+
     def add_subplot(self, idx=None):
         # Default to the bottom of the list
         if idx is None:
@@ -254,12 +351,13 @@ class PlotAreaWidget(QWidget):
         subplot = SubPlotWidget(self, object_name_override=subplot_object_name) # Pass unique name
         subplot.move_cursor(self._plot_manager._time)
         subplot.set_xlimits(self._plot_manager.range_slider.min(), self._plot_manager.range_slider.max())
+        subplot.set_events(*self._plot_manager.text_log_events)
         self._plot_manager.timeValueChanged.connect(subplot.move_cursor)
         self._plot_manager.range_slider.minValueChanged.connect(subplot.set_xlimit_min)
         self._plot_manager.range_slider.maxValueChanged.connect(subplot.set_xlimit_max)
         self.plot_area.insertWidget(idx, subplot)
 
-        self._link_axes()
+        self._x_range.add_subplot(subplot)
 
         _disp_layout_contents(self.plot_area)
 
@@ -276,35 +374,22 @@ class PlotAreaWidget(QWidget):
             # Don't allow the only remaining plot to be removed
             return
         item = self.plot_area.takeAt(self.plot_area.indexOf(subplot))
+        self._x_range.remove_subplot(subplot)
         subplot.close()
 
         _disp_layout_contents(self.plot_area)
 
-        if self.plot_area.count() <= 1:
-            # Nothing else to do here
-            return
-
-        # We need to handle the special case of the first subplot being removed!
-        # Re-link all axes to the first plot in the list
-        self._link_axes()
-
     def update_plot_xrange(self, val=None):
         logger.debug(f"Value: {val}, start: {self._plot_manager.range_slider.start()}, end: {self._plot_manager.range_slider.end()}")
-        # Because plots are linked we only need to do this for the first plot. Others will follow suite.
-        self._get_plot(0).pw.setXRange(min=self._plot_manager.range_slider.start(),
-                                       max=self._plot_manager.range_slider.end(),
-                                       padding=0)
+        # This is called directly (e.g. after a subplot auto-ranges), so apply the range right away
+        # rather than waiting for the next frame.
+        self._x_range.set_range(self._plot_manager.range_slider.start(),
+                                self._plot_manager.range_slider.end())
 
     def autoscale_y_axes(self):
         for idx in range(self.plot_area.count()):
             self._get_plot(idx).update_plot_yrange()
 
-    def _link_axes(self):
-        # TODO: Make this use signal/slot mechanism
-        pw = self._get_plot(0).pw
-        for idx in range(1, self.plot_area.count()):
-            self._get_plot(idx).pw.setXLink(pw)
-
     def _get_index(self, subplot):
         """ This method returns the index of the subplot (both from the layout and the list) """
         return self.plot_area.indexOf(subplot)
@@ -312,6 +397,14 @@ class PlotAreaWidget(QWidget):
     def _get_plot(self, idx):
         return self.plot_area.itemAt(idx).widget()
 
+    def find_subplot(self, var_name, model):
+        """ The first subplot showing `var_name` of `model`, else the first subplot. """
+        subplots = [self._get_plot(i) for i in range(self.plot_area.count())]
+        for subplot in subplots:
+            if subplot.has_trace(var_name, model):
+                return subplot
+        return subplots[0] if subplots else None
+
     def update_all_cursor_settings(self):
         """Update cursor settings for all SubPlotWidgets"""
         n_plots = self.plot_area.count()
@@ -320,6 +413,19 @@ class PlotAreaWidget(QWidget):
             if hasattr(plot_widget, 'update_cursor_settings'):
                 plot_widget.update_cursor_settings()
 
+    def update_all_render_backends(self, backend=None):
+        """Switch the rendering backend of all SubPlotWidgets"""
+        for i in range(self.plot_area.count()):
+            self._get_plot(i).update_render_backend(backend)
+
+    def set_hover_readout_enabled(self, enabled):
+        for i in range(self.plot_area.count()):
+            self._get_plot(i).set_hover_readout_enabled(enabled)
+
+    def set_events(self, times, severities):
+        for i in range(self.plot_area.count()):
+            self._get_plot(i).set_events(times, severities)
+
     def get_plot_info(self):
         n_plots = self.plot_area.count()
         plotlist = dict()
@@ -343,6 +449,8 @@ class PlotAreaWidget(QWidget):
                 logger.debug(f"Plot at idx {idx} : {self._get_plot(idx)}")
                 self.remove_subplot(self._get_plot(self.plot_area.count() - 1))
 
+        self._build_derived_variables(plot_info, data_source)
+
         # Walk the list of traces and produce the plots.
         for i in range(requested_count):
             plot = plot_info["plots"][i]
@@ -360,6 +468,34 @@ class PlotAreaWidget(QWidget):
                 # Don't mess up the y-range if plots are being appended.
                 subplot.set_y_range(*plot["yrange"])
 
+    def _build_derived_variables(self, plot_info, data_source):
+        """ Add the derived variables used by the plotlist to the source and compute them all in
+            one batch (on a thread pool) before anything is plotted. """
+        model = data_source.model()
+        if not hasattr(model, 'add_derived_recipe'):
+            return
+
+        specs = dict()
+        for plot in plot_info["plots"][:plot_info['count']]:
+            specs.update(plot.get("derived", {}))
+        if not specs:
+            return
+
+        for name, spec in specs.items():
+            if model.has_variable(name):
+                # Already defined for this source, e.g. by a plotlist loaded earlier.
+                continue
+            try:
+                model.add_derived_recipe(name, recipe_from_dict(spec, self._plot_manager.model_of_file_index))
+            except (KeyError, ValueError) as ex:
+                logger.warning(f"Unable to restore derived variable '{name}': {ex}")
+
+        try:
+            # Anything that was already computed for this source is skipped.
+            model.materialize_derived(list(specs))
+        except Exception as ex:
+            logger.error(f"Unable to compute derived variables: {ex}")
+
     def _copy_to_clipboard(self):
         cb = QApplication.clipboard()
         cb.setPixmap(self.grab())
@@ -4,6 +4,9 @@ from PyQt5.QtCore import QSettings
 
 import os
 
+import render_backend
+from maths import derived_cache
+
 class PreferencesDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -35,7 +38,9 @@ class PreferencesDialog(QDialog):
             self.urdf_settings,
             self.geometry_path_settings,
             self.phase_plot_settings,
-            self.cursor_settings
+            self.cursor_settings,
+            self.render_settings,
+            self.derived_cache_settings
         ]
         
         from PyQt5.QtWidgets import QFrame
@@ -228,6 +233,49 @@ class PreferencesDialog(QDialog):
         
         return vbox
 
+    def render_settings(self):
+        setting_name = render_backend.SETTING_NAME
+        current_backend = self._settings.value(setting_name, render_backend.DEFAULT_BACKEND)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Plot rendering backend:"))
+        backend_combo = QComboBox()
+        backend_combo.addItems(render_backend.BACKENDS)
+        backend_combo.setCurrentText(current_backend)
+        backend_combo.setToolTip("OpenGL is faster for subplots with many long traces. If an OpenGL\n" +
+                                 "context can't be created, QPainter is used instead.")
+        hbox.addWidget(backend_combo)
+
+        # Register the updated backend with the cache so it will be written on 'accept'
+        def update_setting(text):
+            self._setting_cache[setting_name] = text
+        backend_combo.currentTextChanged.connect(update_setting)
+
+        return hbox
+
+    def derived_cache_settings(self):
+        setting_name = derived_cache.SETTING_NAME
+        size_mb = int(self._settings.value(setting_name, derived_cache.DEFAULT_SIZE_MB))
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Derived variable disk cache:"))
+        size_spinbox = QSpinBox()
+        size_spinbox.setRange(0, 1 << 20)
+        size_spinbox.setSingleStep(256)
+        size_spinbox.setSuffix(" MiB")
+        size_spinbox.setSpecialValueText("disabled")
+        size_spinbox.setValue(size_mb)
+        size_spinbox.setToolTip("Results of math operations are kept on disk so they aren't recomputed\n" +
+                                "when a log is reopened. The least recently used results are removed first.")
+        hbox.addWidget(size_spinbox)
+
+        # Register the updated size with the cache so it will be written on 'accept'
+        def update_setting(value):
+            self._setting_cache[setting_name] = value
+        size_spinbox.valueChanged.connect(update_setting)
+
+        return hbox
+
     def choose_cursor_color(self):
         from PyQt5.QtGui import QColor
         current_color_text = self.cursor_color_button.text()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+'''
+Selection of the rendering backend used by the plot widgets.
+
+Two backends are supported:
+  * "QPainter" - the default raster path of QGraphicsView.
+  * "OpenGL"   - the plot viewport is replaced by a QOpenGLWidget. pyqtgraph then draws curves with
+                 vertex buffers that are only re-uploaded when the curve data changes (i.e. when
+                 the displayed level of detail changes), rather than re-tessellating paths on every
+                 repaint.
+
+The OpenGL backend works with software rendering (Mesa llvmpipe), so it can also be exercised on
+headless machines (e.g. `LIBGL_ALWAYS_SOFTWARE=1 xvfb-run python main.py -r OpenGL`). If an OpenGL
+context can't be created, the QPainter backend is used instead.
+
+The backend is chosen (in order of priority) from the command-line / environment override, the
+user preferences, and finally the default.
+'''
+
+import os
+
+from PyQt5.QtCore import QSettings
+from PyQt5.QtGui import QOpenGLContext
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+BACKEND_QPAINTER = "QPainter"
+BACKEND_OPENGL = "OpenGL"
+BACKENDS = (BACKEND_QPAINTER, BACKEND_OPENGL)
+
+DEFAULT_BACKEND = BACKEND_QPAINTER
+
+# Name of the setting (in the "Preferences" group) and the environment variable that can be used to
+# override the preference, e.g. for benchmarking.
+SETTING_NAME = "plot/render_backend"
+ENV_OVERRIDE = "PYPLOT_RENDER_BACKEND"
+
+_opengl_available = None
+
+
+def opengl_available():
+    ''' Returns True if an OpenGL context can be created on this machine. The result is cached. '''
+    global _opengl_available
+    if _opengl_available is None:
+        context = QOpenGLContext()
+        _opengl_available = context.create()
+        if _opengl_available:
+            fmt = context.format()
+            logger.info(f"OpenGL {fmt.majorVersion()}.{fmt.minorVersion()} is available for plot rendering.")
+        else:
+            logger.info("Unable to create an OpenGL context. Plots will be rendered with QPainter.")
+    return _opengl_available
+
+
+def set_override(backend):
+    ''' Force a specific backend for this process (takes precedence over the user preference). '''
+    if backend is None:
+        os.environ.pop(ENV_OVERRIDE, None)
+        return
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown render backend '{backend}'. Expected one of {BACKENDS}")
+    os.environ[ENV_OVERRIDE] = backend
+
+
+def selected_backend():
+    ''' The backend requested by the user (which may not be available on this machine). '''
+    backend = os.environ.get(ENV_OVERRIDE)
+    if backend is None:
+        settings = QSettings()
+        settings.beginGroup("Preferences")
+        backend = settings.value(SETTING_NAME, DEFAULT_BACKEND)
+        settings.endGroup()
+
+    if backend not in BACKENDS:
+        logger.warning(f"Unknown render backend '{backend}'. Using {DEFAULT_BACKEND}.")
+        backend = DEFAULT_BACKEND
+    return backend
+
+
+def apply_backend(graphics_view, backend=None):
+    '''
+    Configure a pyqtgraph GraphicsView (e.g. a PlotWidget) to render with the requested backend.
+    Returns the backend that is actually in use.
+    '''
+    if backend is None:
+        backend = selected_backend()
+
+    use_gl = backend == BACKEND_OPENGL and opengl_available()
+    if backend == BACKEND_OPENGL and not use_gl:
+        backend = BACKEND_QPAINTER
+
+    # Swapping the viewport is comparatively expensive, so only do it if something actually changes.
+    if getattr(graphics_view, '_render_backend', BACKEND_QPAINTER) != backend:
+        graphics_view.useOpenGL(use_gl)
+    graphics_view._render_backend = backend
+    return backend
@@ -10,6 +10,7 @@ import math
 import os
 
 from geometry_helpers import create_sphere
+from kinematics import KinematicTree, register_tree
 
 __LEAD_DENSITY__=11340  # kg / m^3
 
@@ -122,6 +123,10 @@ class RobotModel(gl.GLGraphicsItem.GLGraphicsItem):
             self.joints[joint.name] = joint.child
 
         self.links[robot_info.base_link.name].setParentItem(self)
+        # For computing the poses of the links over a whole log (see `kinematics.link_poses`).
+        self.urdf_file = urdf_file
+        self.kinematics = KinematicTree.from_urdf(robot_info)
+        register_tree(urdf_file, self.kinematics)
 
     def setJointQ(self, joint, q):
         if joint in self.joints:
@@ -131,12 +136,14 @@ class RobotModel(gl.GLGraphicsItem.GLGraphicsItem):
             print(f"Invalid joint name: '{joint}'")
 
     def setJointQs(self, qs):
+        ''' Set the positions of all the joints, in the order of `self.joints`. '''
         if len(qs) != len(self.joints):
             print(f"Error, supplied joint length doesn't match actual joint length ({len(qs)} != {len(self.joints)})")
             return
 
-        for i, q in enumerate(qs):
-            self.links[i+1].setJointQ(q)
+        for child, q in zip(self.joints.values(), qs):
+            self.links[child].setJointQ(q)
+        self.joint_moved.emit()
 
     def hideCoM(self):
         for name, link in self.links.items():
@@ -38,6 +38,7 @@ class ShortcutsHelpDialog(QDialog):
                     ("Ctrl + Down Arrow", "Zoom out (time axis, larger step)"),
                     ("Shift + Up Arrow", "Zoom in (time axis, even larger step)"),
                     ("Shift + Down Arrow", "Zoom out (time axis, even larger step)"),
+                    ("Space", "Play / pause"),
                 ]
             },
             {
@@ -58,6 +59,7 @@ class ShortcutsHelpDialog(QDialog):
                 "shortcuts": [
                     ("Ctrl + N", "Add new subplot"),
                     ("Ctrl + T", "Add new plot tab"),
+                    ("Ctrl + H", "Toggle snap hover readout"),
                     ("Ctrl + S", "Save plotlist for current tab"),
                     ("Ctrl + Shift + O", "Load plotlist for current tab"),
                 ]
@@ -13,6 +13,12 @@ import pickle
 import numpy as np
 from data_model import DataItem
 from custom_plot_item import CustomPlotItem
+from trace_plot_item import TracePlotItem
+from hover_readout import HoverReadout
+from event_markers import EventMarkerItem
+from maths.recipes import recipe_to_dict
+import render_backend
+import timebase
 
 logger = get_logger(__name__)
 
@@ -50,6 +56,7 @@ class SubPlotWidget(QWidget):
         # NOTE: The line below was pg.PlotWidget(), but there's a bug internal to pyqtgraph. See:
         #  https://github.com/pyqtgraph/pyqtgraph/issues/1854
         self.pw = PatchedPlotWidget()
+        render_backend.apply_backend(self.pw)
         # Adding stretch below ensures that the plow widget takes up as much space as possible
         # (labels take up only the minimum space possible)
         v_box.addWidget(self.pw, stretch=1)
@@ -73,6 +80,10 @@ class SubPlotWidget(QWidget):
         self.cursor = pg.InfiniteLine(pos=0, movable=False, pen='r')
         self.pw.addItem(self.cursor)
 
+        # Errors and warnings of the text log.
+        self._event_markers = EventMarkerItem()
+        self.pw.addItem(self._event_markers, ignoreBounds=True)
+
         self._traces: List[CustomPlotItem] = []
 
         # We can just override the menu of the ViewBox here but I think a better solution
@@ -83,6 +94,9 @@ class SubPlotWidget(QWidget):
 
         self.pw.scene().sigMouseClicked.connect(self._on_scene_mouse_click_event)
 
+        self._hover_readout = HoverReadout(self)
+        self._hover_readout.set_enabled(getattr(self.parent().plot_manager(), 'hover_readout_enabled', False))
+
         # Drop indicator for visual feedback during drag-and-drop of labels
         self._drop_indicator = QFrame(self)
         self._drop_indicator.setFrameShape(QFrame.VLine)
@@ -98,6 +112,10 @@ class SubPlotWidget(QWidget):
     def move_cursor(self, time):
         self.cursor.setValue(time)
 
+    def set_events(self, times, severities):
+        """ Mark text log events at `times` (None clears them). See `event_markers`. """
+        self._event_markers.set_events(times, severities)
+
     def set_xlimits(self, xmin, xmax):
         self.set_xlimit_min(xmin)
         self.set_xlimit_max(xmax)
@@ -133,6 +151,11 @@ class SubPlotWidget(QWidget):
 
         return menu
 
+    @property
+    def traces(self):
+        """The labels (CustomPlotItem) of the traces of the subplot, in order"""
+        return list(self._traces)
+
     @property
     def _cidx(self):
         return len(self._traces)
@@ -475,14 +498,13 @@ class SubPlotWidget(QWidget):
             logger.error(f"y_data for '{name}' is None. Aborting plot.")
             return
 
-        item = self.pw.getPlotItem().plot(x=source.time,
-                                          y=y_data,
-                                          pen=pg.mkPen(color=self._get_color(self._cidx),
-                                                       width=CustomPlotItem.PEN_WIDTH),
-                                          name=name,
-                                          # clipToView=True,
-                                          autoDownsample=True,
-                                          downsampleMethod='peak')
+        # Clipping and decimation are done by the item using the source's timebase.
+        item = TracePlotItem(timebase.for_source(source),
+                             y_data,
+                             pen=pg.mkPen(color=self._get_color(self._cidx),
+                                          width=CustomPlotItem.PEN_WIDTH),
+                             name=name)
+        self.pw.getPlotItem().addItem(item)
 
         label = CustomPlotItem(self, item, source, self.parent().plot_manager()._tick)
         self._traces.append(label)
@@ -491,7 +513,11 @@ class SubPlotWidget(QWidget):
         # Connect signals for the new label
         # Time changed connection is fine
         self.parent().plot_manager().timeValueChanged.connect(label.on_time_changed)
-        source.timeChanged.connect(label.on_source_time_changed)
+        # Not all sources support a time offset (e.g. those used in tests)
+        if hasattr(source, 'timeChanged'):
+            source.timeChanged.connect(label.on_source_time_changed)
+        if hasattr(source.model(), 'derivedInvalidated'):
+            source.model().derivedInvalidated.connect(label.on_derived_invalidated)
 
         # Conditionally connect onClose for the source
         if hasattr(source, 'onClose') and callable(getattr(source, 'onClose', None)):
@@ -520,7 +546,10 @@ class SubPlotWidget(QWidget):
         logger.debug(f"remove_item called for label '{label.text()}' in subplot '{self.objectName()}', is_move_operation={is_move_operation}")
 
         # Disconnect the timeChanged signal
-        label.source.timeChanged.disconnect(label.on_source_time_changed)
+        if hasattr(label.source, 'timeChanged'):
+            label.source.timeChanged.disconnect(label.on_source_time_changed)
+        if hasattr(label.source.model(), 'derivedInvalidated'):
+            label.source.model().derivedInvalidated.disconnect(label.on_derived_invalidated)
 
         # Remove from pyqtgraph plot
         self.pw.removeItem(trace)
@@ -572,6 +601,7 @@ class SubPlotWidget(QWidget):
         # Replace the cursor. Such a hack
         self.cursor = pg.InfiniteLine(pos=x, movable=False, pen='r')
         self.pw.addItem(self.cursor)
+        self.pw.addItem(self._event_markers, ignoreBounds=True)
 
         # Remove labels also.
         while self._labels.count() > 0:
@@ -586,6 +616,9 @@ class SubPlotWidget(QWidget):
     def set_y_range(self, ymin, ymax):
         self.pw.setYRange(ymin, ymax, padding=0)
 
+    def has_trace(self, var_name, model):
+        return any(trace.var_name == var_name and trace.source.model() is model for trace in self._traces)
+
     def get_plot_info(self):
         """ This method should return a dictionary of information required to reproduce this
             plot """
@@ -598,6 +631,21 @@ class SubPlotWidget(QWidget):
         plot_info['yrange'] = y_range
         plot_info['traces'] = [trace.get_plot_spec() for trace in self._traces if trace.isVisible()]
 
+        # Store the recipes of derived traces (and of the derived variables they use) so the
+        # plotlist can be loaded on its own.
+        derived = dict()
+        for trace in self._traces:
+            model = trace.source.model()
+            if not trace.isVisible() or not hasattr(model, 'get_recipes'):
+                continue
+            for name, recipe in model.get_recipes([trace.var_name]):
+                try:
+                    derived.setdefault(name, recipe_to_dict(recipe, self.parent().plot_manager().file_index_of_model))
+                except ValueError as ex:
+                    logger.warning(f"Unable to save the recipe of '{name}': {ex}")
+        if derived:
+            plot_info['derived'] = derived
+
         return plot_info
 
     @staticmethod
@@ -626,6 +674,14 @@ class SubPlotWidget(QWidget):
         cb.setPixmap(self.grab())
         logger.info("Plot copied to clipboard.")
 
+    def update_render_backend(self, backend=None):
+        """Switch between the QPainter and OpenGL rendering backends (defaults to the preference)"""
+        return render_backend.apply_backend(self.pw, backend)
+
+    def set_hover_readout_enabled(self, enabled):
+        """Enable/disable the snap-to-sample hover readout"""
+        self._hover_readout.set_enabled(enabled)
+
     def update_cursor_settings(self):
         """Update cursor appearance from settings"""
         from PyQt5.QtCore import QSettings
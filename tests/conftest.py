@@ -0,0 +1,23 @@
+import sys
+import os
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from data_model import DataModel
+
+
+@pytest.fixture
+def make_model():
+    ''' Factory of `DataModel`s of the samples at `time`, given as a data frame or as columns. '''
+    def make(time, data_frame=None, source="test", **columns):
+        if data_frame is None:
+            data_frame = pd.DataFrame(columns)
+        return DataModel(SimpleNamespace(data_frame=data_frame, time=np.asarray(time), source=source))
+    return make
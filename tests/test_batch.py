@@ -0,0 +1,82 @@
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import batch
+from maths.recipes import Recipe, operation
+
+
+@operation("test_batch_fail")
+def fail(inputs, tb):
+    raise ValueError("bad cutoff frequency")
+
+NAMES = ["joint_0_pos", "joint_0_vel", "joint_1_pos", "joint_1_vel", "base_z"]
+
+
+def test_match_wildcard():
+    assert batch.match_variables(NAMES, "joint_*_vel") == ["joint_0_vel", "joint_1_vel"]
+
+
+def test_match_regex():
+    assert batch.match_variables(NAMES, r"^joint_\d_pos$", regex=True) == ["joint_0_pos", "joint_1_pos"]
+    with pytest.raises(ValueError):
+        batch.match_variables(NAMES, "(", regex=True)
+
+
+def test_output_name_template():
+    assert batch.format_output_name("{var}_{op}@{file}", "x", "filter", "log") == "x_filter@log"
+    with pytest.raises(ValueError):
+        batch.format_output_name("{unknown}", "x", "filter")
+
+
+@pytest.mark.parametrize("pool", ["threads", "processes"])
+def test_batch_run(pool, make_model):
+    frame = pd.DataFrame({name: np.arange(100.) * (i + 1) for i, name in enumerate(NAMES)})
+    model = make_model(0.01 * np.arange(100), frame)
+
+    items = [batch.BatchItem(model, name, f"Int({name})", Recipe("integrate", {}, ((None, name),)))
+             for name in batch.match_variables(NAMES, "joint_*")]
+    executor = ThreadPoolExecutor(2) if pool == "threads" else None
+    run = batch.BatchRun(items, executor)
+    assert not run.done()
+    run.submit()
+    results = run.results()
+    assert run.done() and run.done_count == len(items) == len(results)
+
+    model.add_derived_recipes([(item.output_name, item.recipe, value) for item, value in results])
+    assert model._derived_graph.is_memoized("Int(joint_1_vel)")
+    np.testing.assert_allclose(model.get_data_by_name("Int(joint_1_vel)"),
+                               np.cumsum(4 * np.arange(100.) * np.r_[0, np.full(99, 0.01)]))
+
+
+def test_batch_inputs(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("doubled", Recipe("expression", {'text': "x0 * 2", 'variables': ["x0"]}, ((None, "x"),)))
+    model.add_derived_recipe("broken", Recipe("test_batch_fail", {}, ((None, "x"),)))
+    items = [batch.BatchItem(model, name, f"Int({name})", Recipe("integrate", {}, ((None, name),)))
+             for name in ["doubled", "broken", "missing", "x"]]
+
+    run = batch.BatchRun(items, ThreadPoolExecutor(2))
+    run.submit()
+    # Derived inputs were evaluated before submitting; those that fail only fail their own item.
+    assert model._derived_graph.is_memoized("doubled")
+    results = dict((item.var_name, value) for item, value in run.results())
+    assert run.done() and sorted(results) == ["doubled", "x"]
+    np.testing.assert_allclose(results["doubled"], 2 * results["x"])
+
+
+def test_batch_cancelled_before_submit(make_model):
+    model = make_model(0.01 * np.arange(10), x=np.arange(10.))
+    run = batch.BatchRun([batch.BatchItem(model, "x", "Int(x)", Recipe("integrate", {}, ((None, "x"),)))],
+                         ThreadPoolExecutor(1))
+    run.cancel()
+    run.submit()
+    assert run.done() and run.results() == []
@@ -0,0 +1,151 @@
+import sys
+import os
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.spatial.transform import Rotation
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+# The geometry modules need urdfpy and PyOpenGL.
+try:
+    from data_linked_geometry import DataLinkedGeometry, read_pose_table, rotations_to_axis_angles
+    from geometry_helpers import axis_angle_from_quat, axis_angles_from_quats
+    from robot_geometry import RobotModel
+except ImportError as e:
+    print(f"Failed to import the geometry modules: {e}")
+    DataLinkedGeometry = None
+
+from maths.recipes import Recipe
+
+if DataLinkedGeometry is None:
+    pytestmark = pytest.mark.skip(reason="The geometry modules are not importable, skipping all tests in this file.")
+
+
+def random_quats(n):
+    quats = Rotation.random(n, random_state=0).as_quat()
+    # Not normalized, as logged quaternions may not be.
+    return quats * np.random.default_rng(0).uniform(0.5, 2., (n, 1))
+
+
+def test_axis_angles_match_scalar_conversion():
+    quats = random_quats(500)
+    axes, angles = axis_angles_from_quats(quats)
+    assert axes.shape == (len(quats), 3) and angles.shape == (len(quats),)
+    for quat, axis, angle in zip(quats, axes, angles):
+        expected_axis, expected_angle = axis_angle_from_quat(quat)
+        np.testing.assert_allclose(axis, expected_axis, atol=1e-9)
+        np.testing.assert_allclose(angle, expected_angle, atol=1e-9)
+
+    # Zero and NaN quaternions (which `axis_angle_from_quat` rejects) are the identity.
+    axes, angles = axis_angles_from_quats([[0., 0., 0., 0.], [np.nan] * 4, [0., 0., 0., 1.]])
+    np.testing.assert_array_equal(angles, 0.)
+    np.testing.assert_array_equal(axes, [[0., 0., 1.]] * 3)
+
+
+class PoseTable(DataLinkedGeometry):
+    ''' The pose table of `names` (with a quaternion from column `rotation` on), without any geometry. '''
+
+    def __init__(self, data_source, names, rotation=None):
+        self._names = names
+        self._rotation = rotation
+        self.built = []
+        DataLinkedGeometry.__init__(self, data_source)
+
+    def _build_pose_table(self, model, first=0):
+        self.built.append(first)
+        table = self._read_pose_table(model, self._names, first)
+        if self._rotation is not None:
+            rotations_to_axis_angles(table, self._rotation)
+        return table
+
+
+def pose_frame(start, stop):
+    ticks = np.arange(start, stop)
+    quats = random_quats(stop)[start:]
+    frame = pd.DataFrame({'x': ticks.astype(float), 'qx': quats[:, 0], 'qy': quats[:, 1], 'qz': quats[:, 2],
+                          'qw': quats[:, 3]})
+    return frame, 0.01 * ticks
+
+
+def expected_row(frame, i):
+    axis, angle = axis_angle_from_quat(frame.loc[i, ['qx', 'qy', 'qz', 'qw']].to_numpy(dtype=float))
+    return [frame.loc[i, 'x'], angle, *axis]
+
+
+def test_pose_table_is_extended_and_invalidated(make_model):
+    frame, time = pose_frame(0, 100)
+    model = make_model(time, frame)
+    model.add_derived_recipe("y", Recipe("expression", {'text': "x0 * 2", 'variables': ["x0"]}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("expression", {'text': "x0 + 1", 'variables': ["x0"]}, ((None, "y"),)))
+    source = SimpleNamespace(model=lambda: model)
+    table = PoseTable(source, ["x", "qx", "qy", "qz", "qw", "missing"], rotation=1)
+    derived = PoseTable(source, ["z"])
+
+    np.testing.assert_allclose(table._pose_at_tick(10), expected_row(frame, 10) + [0.])
+    assert derived._pose_at_tick(10) == [21.]
+    assert table.built == [0]
+
+    # Appended samples only add rows. The values of derived variables may change before the new
+    # samples (e.g. centered windows), so tables that read them are rebuilt.
+    new_frame, new_time = pose_frame(100, 130)
+    model.append_data(new_frame, new_time)
+    assert table.built == [0, 100]
+    assert len(table._pose_table) == 130
+    np.testing.assert_allclose(table._pose_at_tick(10), expected_row(frame, 10) + [0.])
+    np.testing.assert_allclose(table._pose_at_tick(120), expected_row(new_frame, 20) + [0.])
+    assert derived._pose_table is None
+    assert derived._pose_at_tick(120) == [241.]
+    assert derived.built == [0, 0]
+
+    # Tables that read a derived variable that changes are rebuilt when next used.
+    model.remove_derived_variable("y")
+    assert derived._pose_table is None
+    assert table._pose_table is not None
+    assert derived._pose_at_tick(120) == [0.]
+    assert derived.built == [0, 0, 0]
+
+
+URDF = """<robot name="test">
+  <link name="base"/>
+  <link name="second"/>
+  <link name="first"/>
+  <link name="tool"/>
+  <joint name="j_first" type="revolute">
+    <parent link="base"/><child link="first"/><axis xyz="0 0 1"/>
+    <limit lower="-1" upper="1" effort="1" velocity="1"/>
+  </joint>
+  <joint name="j_tool" type="fixed">
+    <parent link="first"/><child link="tool"/>
+  </joint>
+  <joint name="j_second" type="prismatic">
+    <parent link="base"/><child link="second"/><axis xyz="1 0 0"/>
+    <limit lower="-1" upper="1" effort="1" velocity="1"/>
+  </joint>
+</robot>
+"""
+
+
+def test_set_joint_qs_follows_joint_order(tmp_path, monkeypatch):
+    path = tmp_path / "test.urdf"
+    path.write_text(URDF)
+    robot = RobotModel(str(path))
+    assert list(robot.joints) == ["j_first", "j_second"]
+    moved = []
+    robot.joint_moved.connect(lambda: moved.append(True))
+    positions = {}
+    for name, link in robot.links.items():
+        monkeypatch.setattr(link, "setJointQ", lambda q, name=name: positions.__setitem__(name, q))
+
+    robot.setJointQs([0.5, -0.25])
+    assert positions == {"first": 0.5, "second": -0.25}
+    assert moved == [True]
+
+    # A wrong number of positions is rejected.
+    positions.clear()
+    robot.setJointQs([0.] * 3)
+    assert positions == {}
@@ -0,0 +1,133 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import derived_cache
+from maths.derived_cache import DiskCache
+from maths.recipes import Recipe, operation
+
+calls = []
+
+
+@operation("test_cached_scale")
+def scale(inputs, tb, gain):
+    calls.append(gain)
+    return inputs[0] * gain
+
+
+@operation("test_cached_batch", batched=True)
+def batch(inputs, tb, gain):
+    calls.append(inputs[0].shape)
+    return inputs[0] * gain
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text("x\n")
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    calls.clear()
+    cache = DiskCache(str(tmp_path / "cache"), 1 << 20)
+    derived_cache.set_cache(cache)
+    yield cache
+    derived_cache.set_cache(None)
+
+
+# The columns and time of the models of the tests.
+COLUMNS = {'x': np.arange(100.), 'w': -np.arange(100.)}
+TIME = 0.01 * np.arange(100)
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path), 1 << 20)
+    assert cache.get(("a", 1)) is None
+    cache.put(("a", 1), np.arange(10.))
+    value = cache.get(("a", 1))
+    assert isinstance(value, np.memmap)
+    np.testing.assert_array_equal(value, np.arange(10.))
+
+    # A new instance finds the existing files.
+    reopened = DiskCache(str(tmp_path), 1 << 20)
+    assert len(reopened) == 1
+    np.testing.assert_array_equal(reopened.get(("a", 1)), np.arange(10.))
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    value = np.zeros(1000)
+    cache = DiskCache(str(tmp_path), 3 * value.nbytes + 500)
+    for key in ("a", "b", "c"):
+        cache.put(key, value)
+    cache.get("a")
+    cache.put("d", value)
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache.nbytes <= cache.limit
+    assert len(os.listdir(tmp_path)) == 3
+
+    # Lowering the limit evicts right away.
+    cache.set_limit(value.nbytes + 500)
+    assert len(cache) == 1 and cache.get("d") is not None
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_reopened_log_reuses_cached_values(cache, log_file, make_model):
+    model = make_model(TIME, source=log_file, **COLUMNS)
+    model.add_derived_recipe("y", Recipe("test_cached_scale", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_cached_scale", {'gain': 3.}, ((None, "y"),)))
+    np.testing.assert_array_equal(model.get_data_by_name("z"), 6. * np.arange(100))
+    assert calls == [2., 3.]
+
+    reopened = make_model(TIME, source=log_file, **COLUMNS)
+    reopened.add_derived_recipe("y", Recipe("test_cached_scale", {'gain': 2.}, ((None, "x"),)))
+    reopened.add_derived_recipe("z", Recipe("test_cached_scale", {'gain': 3.}, ((None, "y"),)))
+    np.testing.assert_array_equal(reopened.get_data_by_name("z"), 6. * np.arange(100))
+    assert calls == [2., 3.]
+
+    # Different parameters (here of an input) are a different value.
+    other = make_model(TIME, source=log_file, **COLUMNS)
+    other.add_derived_recipe("y", Recipe("test_cached_scale", {'gain': 4.}, ((None, "x"),)))
+    other.add_derived_recipe("z", Recipe("test_cached_scale", {'gain': 3.}, ((None, "y"),)))
+    np.testing.assert_array_equal(other.get_data_by_name("z"), 12. * np.arange(100))
+    assert calls == [2., 3., 4., 3.]
+
+
+def test_modified_file_is_recomputed(cache, log_file, make_model):
+    recipe = Recipe("test_cached_scale", {'gain': 2.}, ((None, "x"),))
+    make_model(TIME, source=log_file, **COLUMNS).add_derived_recipe("y", recipe).data
+    st = os.stat(log_file)
+    os.utime(log_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    make_model(TIME, source=log_file, **COLUMNS).add_derived_recipe("y", recipe).data
+    assert calls == [2., 2.]
+
+
+def test_sources_without_a_file_are_not_cached(cache, make_model):
+    recipe = Recipe("test_cached_scale", {'gain': 2.}, ((None, "x"),))
+    make_model(TIME, source="not a file", **COLUMNS).add_derived_recipe("y", recipe).data
+    make_model(TIME, source="not a file", **COLUMNS).add_derived_recipe("y", recipe).data
+    assert calls == [2., 2.]
+    assert len(cache) == 0
+
+
+def test_batch_uses_cached_columns(cache, log_file, make_model):
+    model = make_model(TIME, source=log_file, **COLUMNS)
+    model.add_derived_recipe("x2", Recipe("test_cached_batch", {'gain': 2.}, ((None, "x"),)))
+    model.materialize_derived(["x2"])
+    assert calls == [(100,)]
+
+    reopened = make_model(TIME, source=log_file, **COLUMNS)
+    reopened.add_derived_recipe("x2", Recipe("test_cached_batch", {'gain': 2.}, ((None, "x"),)))
+    reopened.add_derived_recipe("w2", Recipe("test_cached_batch", {'gain': 2.}, ((None, "w"),)))
+    reopened.materialize_derived(["x2", "w2"])
+    # Only the column that wasn't cached is computed.
+    assert calls == [(100,), (100, 1)]
+    np.testing.assert_array_equal(reopened.get_data_by_name("w2"), -2. * np.arange(100))
@@ -0,0 +1,84 @@
+import sys
+import os
+import numpy as np
+import pytest
+import pyqtgraph as pg
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import event_markers
+from event_markers import EventMarkerItem, bin_events, select_events
+import text_log_decode as tld
+import timebase
+
+
+def make_events(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0., 100., n), rng.integers(tld.Severity.Critical, tld.Severity.Warn + 1, n).astype(np.int8)
+
+
+def test_bin_events():
+    times, severities = make_events(5000)
+    order = np.argsort(times)
+    times, severities = times[order], severities[order]
+    bins, worst, counts = bin_events(times, severities, 20., 30., 37)
+
+    visible = (times >= 20.) & (times <= 30.)
+    expected_bins = np.minimum(((times[visible] - 20.) * 3.7).astype(int), 36)
+    assert list(bins) == sorted(set(expected_bins))
+    assert counts.sum() == visible.sum()
+    for b, w, c in zip(bins, worst, counts):
+        in_bin = expected_bins == b
+        assert c == in_bin.sum() and w == severities[visible][in_bin].min()
+
+    assert len(bin_events(times, severities, 200., 300., 10)[0]) == 0
+
+
+def test_select_events():
+    tb = timebase.from_array(0.01 * np.arange(1000)).shifted(5.)
+    ticks = np.array([-1, 0, 10, 20, 999, 1000])
+    severities = np.array([1, 2, 3, 4, 1, 1], dtype=np.int8)
+    times, kept = select_events(ticks, severities, tb)
+    np.testing.assert_allclose(times, [5., 5.1, 14.99])
+    assert list(kept) == [2, 3, 1]
+
+
+@pytest.fixture
+def plot(qapp):
+    widget = pg.PlotWidget()
+    widget.resize(400, 200)
+    item = EventMarkerItem()
+    widget.addItem(item, ignoreBounds=True)
+    widget.setYRange(0., 1., padding=0)
+    return widget, item
+
+
+def drawn(monkeypatch, widget):
+    calls = []
+    monkeypatch.setattr(event_markers, "draw_markers", lambda painter, xs, *args: calls.append(np.asarray(xs)))
+    widget.show()
+    widget.grab()
+    return np.concatenate(calls) if calls else np.empty(0)
+
+
+def test_dense_markers_are_binned(plot, monkeypatch):
+    widget, item = plot
+    item.set_events(*make_events(200_000))
+    widget.setXRange(0., 100., padding=0)
+    xs = drawn(monkeypatch, widget)
+    # At most one marker per pixel.
+    assert 0 < len(xs) <= widget.width()
+    assert widget.getViewBox().viewRange()[1] == pytest.approx([0., 1.])
+
+
+def test_sparse_markers_are_culled(plot, monkeypatch):
+    widget, item = plot
+    times, severities = make_events(200_000)
+    item.set_events(times, severities)
+    widget.setXRange(50., 50.001, padding=0)
+    xs = drawn(monkeypatch, widget)
+    x0, x1 = widget.getViewBox().viewRange()[0]
+    assert sorted(xs) == sorted(times[(times >= x0) & (times <= x1)])
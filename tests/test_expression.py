@@ -0,0 +1,69 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import expression
+from maths.expression import compile_expression, ExpressionError
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    # Long enough to span several blocks and threads, with a partial block at the end.
+    n = 3 * expression.MIN_PARALLEL_SIZE + 123
+    return {'x0': rng.normal(size=n), 'x1': rng.uniform(1., 2., size=n)}
+
+
+@pytest.mark.parametrize("text, reference", [
+    ("x0 + 3 * x1", lambda x0, x1: x0 + 3 * x1),
+    ("sqrt(x0^2 + x1^2) * 0.5", lambda x0, x1: np.sqrt(x0 ** 2 + x1 ** 2) * 0.5),
+    ("-x0^2 + x1", lambda x0, x1: -x0 ** 2 + x1),
+    ("sin(x0) * cos(x1) / x1 - atan2(x0, x1)", lambda x0, x1: np.sin(x0) * np.cos(x1) / x1 - np.arctan2(x0, x1)),
+    ("if(x0 > 0, x0, -x1)", lambda x0, x1: np.where(x0 > 0, x0, -x1)),
+    ("log(x1, 10) + log(x1)", lambda x0, x1: np.log10(x1) + np.log(x1)),
+    ("max(x0, x1) - min(x0, x1)", lambda x0, x1: np.abs(x0 - x1)),
+    ("(x0 > 0) and (x1 < 1.5)", lambda x0, x1: (x0 > 0) & (x1 < 1.5)),
+    ("PI * x0 + E", lambda x0, x1: np.pi * x0 + np.e),
+    ("x1", lambda x0, x1: x1),
+])
+def test_matches_numpy(values, text, reference):
+    expr = compile_expression(text)
+    result = expr.evaluate(values)
+    assert result.dtype == np.float64
+    np.testing.assert_allclose(result, reference(values['x0'], values['x1']))
+
+
+def test_variables_in_order_of_appearance():
+    assert compile_expression("x2 * sin(x0) + x2 - x1").variables() == ['x2', 'x0', 'x1']
+
+
+def test_scratch_buffers_are_reused():
+    # A long chain of operators only needs a couple of scratch buffers.
+    expr = compile_expression(" + ".join(f"x0 * {i}" for i in range(20)))
+    assert expr._n_slots <= 3
+
+
+@pytest.mark.parametrize("text", ["x0 +", "foo(x0)", "x0[1]", "sin(x0, x1)", "x0 < x1 < 2"])
+def test_invalid_expressions(text):
+    with pytest.raises(ExpressionError):
+        compile_expression(text)
+
+
+def test_evaluate_errors():
+    expr = compile_expression("x0 + x1")
+    with pytest.raises(ExpressionError):
+        expr.evaluate({'x0': np.zeros(3)})
+    with pytest.raises(ExpressionError):
+        expr.evaluate({'x0': np.zeros(3), 'x1': np.zeros(4)})
+
+
+def test_threaded_evaluation(values, monkeypatch):
+    monkeypatch.setattr(expression, 'MAX_THREADS', 4)
+    result = compile_expression("x0 * x1 - x0").evaluate(values)
+    np.testing.assert_allclose(result, values['x0'] * values['x1'] - values['x0'])
@@ -0,0 +1,48 @@
+import sys
+import os
+import numpy as np
+import pytest
+from scipy import signal
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import filter_engine
+import timebase
+
+
+@pytest.fixture
+def block():
+    return np.random.default_rng(0).normal(size=(5000, 6))
+
+
+@pytest.mark.parametrize("filtfilt", [False, True])
+def test_block_matches_column_by_column(block, filtfilt, monkeypatch):
+    # Force the threaded path.
+    monkeypatch.setattr(filter_engine, 'MIN_PARALLEL_SIZE', 0)
+    monkeypatch.setattr(filter_engine, 'MAX_THREADS', 4)
+    sos = filter_engine.design_sos(4, "low", 10., 500.)
+    result = filter_engine.filter_columns(sos, block, filtfilt)
+
+    fn = signal.sosfiltfilt if filtfilt else signal.sosfilt
+    for col in range(block.shape[1]):
+        np.testing.assert_allclose(result[:, col], fn(sos, block[:, col]))
+
+
+def test_design_is_cached():
+    assert filter_engine.design_sos(8, "high", 5., 1000.) is filter_engine.design_sos(8, "high", 5., 1000.)
+
+
+def test_non_uniform_sampling_is_resampled():
+    rng = np.random.default_rng(1)
+    time = np.cumsum(rng.uniform(0.0019, 0.0021, size=20000))
+    tb = timebase.from_array(time)
+    assert not tb.is_uniform
+
+    slow = np.sin(2 * np.pi * 1. * time)
+    data = slow + 0.5 * np.sin(2 * np.pi * 200. * time)
+    result = filter_engine.apply_filter(data, tb, 4, "low", 20., True)
+    assert result.shape == data.shape
+    np.testing.assert_allclose(result[1000:-1000], slow[1000:-1000], atol=0.02)
@@ -0,0 +1,120 @@
+import sys
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import kinematics
+from kinematics import Joint, KinematicTree, link_poses
+
+
+def translation(x, y, z):
+    origin = np.eye(4)
+    origin[:3, 3] = [x, y, z]
+    return origin
+
+
+def planar_arm():
+    ''' Two unit links turning about z, and a slider along the y axis of a frame turned about x. '''
+    slider_origin = translation(0, 0, 1)
+    slider_origin[:3, :3] = Rotation.from_euler('x', 90, degrees=True).as_matrix()
+    return KinematicTree("base", [
+        Joint("shoulder", "revolute", "base", "upper", np.eye(4), np.array([0., 0., 1.]), -3., 3.),
+        Joint("elbow", "continuous", "upper", "lower", translation(1, 0, 0), np.array([0., 0., 1.]), None, None),
+        Joint("wrist", "fixed", "lower", "hand", translation(1, 0, 0), np.array([1., 0., 0.]), None, None),
+        Joint("slide", "prismatic", "base", "slider", slider_origin, np.array([0., 1., 0.]), 0., 0.5),
+    ])
+
+
+def test_planar_arm():
+    tree = planar_arm()
+    assert tree.movable_joints == ["shoulder", "elbow", "slide"]
+    assert [joint.name for joint in tree.chain("hand")] == ["shoulder", "elbow", "wrist"]
+
+    n = 1000
+    rng = np.random.default_rng(0)
+    q1, q2, s = rng.uniform(-2.5, 2.5, n), rng.uniform(-10, 10, n), rng.uniform(-1, 1, n)
+    poses = link_poses(tree, ["hand", "slider"], n, {"shoulder": q1, "elbow": q2, "slide": s})
+
+    hand = poses["hand"]
+    np.testing.assert_allclose(hand[0], np.cos(q1) + np.cos(q1 + q2), atol=1e-12)
+    np.testing.assert_allclose(hand[1], np.sin(q1) + np.sin(q1 + q2), atol=1e-12)
+    np.testing.assert_allclose(hand[2], 0, atol=1e-12)
+    yaw = Rotation.from_quat(hand[3:].T).as_euler('zyx')[:, 0]
+    np.testing.assert_allclose(np.cos(yaw - q1 - q2), 1)
+
+    # The slider is clamped to [0, 0.5] and moves along z once its frame is turned.
+    np.testing.assert_allclose(poses["slider"][2], 1 + np.clip(s, 0, 0.5), atol=1e-12)
+    np.testing.assert_allclose(poses["slider"][:2], 0, atol=1e-12)
+
+
+def test_floating_base_and_chunks(monkeypatch):
+    tree = planar_arm()
+    n = 50
+    rng = np.random.default_rng(1)
+    q = {"shoulder": rng.uniform(-1, 1, n)}
+    base_pos = rng.normal(size=(n, 3))
+    base_quat = rng.normal(size=(n, 4))
+    base_quat[0] = 0
+    monkeypatch.setattr(kinematics, "CHUNK_TICKS", 7)
+    hand = link_poses(tree, ["hand"], n, q, base_pos, base_quat)["hand"]
+
+    for i in range(n):
+        rotation = Rotation.from_quat(base_quat[i]) if i else Rotation.identity()
+        # The elbow is at 0, so the hand is 2 m along the upper arm.
+        expected = base_pos[i] + rotation.apply([2 * np.cos(q["shoulder"][i]), 2 * np.sin(q["shoulder"][i]), 0])
+        np.testing.assert_allclose(hand[:3, i], expected, atol=1e-12)
+        yaw = Rotation.from_euler('z', q["shoulder"][i])
+        assert (rotation * yaw).approx_equal(Rotation.from_quat(hand[3:, i]))
+
+
+def test_from_urdf():
+    def joint(name, joint_type, parent, child, limit=None):
+        return SimpleNamespace(name=name, joint_type=joint_type, parent=parent, child=child,
+                               origin=translation(0, 0, 1), axis=[1., 0., 0.], limit=limit)
+
+    robot_info = SimpleNamespace(base_link=SimpleNamespace(name="trunk"), joints=[
+        joint("hip", "revolute", "trunk", "thigh", SimpleNamespace(lower=-1., upper=1.)),
+        joint("knee", "continuous", "thigh", "calf"),
+    ])
+    tree = KinematicTree.from_urdf(robot_info)
+    assert tree.links == ["trunk", "thigh", "calf"]
+    assert (tree.joints[0].lower, tree.joints[1].lower) == (-1., None)
+    with pytest.raises(KeyError):
+        tree.chain("foot")
+    calf = link_poses(tree, ["calf"], 1, {"hip": np.array([np.pi / 2])})["calf"]
+    # The hip is clamped to 1 rad.
+    np.testing.assert_allclose(calf[:3, 0], [0, -np.sin(1.), 1 + np.cos(1.)], atol=1e-12)
+
+
+def test_pose_recipes(make_model):
+    import pandas as pd
+    from maths.recipes import Recipe, recipe_from_dict, recipe_to_dict
+
+    kinematics.register_tree("planar_arm.urdf", planar_arm())
+    rng = np.random.default_rng(2)
+    frame = pd.DataFrame({"q.shoulder": rng.uniform(-2, 2, 120), "q.elbow": rng.uniform(-2, 2, 120)})
+    model = make_model(0.01 * np.arange(100), frame[:100], source="stream")
+    inputs = ((None, "q.shoulder"), (None, "q.elbow"))
+    recipes = []
+    for field in kinematics.POSE_FIELDS:
+        params = {'urdf': "planar_arm.urdf", 'link': "hand", 'field': field, 'joint_pattern': "q.{}",
+                  'joints': ["shoulder", "elbow"]}
+        recipe = recipe_from_dict(recipe_to_dict(Recipe("fk", params, inputs)))
+        recipes.append((kinematics.pose_variable_name("hand", field), recipe, None))
+    model.add_derived_recipes(recipes)
+    model.materialize_derived([name for name, _, _ in recipes])
+
+    # Appended samples extend the poses.
+    model.append_data(frame[100:].reset_index(drop=True), 0.01 * np.arange(100, 120))
+    assert model._derived_graph.is_memoized("fk.hand.x")
+    expected = link_poses(planar_arm(), ["hand"], 120, {"shoulder": frame["q.shoulder"].to_numpy(),
+                                                        "elbow": frame["q.elbow"].to_numpy()})["hand"]
+    for field, values in zip(kinematics.POSE_FIELDS, expected):
+        np.testing.assert_allclose(model.get_data_by_name(f"fk.hand.{field}"), values, atol=1e-12)
@@ -0,0 +1,108 @@
+import sys
+import os
+import numpy as np
+import pytest
+from PyQt5.QtCore import QObject
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import timebase
+from playback import PlaybackController, PlaybackWidget
+
+
+class MockPlotManager(QObject):
+    def __init__(self, time_base):
+        QObject.__init__(self)
+        self.timebase = time_base
+        self.tick = 0
+        self.time = 0.
+        self.ticks_set = []
+
+    def set_tick_from_time(self, t):
+        self.tick = self.timebase.nearest_tick(t)
+        self.time = self.timebase.at(self.tick).item()
+        self.ticks_set.append(self.tick)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def player(qapp):
+    # 10 s at 1 kHz.
+    plot_manager = MockPlotManager(timebase.from_array(0.001 * np.arange(10001)))
+    clock = Clock()
+    return plot_manager, clock, PlaybackController(plot_manager, clock)
+
+
+def test_playback_follows_the_clock(player):
+    plot_manager, clock, controller = player
+    playing = []
+    controller.playingChanged.connect(playing.append)
+    controller.play()
+    assert controller.is_playing and playing == [True]
+
+    # Slow frames skip ticks rather than falling behind.
+    for dt in (0.016, 0.1, 0.5):
+        clock.now += dt
+        controller.advance()
+    assert plot_manager.ticks_set == [16, 116, 616]
+
+    # A frame that doesn't reach the next tick doesn't move the cursor.
+    clock.now += 0.0002
+    controller.advance()
+    assert len(plot_manager.ticks_set) == 3
+
+    controller.set_speed(4.)
+    clock.now += 0.25
+    controller.advance()
+    assert plot_manager.tick == 1616
+
+    # Moving the cursor while playing carries on from there.
+    plot_manager.set_tick_from_time(2.)
+    clock.now += 0.25
+    controller.advance()
+    assert plot_manager.tick == 2000
+    clock.now += 0.25
+    controller.advance()
+    assert plot_manager.tick == 3000
+
+    # Playback stops at the end, and starts over from the beginning.
+    clock.now += 10.
+    controller.advance()
+    assert plot_manager.tick == 10000 and not controller.is_playing and playing == [True, False]
+    controller.play()
+    clock.now += 0.5
+    controller.advance()
+    assert plot_manager.tick == 2000
+
+
+def test_frame_rate_and_widget(player):
+    plot_manager, clock, controller = player
+    widget = PlaybackWidget(controller)
+    rates = []
+    controller.frameRateMeasured.connect(rates.append)
+    controller.toggle()
+    for _ in range(30):
+        clock.now += 0.02
+        controller.advance()
+    assert rates == [pytest.approx(50.)]
+    assert widget._frame_rate_label.text() == "50 fps"
+
+    widget._speed_box.setCurrentIndex(widget._speed_box.findData(2.))
+    assert controller.speed == 2.
+    controller.toggle()
+    assert not controller.is_playing and widget._frame_rate_label.text() == ""
+
+    # Nothing to play without a file.
+    plot_manager.timebase = None
+    controller.play()
+    assert not controller.is_playing
@@ -0,0 +1,165 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import recipes, resample
+from maths.recipes import Recipe, operation
+
+calls = []
+
+
+@operation("test_scale")
+def scale(inputs, tb, gain):
+    calls.append(gain)
+    return inputs[0] * gain
+
+
+@operation("test_sum")
+def add(inputs, tb):
+    calls.append("sum")
+    return inputs[0] + inputs[1]
+
+
+@operation("test_batch", batched=True)
+def batch(inputs, tb, gain):
+    calls.append(inputs[0].shape)
+    return inputs[0] * gain
+
+
+@operation("test_fail")
+def fail(inputs, tb):
+    raise ValueError("bad cutoff frequency")
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    calls.clear()
+    limit = recipes.cache_limit()
+    yield
+    recipes.set_cache_limit(limit)
+
+
+def test_evaluated_lazily_and_memoized(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("y", Recipe("test_scale", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_scale", {'gain': 3.}, ((None, "y"),)))
+    assert calls == []
+
+    np.testing.assert_array_equal(model.get_data_by_name("z"), 6. * np.arange(100))
+    assert calls == [2., 3.]
+    model.get_data_by_name("z")
+    assert calls == [2., 3.]
+
+    # A time offset doesn't change variables that only depend on their own file.
+    model.set_time_offset(1.)
+    model.get_data_by_name("z")
+    assert calls == [2., 3.]
+
+
+def test_time_offset_invalidates_resampled_dependents(make_model):
+    reference = make_model(0.01 * np.arange(100), a=np.zeros(100))
+    other = make_model(0.02 * np.arange(50), b=np.arange(50.))
+    reference.add_derived_recipe("s", Recipe("test_sum", {}, ((None, "a"), (other, "b")), resample.HOLD))
+    reference.add_derived_recipe("t", Recipe("test_scale", {'gain': 1.}, ((None, "s"),)))
+
+    invalidated = []
+    reference.derivedInvalidated.connect(invalidated.append)
+
+    np.testing.assert_array_equal(reference.get_data_by_name("t")[:4], [0., 0., 1., 1.])
+    other.set_time_offset(0.02)
+    assert invalidated == ["s", "t"]
+    np.testing.assert_array_equal(reference.get_data_by_name("t")[:4], [0., 0., 0., 0.])
+    assert calls == ["sum", 1., "sum", 1.]
+
+
+def test_removing_a_recipe_invalidates_dependents(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("y", Recipe("test_scale", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_scale", {'gain': 3.}, ((None, "y"),)))
+    model.get_data_by_name("z")
+    invalidated = []
+    model.derivedInvalidated.connect(invalidated.append)
+
+    model.remove_derived_variable("y")
+    assert invalidated == ["z"]
+    assert not model._derived_graph.is_memoized("z")
+    assert model.get_data_by_name("z") is None
+
+    # A replacement is picked up by the dependents.
+    model.add_derived_recipe("y", Recipe("test_scale", {'gain': 5.}, ((None, "x"),)))
+    np.testing.assert_array_equal(model.get_data_by_name("z"), 15. * np.arange(100))
+
+
+def test_input_errors_propagate(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("y", Recipe("test_fail", {}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_scale", {'gain': 3.}, ((None, "y"),)))
+    model.add_derived_recipe("w", Recipe("test_scale", {'gain': 3.}, ((None, "nope"),)))
+    with pytest.raises(ValueError, match="bad cutoff frequency"):
+        model._derived_graph.value("z")
+    with pytest.raises(KeyError, match="unknown variable 'nope'"):
+        model._derived_graph.value("w")
+
+
+def test_eviction_recomputes(make_model):
+    model = make_model(0.01 * np.arange(1000), x=np.arange(1000.))
+    model.add_derived_recipe("y", Recipe("test_scale", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_scale", {'gain': 3.}, ((None, "x"),)))
+    recipes.set_cache_limit(1000 * 8)
+
+    model.get_data_by_name("y")
+    model.get_data_by_name("z")
+    assert not model._derived_graph.is_memoized("y")
+    assert model._derived_graph.is_memoized("z")
+
+    np.testing.assert_array_equal(model.get_data_by_name("y"), 2. * np.arange(1000))
+    assert calls == [2., 3., 2.]
+
+
+def test_builtin_operations(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("d", Recipe("differentiate", {}, ((None, "x"),)))
+    model.add_derived_recipe("e", Recipe("expression", {'text': "x0 ^ 2", 'variables': ["x0"]}, ((None, "d"),)))
+    np.testing.assert_allclose(model.get_data_by_name("e")[1:], 1e4)
+
+
+def test_dict_round_trip(make_model):
+    other = make_model(0.01 * np.arange(10), b=np.zeros(10))
+    recipe = Recipe("test_sum", {}, ((None, "a"), (other, "b")), resample.LINEAR)
+
+    spec = recipes.recipe_to_dict(recipe, {other: 1}.get)
+    assert spec['inputs'] == ["a", {'var': "b", 'file': 1}]
+    assert recipes.recipe_from_dict(spec, {1: other}.get) == recipe
+    with pytest.raises(ValueError):
+        recipes.recipe_to_dict(recipe)
+
+
+def test_materialize_computes_each_variable_once(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.))
+    model.add_derived_recipe("y", Recipe("test_scale", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("z", Recipe("test_scale", {'gain': 3.}, ((None, "y"),)))
+    model.add_derived_recipe("w", Recipe("test_sum", {}, ((None, "y"), (None, "z"))))
+    assert [name for name, _ in model.get_recipes(["w"])] == ["y", "z", "w"]
+
+    model.materialize_derived(["w", "z"])
+    assert sorted(calls, key=str) == [2., 3., "sum"]
+    model.materialize_derived(["w"])
+    assert len(calls) == 3
+
+
+def test_batched_operations_are_evaluated_together(make_model):
+    model = make_model(0.01 * np.arange(100), x=np.arange(100.), y=np.ones(100))
+    model.add_derived_recipe("a", Recipe("test_batch", {'gain': 2.}, ((None, "x"),)))
+    model.add_derived_recipe("b", Recipe("test_batch", {'gain': 2.}, ((None, "y"),)))
+    model.add_derived_recipe("c", Recipe("test_batch", {'gain': 3.}, ((None, "y"),)))
+
+    model.materialize_derived(["a", "b", "c"])
+    assert sorted(calls) == [(100,), (100, 2)]
+    np.testing.assert_array_equal(model.get_data_by_name("b"), 2. * np.ones(100))
+    np.testing.assert_array_equal(model.get_data_by_name("c"), 3. * np.ones(100))
@@ -0,0 +1,59 @@
+import sys
+import os
+import numpy as np
+import pytest
+import pyqtgraph as pg
+from PyQt5.QtWidgets import QOpenGLWidget
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import render_backend
+import timebase
+from trace_plot_item import TracePlotItem
+
+
+@pytest.fixture
+def forced_opengl(monkeypatch):
+    # As `main.py -r OpenGL`. Under QT_QPA_PLATFORM=offscreen there may be no OpenGL at all, or
+    # only Mesa's llvmpipe; either way the plots must still render.
+    monkeypatch.delenv(render_backend.ENV_OVERRIDE, raising=False)
+    render_backend.set_override(render_backend.BACKEND_OPENGL)
+    yield
+    render_backend.set_override(None)
+
+
+def render(widget, qapp):
+    tb = timebase.UniformTimebase(0., 0.01, 10_000)
+    widget.addItem(TracePlotItem(tb, np.sin(0.01 * np.arange(len(tb)))))
+    widget.resize(320, 240)
+    widget.show()
+    qapp.processEvents()
+    image = widget.grab().toImage()
+    widget.close()
+    return image
+
+
+def test_forced_opengl_falls_back_cleanly(qapp, forced_opengl):
+    widget = pg.PlotWidget()
+    backend = render_backend.apply_backend(widget)
+    if render_backend.opengl_available():
+        assert backend == render_backend.BACKEND_OPENGL
+        assert isinstance(widget.viewport(), QOpenGLWidget)
+    else:
+        assert backend == render_backend.BACKEND_QPAINTER
+        assert not isinstance(widget.viewport(), QOpenGLWidget)
+    assert not render(widget, qapp).isNull()
+
+
+def test_opengl_context_failure(qapp, forced_opengl, monkeypatch):
+    monkeypatch.setattr(render_backend, "_opengl_available", None)
+    monkeypatch.setattr(render_backend.QOpenGLContext, "create", lambda self: False)
+    widget = pg.PlotWidget()
+    assert render_backend.apply_backend(widget) == render_backend.BACKEND_QPAINTER
+    assert not isinstance(widget.viewport(), QOpenGLWidget)
+    assert not render(widget, qapp).isNull()
+    # The failure is remembered rather than retried for every plot.
+    assert render_backend._opengl_available is False
@@ -0,0 +1,56 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import graph_utils
+import timebase
+from maths import resample
+
+
+@pytest.fixture(params=["uniform", "non-uniform"])
+def timebases(request):
+    source_time = 0.01 * np.arange(500) + 0.003
+    if request.param == "non-uniform":
+        source_time[250:] += 0.004
+    reference_time = 0.004 * np.arange(1500) - 0.5
+    return timebase.from_array(source_time), timebase.from_array(reference_time)
+
+
+def test_hold_matches_time_to_tick(timebases):
+    source_tb, reference_tb = timebases
+    data = np.random.default_rng(0).normal(size=len(source_tb))
+
+    result = resample.resample(data, source_tb, reference_tb, resample.HOLD)
+    expected = [data[graph_utils.time_to_tick(source_tb.array(), t)] for t in reference_tb.array()]
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_linear_matches_interp(timebases):
+    source_tb, reference_tb = timebases
+    data = np.random.default_rng(1).normal(size=len(source_tb))
+
+    result = resample.resample(data, source_tb, reference_tb, resample.LINEAR)
+    np.testing.assert_allclose(result, np.interp(reference_tb.array(), source_tb.array(), data))
+
+
+def test_mapping_is_cached(timebases):
+    source_tb, reference_tb = timebases
+    mapping = resample.get_mapping(source_tb, reference_tb, resample.HOLD)
+    assert resample.get_mapping(source_tb, reference_tb, resample.HOLD) is mapping
+    assert resample.get_mapping(source_tb, reference_tb, resample.LINEAR) is not mapping
+
+    # A time offset produces a new timebase, and therefore a new mapping.
+    shifted = source_tb.shifted(1.0)
+    assert resample.get_mapping(shifted, reference_tb, resample.HOLD) is not mapping
+
+
+def test_same_timebase_is_not_resampled():
+    tb = timebase.UniformTimebase(0., 0.01, 100)
+    data = np.arange(100.)
+    assert resample.resample(data, tb, timebase.UniformTimebase(0., 0.01, 100)) is data
@@ -0,0 +1,62 @@
+import sys
+import os
+import numpy as np
+import pytest
+from scipy import signal
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths import running_kernels
+
+
+def naive(data, start, end, fn):
+    return np.array([fn(data[s:e], axis=0) for s, e in zip(start, end)])
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(0).normal(size=(1000, 3)) + 1e6
+
+
+@pytest.mark.parametrize("window", [1, 4, 25])
+def test_tick_windows(data, window):
+    start, end = running_kernels.tick_window_bounds(len(data), window)
+    np.testing.assert_allclose(running_kernels.running_mean(data, window), naive(data, start, end, np.mean))
+    np.testing.assert_allclose(running_kernels.running_median(data, window), naive(data, start, end, np.median))
+
+
+def test_matches_scipy_away_from_edges(data):
+    x = data[:, 0]
+    np.testing.assert_allclose(running_kernels.running_median(x, 25)[12:-12], signal.medfilt(x, 25)[12:-12])
+    np.testing.assert_allclose(running_kernels.running_mean(x, 10)[10:-10],
+                               np.convolve(x, np.ones(10) / 10, mode='same')[10:-10])
+
+
+def test_time_windows_over_non_uniform_time(data):
+    rng = np.random.default_rng(1)
+    time = np.cumsum(rng.uniform(0.005, 0.015, size=len(data)))
+    time[500:] += 1.  # A dropout.
+    window = 0.1
+
+    start = [np.searchsorted(time, t - 0.05 - 1e-9) for t in time]
+    end = [np.searchsorted(time, t + 0.05 + 1e-9, side='right') for t in time]
+    np.testing.assert_allclose(running_kernels.running_mean(data, window, time), naive(data, start, end, np.mean))
+    np.testing.assert_allclose(running_kernels.running_median(data, window, time), naive(data, start, end, np.median))
+
+
+def test_nan_samples_are_ignored():
+    x = np.arange(10.)
+    x[3] = np.nan
+    mean = running_kernels.running_mean(x, 3)
+    assert mean[3] == 3.
+    assert running_kernels.running_median(x, 3)[4] == 4.5
+    assert np.isfinite(mean).all()
+
+
+def test_median_without_fast_scipy_filter(data, monkeypatch):
+    expected = running_kernels.running_median(data, 25)
+    monkeypatch.setattr(running_kernels, "_FAST_MEDIAN_FILTER", False)
+    np.testing.assert_allclose(running_kernels.running_median(data, 25), expected)
@@ -0,0 +1,149 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from maths.recipes import Recipe
+import timebase
+
+DT = 0.01
+
+
+def make_frame(start, stop):
+    rng = np.random.default_rng(start)
+    ticks = np.arange(start, stop)
+    return pd.DataFrame({'x': np.sin(0.01 * ticks) + 0.1 * rng.standard_normal(len(ticks)),
+                         'y': np.cos(0.02 * ticks)}), DT * ticks
+
+
+RECIPES = {
+    'diff': Recipe("differentiate", {}, ((None, "x"),)),
+    'int': Recipe("integrate", {}, ((None, "x"),)),
+    'lowpass': Recipe("filter", {'order': 4, 'type': "low", 'cutoff': 5., 'filtfilt': False}, ((None, "x"),)),
+    'highpass': Recipe("filter", {'order': 2, 'type': "high", 'cutoff': 1., 'filtfilt': False}, ((None, "x"),)),
+    'mean': Recipe("running_window", {'type': "mean", 'window_sz': 20, 'is_ticks': True}, ((None, "x"),)),
+    'median': Recipe("running_window", {'type': "median", 'window_sz': 10, 'is_ticks': True}, ((None, "x"),)),
+    'median_time': Recipe("running_window", {'type': "median", 'window_sz': 0.25, 'is_ticks': False},
+                          ((None, "x"),)),
+    'max': Recipe("running_minmax", {'type': "max", 'window_sz': 15, 'is_ticks': True}, ((None, "x"),)),
+    'min_time': Recipe("running_minmax", {'type': "min", 'window_sz': 0.2, 'is_ticks': False}, ((None, "x"),)),
+    'expr': Recipe("expression", {'text': "x0 * x1 + 1", 'variables': ["x0", "x1"]},
+                   ((None, "x"), (None, "y"))),
+    'filtfilt': Recipe("filter", {'order': 2, 'type': "low", 'cutoff': 5., 'filtfilt': True}, ((None, "x"),)),
+    # Depends on a centered window whose last outputs are revised by every update.
+    'chained': Recipe("integrate", {}, ((None, "median"),)),
+    'chained_causal': Recipe("differentiate", {}, ((None, "lowpass"),)),
+}
+
+
+def test_extend_timebase():
+    tb = timebase.from_array(DT * np.arange(100))
+    extended = timebase.extend(tb.shifted(2.), DT * np.arange(100, 150))
+    assert extended.is_uniform
+    assert len(extended) == 150
+    np.testing.assert_allclose(extended.array(), 2. + DT * np.arange(150))
+
+    gap = timebase.extend(tb, 5. + DT * np.arange(10))
+    assert not gap.is_uniform
+    np.testing.assert_allclose(gap.array()[-10:], 5. + DT * np.arange(10))
+
+    # Non-uniform timebases grow in place; extending an older one again must not change the newer one.
+    longer = timebase.extend(gap, 6. + DT * np.arange(5))
+    other = timebase.extend(gap.shifted(1.), 7. + DT * np.arange(3))
+    np.testing.assert_allclose(longer.array()[-5:], 6. + DT * np.arange(5))
+    np.testing.assert_allclose(other.array()[-3:], 8. + DT * np.arange(3))
+    assert len(gap) == 110
+
+
+@pytest.mark.parametrize("chunks", [(1000, 1), (1000, 7, 500, 3), (2000, 250, 250, 500)])
+def test_appended_samples_extend_derived_variables(chunks, make_model):
+    frame, time = make_frame(0, chunks[0])
+    model = make_model(time, frame, source="stream")
+    for name, recipe in RECIPES.items():
+        model.add_derived_recipe(name, recipe)
+    model.materialize_derived(list(RECIPES))
+
+    invalidated = []
+    model.derivedInvalidated.connect(invalidated.append)
+    frames = [make_frame(0, chunks[0])]
+    n = chunks[0]
+    for size in chunks[1:]:
+        frames.append(make_frame(n, n + size))
+        model.append_data(*frames[-1])
+        n += size
+
+    # Values that could be extended stay memoized; the rest are recomputed on demand.
+    graph = model._derived_graph
+    for name in ('diff', 'int', 'lowpass', 'highpass', 'mean', 'median', 'median_time', 'max', 'min_time',
+                 'expr', 'chained_causal'):
+        assert graph.is_memoized(name), name
+    assert not graph.is_memoized('filtfilt')
+    assert not graph.is_memoized('chained')
+    assert set(invalidated) == set(RECIPES)
+
+    reference = make_model(np.concatenate([t for _, t in frames]),
+                           pd.concat([f for f, _ in frames], ignore_index=True), source="stream")
+    for name, recipe in RECIPES.items():
+        reference.add_derived_recipe(name, recipe)
+        np.testing.assert_allclose(model.get_data_by_name(name), reference.get_data_by_name(name),
+                                   rtol=1e-9, atol=1e-9, err_msg=name)
+
+
+@pytest.mark.parametrize("chunks", [(1000, 1, 7), (500, 250, 3, 400)])
+def test_time_windows_on_jittered_timebase(chunks, make_model):
+    recipes = {name: Recipe("running_window", {'type': name, 'window_sz': 0.25, 'is_ticks': False}, ((None, "x"),))
+               for name in ("mean", "median")}
+    recipes['min'] = RECIPES['min_time']
+    rng = np.random.default_rng(1)
+    n = sum(chunks)
+    frame, _ = make_frame(0, n)
+    time = np.cumsum(DT * rng.uniform(0.5, 1.5, n))
+    model = make_model(time[:chunks[0]], frame[:chunks[0]], source="stream")
+    assert not model.timebase.is_uniform
+    for name, recipe in recipes.items():
+        model.add_derived_recipe(name, recipe)
+    model.materialize_derived(list(recipes))
+
+    start = chunks[0]
+    for size in chunks[1:]:
+        model.append_data(frame[start:start + size].reset_index(drop=True), time[start:start + size])
+        start += size
+        assert model._derived_graph.is_memoized('mean') and model._derived_graph.is_memoized('median')
+
+    reference = make_model(time, frame, source="stream")
+    for name, recipe in recipes.items():
+        reference.add_derived_recipe(name, recipe)
+        np.testing.assert_allclose(model.get_data_by_name(name), reference.get_data_by_name(name),
+                                   rtol=1e-9, atol=1e-9, err_msg=name)
+
+
+def test_append_with_plain_derived_variable(make_model):
+    frame, time = make_frame(0, 100)
+    model = make_model(time, frame, source="stream")
+    model.add_derived_variable('plain', np.arange(100.))
+    model.add_derived_recipe('diff', RECIPES['diff'])
+    model.set_show_derived(True)
+    for start in (100, 103, 200):
+        model.append_data(*make_frame(start, start + 3))
+
+    plain = model.get_data_by_name('plain')
+    assert len(plain) == len(model.get_data_by_name('x')) == 109
+    np.testing.assert_array_equal(plain[:100], np.arange(100.))
+    assert np.isnan(plain[100:]).all()
+    assert len(model.get_data_by_name('diff')) == 109
+
+
+def test_append_requires_all_variables(make_model):
+    frame, time = make_frame(0, 10)
+    model = make_model(time, frame, source="stream")
+    frame, time = make_frame(10, 20)
+    with pytest.raises(ValueError):
+        model.append_data(frame[['x']], time)
+    with pytest.raises(ValueError):
+        model.append_data(frame, time[:-1])
@@ -1,6 +1,7 @@
 import pytest
 from PyQt5.QtWidgets import QApplication, QWidget # QApplication is needed for qapp fixture if not already managed
 from PyQt5.QtGui import QPalette
+from PyQt5.QtCore import QEvent
 import sys
 import os
 import numpy as np
@@ -280,3 +281,25 @@ def test_add_and_remove_multiple_traces(subplot_widget_setup):
     assert pg_item_names_final == ["S3"], "Incorrect PlotDataItems in pyqtgraph plot after S1 removal"
 
 # Note: Removed 'if __name__ == "__main__": unittest.main()' as pytest handles test discovery and execution.
+
+def test_hover_readout_survives_backend_switch(subplot_widget_setup, monkeypatch):
+    '''Leaving the plot hides the hover marker, also after the render backend replaced the viewport.'''
+    subplot_widget = subplot_widget_setup
+    source = MockDataSource(np.array([0.0, 0.1, 0.2]), {"S1": np.array([1.0, 2.0, 3.0])})
+    subplot_widget.plot_data_from_source("S1", source)
+    assert [label.trace.name() for label in subplot_widget.traces] == ["S1"]
+
+    hover = subplot_widget._hover_readout
+    hover.set_enabled(True)
+    old_viewport = subplot_widget.pw.viewport()
+    subplot_widget.pw.setViewport(QWidget())
+    assert subplot_widget.pw.viewport() is not old_viewport
+
+    hover._marker.show()
+    QApplication.sendEvent(subplot_widget.pw, QEvent(QEvent.Leave))
+    assert not hover._marker.isVisible()
+
+    hover.set_enabled(False)
+    hover._marker.show()
+    QApplication.sendEvent(subplot_widget.pw, QEvent(QEvent.Leave))
+    assert hover._marker.isVisible()
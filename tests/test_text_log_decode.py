@@ -0,0 +1,130 @@
+import sys
+import os
+from datetime import datetime
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import text_log_decode as tld
+
+SEVERITIES = ["Critical", "Error", "Warn", "Note", "Debug", "Trace"]
+
+
+def make_records(n):
+    records = []
+    for i in range(n):
+        stamp = f"2024-03-10]|[{(i // 3600) % 24:02d}:{(i // 60) % 60:02d}:{i % 60:02d}.{i % 1000:03d}456"
+        msg = f"message {i}" if i % 10 else f"multi\nline {i}\n[nested]"
+        records.append((stamp, i, SEVERITIES[i % 6], f"host{i % 3}:app{i % 2}", f"src{i % 7}", msg))
+    return records
+
+
+def write_log(path, records, newline="\n"):
+    with open(path, 'w', newline='') as f:
+        for stamp, step, severity, host_app, source, msg in records:
+            f.write(f"[{stamp}]|[{step}]|[ {severity} ]|[{host_app}]|[{source}]|[{msg}]\n".replace("\n", newline))
+    return str(path)
+
+
+def expected(records):
+    msgs = []
+    for stamp, step, severity, host_app, source, msg in records:
+        time = datetime.strptime(stamp.replace("]|[", "T"), '%Y-%m-%dT%H:%M:%S.%f').timestamp()
+        msgs.append(tld.LogMsg(time, step, tld.SEVERITY_MAP[severity.lower()], *host_app.split(':'), source, msg))
+    return msgs
+
+
+def test_decode_text_log(tmp_path):
+    records = make_records(500)
+    assert tld.decode_text_log(write_log(tmp_path / "log.txt", records)) == expected(records)
+
+
+def test_windows_line_endings(tmp_path):
+    records = make_records(50)
+    assert tld.decode_text_log(write_log(tmp_path / "log.txt", records, "\r\n")) == expected(records)
+
+
+def test_malformed_records_are_skipped(tmp_path):
+    records = make_records(20)
+    path = write_log(tmp_path / "log.txt", records)
+    with open(path, 'a') as f:
+        f.write("garbage line\n")
+        f.write("[2024-03-10]|[bad time]|[1]|[Note]|[h:a]|[s]|[m]\n")
+        f.write("[2024-03-10]|[01:00:00.000]|[1]|[Unknown]|[h:a]|[s]|[m]\n")
+        # The last record doesn't need a trailing newline.
+        f.write("[2024-03-10]|[02:00:00.000]|[7]|[Note]|[h:a]|[s]|[last]")
+    msgs = tld.decode_text_log(path)
+    assert msgs[:-1] == expected(records)
+    assert (msgs[-1].step, msgs[-1].msg) == (7, "last")
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_blocks_split_records(tmp_path, newline):
+    records = make_records(300)
+    path = write_log(tmp_path / "log.txt", records, newline)
+    size = os.path.getsize(path)
+    # Blocks much smaller than a record, and ranges split at record boundaries.
+    bounds = tld._record_boundaries(path, 7)
+    assert bounds[0] == 0 and bounds[-1] == size
+    # Split offsets that fall inside an unterminated last record, or past all record ends.
+    with open(path, 'ab') as f:
+        f.write(b"[2024-03-10]|[00:00:00.000]|[1]|[Note]|[h:a]|[s]|[unterminated" + b"x" * 200)
+    assert tld._record_boundaries(path, 50)[-1] == os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+    parts = [tld._decode_range(path, start, end, block_size=37) for start, end in zip(bounds[:-1], bounds[1:])]
+    columns = tld._concat(parts)
+    np.testing.assert_array_equal(columns.step, np.arange(300))
+    assert columns.msgs() == [r[-1] for r in records]
+    assert columns.msg(10) == records[10][-1]
+    # Names from all the parts share their categories.
+    assert sorted(columns.source.categories) == [f"src{i}" for i in range(7)]
+    assert list(np.asarray(columns.app[:4])) == ["app0", "app1", "app0", "app1"]
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_parallel_decoding(tmp_path, monkeypatch, newline):
+    records = make_records(2000)
+    path = write_log(tmp_path / "log.txt", records, newline)
+    monkeypatch.setattr(tld, "MIN_PARALLEL_SIZE", 1)
+    df = tld.read_text_log(path, processes=3)
+    assert list(df.columns) == list(tld.COLUMNS)
+    np.testing.assert_array_equal(df['step'], np.arange(2000))
+    assert df.equals(tld.read_text_log(path, processes=1))
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_lazy_index(tmp_path, monkeypatch, newline):
+    records = make_records(300)
+    path = write_log(tmp_path / "log.txt", records, newline)
+    with open(path, 'a') as f:
+        f.write("garbage line\n")
+    columns = tld.read_text_log_index(path)
+    assert columns.is_lazy and os.path.exists(tld.index_path(path))
+    full = tld.read_text_log_columns(path)
+    np.testing.assert_array_equal(columns.time, full.time)
+    np.testing.assert_array_equal(columns.step, full.step)
+    np.testing.assert_array_equal(columns.severity, full.severity)
+    assert columns.msg(10) == records[10][-1]
+    assert columns.msgs() == full.msgs()
+    data, offsets = columns.packed_messages()
+    assert data[offsets[10]:offsets[11]].tobytes().decode() == records[10][-1].replace("\n", newline)
+
+    # Reopening reads the saved index instead of the log.
+    monkeypatch.setattr(tld, "_index_data", None)
+    reopened = tld.read_text_log_index(path)
+    np.testing.assert_array_equal(reopened.msg_ends, columns.msg_ends)
+    assert list(np.asarray(reopened.source)) == list(np.asarray(full.source))
+    assert reopened.msgs() == full.msgs()
+
+
+def test_lazy_index_is_rebuilt_when_the_log_changes(tmp_path):
+    path = write_log(tmp_path / "log.txt", make_records(20))
+    assert len(tld.read_text_log_index(path)) == 20
+    write_log(tmp_path / "log.txt", make_records(25))
+    os.utime(path, ns=(0, 0))
+    assert len(tld.read_text_log_index(path)) == 25
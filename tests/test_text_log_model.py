@@ -0,0 +1,108 @@
+import sys
+import os
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt, QPersistentModelIndex
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import text_log_decode as tld
+from text_log_model import TextLogModel, TextLogEntry, TextLogFilterProxyModel
+from tests.test_text_log_decode import make_records, write_log
+
+
+@pytest.fixture
+def model(qapp, tmp_path):
+    return TextLogModel(write_log(tmp_path / "log.txt", make_records(60)))
+
+
+def display(model, row, column):
+    return model.data(model.index(row, column), Qt.DisplayRole).value()
+
+
+def test_data_is_read_from_columns(model):
+    assert model.rowCount() == 60
+    assert isinstance(model.time, np.ndarray) and isinstance(model.ticks, np.ndarray)
+    assert display(model, 3, TextLogEntry.Severity) == "Note"
+    assert display(model, 3, TextLogEntry.Message) == "message 3"
+    assert display(model, 3, TextLogEntry.Source) == "src3"
+    assert display(model, 10, TextLogEntry.Message) == "multi\nline 10\n[nested]"
+
+    item = model.data(model.index(4, 0), Qt.UserRole)
+    assert (item.tick, item.severity, item.source) == (4, tld.Severity.Debug, "src4")
+    assert model.data(model.index(0, 0), Qt.BackgroundRole).value() is not None
+    assert model.data(model.index(4, 0), Qt.BackgroundRole).value() is None
+
+
+def test_sort_keeps_persistent_indexes(model):
+    selected = QPersistentModelIndex(model.index(5, TextLogEntry.Message))
+    model.sort(TextLogEntry.Source, Qt.DescendingOrder)
+    sources = [display(model, row, TextLogEntry.Source) for row in range(60)]
+    assert sources == sorted(sources, reverse=True)
+    # Equal keys stay in file order.
+    assert [model.record(row) for row in range(3)] == [6, 13, 20]
+    assert model.record(selected.row()) == 5
+
+    model.sort(TextLogEntry.Tick)
+    assert [model.record(row) for row in range(60)] == list(range(60))
+
+
+def test_severity_filter(model):
+    proxy = TextLogFilterProxyModel(None)
+    proxy.setSourceModel(model)
+    assert proxy.rowCount() == 50
+    proxy.set_max_severity(tld.Severity.Error)
+    assert proxy.rowCount() == 20
+
+
+def test_name_and_text_filters(model):
+    proxy = TextLogFilterProxyModel(None)
+    proxy.setSourceModel(model)
+    proxy.set_max_severity(tld.Severity.Trace)
+    assert model.names('source') == [f"src{i}" for i in range(7)]
+
+    proxy.set_names('source', ["src2", "src5"])
+    assert list(proxy.accepted_rows()) == [i for i in range(60) if i % 7 in (2, 5)]
+    proxy.set_names('host', ["host1"])
+    proxy.set_names('app', ["app0"])
+    assert list(proxy.accepted_rows()) == [i for i in range(60) if i % 7 in (2, 5) and i % 3 == 1 and i % 2 == 0]
+    proxy.set_names('source', None)
+    proxy.set_names('host', None)
+    proxy.set_names('app', None)
+
+    # Case is ignored, and a match may not run from one message into the next.
+    proxy.set_text("LINE")
+    assert list(proxy.accepted_rows()) == list(range(0, 60, 10))
+    proxy.set_text("ge 5")
+    assert list(proxy.accepted_rows()) == [5] + list(range(51, 60))
+    proxy.set_text("1m")
+    assert proxy.rowCount() == 0
+    proxy.set_text("")
+    assert proxy.rowCount() == 60
+
+
+def test_filter_maps_rows(model):
+    proxy = TextLogFilterProxyModel(None)
+    proxy.setSourceModel(model)
+    proxy.set_max_severity(tld.Severity.Error)
+    assert proxy.rowCount() == 20
+    assert proxy.index(1, TextLogEntry.Message).data() == "message 1"
+    assert proxy.index(2, TextLogEntry.Message).data() == "message 6"
+    assert proxy.mapFromSource(model.index(7, 0)).row() == 3
+    assert not proxy.mapFromSource(model.index(8, 0)).isValid()
+
+    # The filter follows the source when it's sorted.
+    model.sort(TextLogEntry.Tick, Qt.DescendingOrder)
+    assert proxy.index(0, TextLogEntry.Message).data() == "message 55"
+    assert proxy.mapToSource(proxy.index(0, 0)).row() == 4
+
+
+def test_lazy_model(qapp, tmp_path, monkeypatch):
+    monkeypatch.setattr(tld, "LAZY_MIN_SIZE", 0)
+    model = TextLogModel(write_log(tmp_path / "log.txt", make_records(60), "\r\n"))
+    assert model.columns.is_lazy
+    assert display(model, 10, TextLogEntry.Message) == "multi\nline 10\n[nested]"
+    assert list(np.flatnonzero(model.text_mask("LINE 2"))) == [20]
@@ -0,0 +1,111 @@
+import sys
+import os
+import re
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import text_log_decode as tld
+import text_log_search
+from text_log_search import MessageSearch, TrigramIndex
+from tests.test_text_log_decode import make_records, write_log
+
+
+@pytest.fixture(scope="module")
+def columns(tmp_path_factory):
+    records = make_records(400)
+    # Messages that differ in case, are empty, aren't ASCII, or only match across a boundary.
+    extra = ["Motor FAULT on joint 3", "", "température élevée", "abc", "def", "joint 12 fault cleared"]
+    records += [r[:-1] + (msg,) for r, msg in zip(make_records(len(extra)), extra)]
+    return tld.read_text_log_columns(write_log(tmp_path_factory.mktemp("log") / "log.txt", records))
+
+
+def brute_force(columns, predicate):
+    return [i for i, msg in enumerate(columns.msgs()) if predicate(msg)]
+
+
+QUERIES = ["fault", "FAULT", "message 1", "line 3", "ge 39", "cdef", "pérat", "3", "ne", "", "no such text"]
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_substring_search(columns, monkeypatch, indexed):
+    # Small chunks, so the index is built from several.
+    monkeypatch.setattr(text_log_search, "BUILD_CHUNK_SIZE", 100)
+    search = MessageSearch(columns)
+    if indexed:
+        search.set_index(TrigramIndex.build(columns))
+    for query in QUERIES:
+        assert list(search.find(query)) == brute_force(columns, lambda m: query.lower() in m.lower()), query
+    assert list(search.find("FAULT", case_sensitive=True)) == [400]
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_regex_search(columns, indexed):
+    search = MessageSearch(columns)
+    if indexed:
+        search.set_index(TrigramIndex.build(columns))
+    for pattern in [r"joint \d+ fault", r"^message 1\d$", r"line 1.0$", r"(fault|motor)", r"^$", r"e\s", "cd"]:
+        compiled = re.compile(pattern, re.IGNORECASE)
+        assert list(search.find(pattern, regex=True)) == \
+            brute_force(columns, lambda m: compiled.search(m) is not None), pattern
+    with pytest.raises(re.error):
+        search.find("(", regex=True)
+
+
+def test_index_narrows_candidates(columns):
+    index = TrigramIndex.build(columns)
+    assert list(index.candidates(b"joint")) == [400, 405]
+    assert len(index.candidates(b"no such")) == 0
+    assert index.candidates(b"ab") is None
+    assert text_log_search._required_literal(r"joint \d+ (fault|error)") == "joint "
+
+
+def test_index_postings(columns, monkeypatch):
+    monkeypatch.setattr(text_log_search, "BUILD_CHUNK_SIZE", 100)
+    index = TrigramIndex.build(columns)
+    expected = {}
+    for i in range(len(columns)):
+        msg = columns.msg_bytes(i).lower()
+        for code in {int.from_bytes(msg[j:j + 3], 'big') for j in range(len(msg) - 2)}:
+            expected.setdefault(code, []).append(i)
+    assert index.trigrams.tolist() == sorted(expected)
+    assert index.records.dtype == np.uint32
+    for code, records in expected.items():
+        assert index.postings(code).tolist() == records
+
+
+def test_large_log_is_not_indexed(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_log_search, "MAX_INDEXED_BYTES", 100)
+    path = write_log(tmp_path / "log.txt", make_records(50))
+    columns = tld.read_text_log_index(path)
+    assert text_log_search.read_trigram_index(path, columns) is None
+    assert not os.path.exists(text_log_search.trigram_index_path(path))
+
+
+def test_lazy_log_search(tmp_path, monkeypatch):
+    # Small chunks, so the messages are read and scanned in several.
+    monkeypatch.setattr(text_log_search, "BUILD_CHUNK_SIZE", 100)
+    monkeypatch.setattr(text_log_search, "SCAN_CHUNK_SIZE", 100)
+    path = write_log(tmp_path / "log.txt", make_records(300), "\r\n")
+    columns = tld.read_text_log_index(path)
+    assert columns.is_lazy
+
+    search = MessageSearch(columns)
+    scanned = [list(search.find(query)) for query in ["line 2", "line\n2", "E 1"]]
+    assert scanned[0] == brute_force(columns, lambda m: "line 2" in m)
+    assert scanned[1] == brute_force(columns, lambda m: "line\n2" in m)
+    assert list(search.find(r"^multi$", regex=True)) == brute_force(columns, lambda m: re.search("^multi$", m))
+
+    index = text_log_search.read_trigram_index(path, columns)
+    assert os.path.exists(text_log_search.trigram_index_path(path))
+    search.set_index(index)
+    assert [list(search.find(query)) for query in ["line 2", "line\n2", "E 1"]] == scanned
+
+    # Reopening reads the saved index.
+    monkeypatch.setattr(TrigramIndex, "build", None)
+    reloaded = text_log_search.read_trigram_index(path, columns)
+    np.testing.assert_array_equal(reloaded.records, index.records)
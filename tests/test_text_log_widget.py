@@ -0,0 +1,76 @@
+import sys
+import os
+from types import SimpleNamespace
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import text_log_decode as tld
+from text_log_widget import TextLogWidget
+from tests.test_text_log_decode import make_records, write_log
+
+
+class MockSignal:
+    def connect(self, slot): pass
+
+
+def make_widget(tmp_path, records):
+    write_log(tmp_path / "log.txt", records)
+    source = SimpleNamespace(filename=str(tmp_path / "log.bin"), onClose=MockSignal(),
+                             model=lambda: SimpleNamespace(tick_max=10**6))
+    return TextLogWidget(None, source)
+
+
+def selected_ticks(widget):
+    rows = sorted(index.row() for index in widget.selectionModel().selectedRows())
+    return [widget.model().index(row, 0).data(256).tick for row in rows]
+
+
+def test_update_selects_messages_of_the_newest_tick(qapp, tmp_path):
+    # Three messages per tick, at ticks 0, 10, 20, ...
+    records = [r[:1] + (10 * (i // 3),) + r[2:] for i, r in enumerate(make_records(90))]
+    widget = make_widget(tmp_path, records)
+    widget.set_max_severity(tld.Severity.Trace)
+
+    widget.update(45)
+    assert selected_ticks(widget) == [40, 40, 40]
+    widget.update(50)
+    assert selected_ticks(widget) == [50, 50, 50]
+
+    # Filtering out messages rebuilds the tick index. Only messages 12 and 13 (tick 40) and
+    # 18 and 19 (tick 60) are errors or worse around here.
+    widget.set_max_severity(tld.Severity.Error)
+    widget.update(50)
+    assert selected_ticks(widget) == [40, 40]
+    widget.update(60)
+    assert selected_ticks(widget) == [60, 60]
+
+    widget.update(-1)
+    assert selected_ticks(widget) == []
+
+
+def test_search_navigation(qapp, tmp_path):
+    records = [r[:1] + (10 * i,) + r[2:] for i, r in enumerate(make_records(60))]
+    widget = make_widget(tmp_path, records)
+
+    # Messages 1 and 11..19; the filter (Debug) hides the Trace messages 11 and 17.
+    counts = widget.set_search("MESSAGE 1")
+    assert sum(counts.values()) == 10
+    assert counts[tld.Severity.Trace] == 2 and counts[tld.Severity.Error] == 3
+
+    ticks = []
+    for _ in range(9):
+        widget.goto_match()
+        ticks.append(widget.currentIndex().data(256).tick)
+        assert selected_ticks(widget) == [ticks[-1]]
+    assert ticks == [10, 120, 130, 140, 150, 160, 180, 190, 10]
+    widget.goto_match(forward=False)
+    widget.goto_match(forward=False)
+    assert widget.currentIndex().data(256).tick == 180
+
+    # Continues from the current message.
+    widget.set_search(r"(?m)^line \d+$", regex=True)
+    widget.goto_match()
+    assert widget.currentIndex().data(256).tick == 200
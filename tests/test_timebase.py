@@ -0,0 +1,155 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import graph_utils
+import timebase
+from trace_lod import TraceLOD
+
+
+def test_uniform_detection():
+    time = 10.0 + 0.002 * np.arange(5000)
+    tb = timebase.from_array(time)
+    assert tb.is_uniform
+    assert tb.t0 == pytest.approx(10.0)
+    assert tb.dt == pytest.approx(0.002)
+    assert len(tb) == 5000
+    np.testing.assert_allclose(tb.array(), time)
+
+    # Small jitter is within the tolerance
+    rng = np.random.default_rng(0)
+    assert timebase.from_array(time + rng.uniform(-1e-7, 1e-7, time.shape)).is_uniform
+
+
+def test_non_uniform_fallback():
+    time = np.cumsum(np.r_[0.0, np.full(100, 0.01), np.full(100, 0.02)])
+    tb = timebase.from_array(time)
+    assert not tb.is_uniform
+    np.testing.assert_array_equal(tb.array(), time)
+
+    # A dropped sample also makes the log non-uniform.
+    assert not timebase.from_array(np.delete(0.01 * np.arange(1000), 500)).is_uniform
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+def test_tick_lookup_matches_graph_utils(uniform):
+    time = 0.01 * np.arange(1000)
+    if not uniform:
+        time[500:] += 0.005
+    tb = timebase.from_array(time)
+    assert tb.is_uniform == uniform
+
+    for t in (-1.0, 0.0, 0.004, 0.01, 1.234, 4.999, 5.0, 5.003, 9.99, 12.0):
+        assert tb.tick_at(t) == graph_utils.time_to_tick(time, t)
+        assert tb.nearest_tick(t) == graph_utils.time_to_nearest_tick(time, t)
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+def test_time_offset(uniform):
+    time = 0.01 * np.arange(1000)
+    if not uniform:
+        time[500:] += 0.005
+    tb = timebase.from_array(time).shifted(2.0)
+    np.testing.assert_allclose(tb.array(), time + 2.0)
+    assert tb.t_min == pytest.approx(2.0)
+    assert tb.tick_at(2.5) == graph_utils.time_to_tick(time, 0.5)
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+def test_tick_range_covers_view(uniform):
+    time = 0.01 * np.arange(1000)
+    if not uniform:
+        time[500:] += 0.005
+    tb = timebase.from_array(time)
+
+    first, last = tb.tick_range(2.345, 6.789)
+    assert time[first] <= 2.345
+    assert time[last - 1] >= 6.789
+    assert first >= 0 and last <= len(time)
+
+    assert tb.tick_range(-10.0, -5.0)[1] <= 1
+    assert tb.tick_range(-10.0, 100.0) == (0, len(time))
+
+
+def test_lod_envelope_preserves_extremes():
+    rng = np.random.default_rng(1)
+    y = rng.normal(size=200_000)
+    y[123_456] = 50.0
+    y[7] = -50.0
+    tb = timebase.UniformTimebase(0.0, 0.001, len(y))
+    lod = TraceLOD(y)
+
+    x_env, y_env = lod.envelope(tb, 0, len(y), 500)
+    assert 500 <= len(y_env) // 2 <= 2000
+    assert len(x_env) == len(y_env)
+    assert np.all(np.diff(x_env) >= 0)
+    assert y_env.max() == 50.0
+    assert y_env.min() == -50.0
+
+    # Small windows are drawn from the raw samples.
+    x_raw, y_raw = lod.envelope(tb, 1000, 1500, 500)
+    np.testing.assert_array_equal(y_raw, y[1000:1500])
+    np.testing.assert_allclose(x_raw, tb.array()[1000:1500])
+
+
+@pytest.mark.parametrize("n", [1000, 300_000])
+def test_lod_nearest_matches_brute_force(n):
+    rng = np.random.default_rng(2)
+    y = np.cumsum(rng.normal(size=n))
+    y[n // 3] = np.nan
+    tb = timebase.UniformTimebase(5.0, 0.001, n)
+    lod = TraceLOD(y)
+    t = tb.array()
+
+    for _ in range(20):
+        x0 = rng.uniform(t[0], t[-1])
+        y0 = rng.uniform(np.nanmin(y), np.nanmax(y))
+        x_scale = rng.uniform(1, 1e5)
+        y_scale = rng.uniform(0.01, 100)
+        first, last = tb.tick_range(x0 - 50 / x_scale, x0 + 50 / x_scale)
+
+        tick, dist = lod.nearest(tb, first, last, x0, y0, x_scale, y_scale)
+        brute = np.hypot((t[first:last] - x0) * x_scale, (y[first:last] - y0) * y_scale)
+        assert first <= tick < last
+        assert dist == pytest.approx(np.nanmin(brute))
+
+
+def test_shifted_copies_share_time_array():
+    tb = timebase.UniformTimebase(0.0, 0.01, 1000)
+    assert tb.shifted(0.0).array() is tb.array()
+    shifted = tb.shifted(2.0)
+    assert shifted.shifted(2.0).array() is shifted.array()
+    np.testing.assert_allclose(shifted.array(), tb.array() + 2.0)
+
+
+def test_trace_item_keeps_time_implicit(qapp):
+    import pyqtgraph as pg
+    from trace_plot_item import TracePlotItem
+
+    tb = timebase.UniformTimebase(5.0, 0.001, 100_000)
+    y = np.sin(np.arange(len(tb)) * 1e-3)
+    widget = pg.PlotWidget()
+    item = TracePlotItem(tb, y)
+    widget.addItem(item)
+    widget.resize(400, 300)
+    widget.show()
+    qapp.processEvents()
+
+    assert item.dataBounds(0) == (tb.t_min, tb.t_max)
+    assert item.dataRect().left() == tb.t_min
+    x, _ = item.getData()
+    assert len(x) < 4000
+    assert tb.t_min <= x[0] < tb.t_min + 0.1 and tb.t_max - 0.1 < x[-1] <= tb.t_max
+    widget.setXRange(10.0, 20.0, padding=0)
+    qapp.processEvents()
+    x, _ = item.getData()
+    assert 9.9 < x[0] < 10.1 and 19.9 < x[-1] < 20.1
+    # The trace never needed the full time array.
+    assert not tb._arrays
+    widget.close()
@@ -1,9 +1,38 @@
+'''
+Decoding of text logs.
+
+Each record looks like `[date]|[time]|[step]|[severity]|[host:app]|[source]|[message]` and ends
+with "]\n"; the message may span several lines. Files are read in fixed-size blocks and every
+block is split into records with a single compiled regular expression. Timestamps are parsed for
+a whole block at once. Large files are split at record boundaries and the parts are decoded in
+parallel, in separate processes.
+
+The result is columnar (`TextLogColumns`): NumPy arrays for the time, step and severity,
+categorical host, app and source names, and all message text in one UTF-8 buffer with offsets.
+
+Large logs are opened lazily instead (`read_text_log_index`): the file is memory-mapped and one
+pass over it records where each message starts and ends, without copying any message text.
+Messages are only decoded when they are read. That index is saved next to the log
+(`<log>.index`), so the log opens without a pass over it the next time.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
 import dataclasses
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum, IntEnum, auto
-import pandas as pd
+import multiprocessing
+import os
+import re
 import sys
 
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
 
 class Severity(IntEnum):
     Critical = auto()
@@ -16,6 +45,125 @@ class Severity(IntEnum):
 
 SEVERITY_MAP = {s.name.lower(): s for s in Severity}
 
+# Columns of the data frame returned by `read_text_log`.
+COLUMNS = ('time', 'step', 'severity', 'host', 'app', 'source', 'msg')
+
+BLOCK_SIZE = 16 << 20
+# Files smaller than this are decoded in the calling process.
+MIN_PARALLEL_SIZE = 64 << 20
+MAX_PROCESSES = os.cpu_count() or 1
+# Files at least this large are opened lazily by `open_text_log_columns`.
+LAZY_MIN_SIZE = 256 << 20
+# Records parsed at a time while indexing a file.
+INDEX_CHUNK_RECORDS = 1 << 16
+# Bump to invalidate the index files written by older versions.
+INDEX_VERSION = 1
+
+_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_EPOCH = datetime(1970, 1, 1)
+# The end of a record ("]\n", or "]\r\n" in files with Windows line endings).
+_RECORD_END = re.compile(rb"\]\r?\n")
+_RECORD_END_MAX_LEN = 3
+# The message is the only field that may span several lines. A record ends at the first "]\n".
+_RECORD = re.compile(r'^\s*\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[((?s:.*?))\](?:\n|\Z)',
+                     re.MULTILINE)
+# The same, for the undecoded bytes of a file (whose line endings may be "\r\n").
+_RECORD_BYTES = re.compile(rb'^\s*\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[(.*?)\]\|\[((?s:.*?))\]\r?(?:\n|\Z)',
+                           re.MULTILINE)
+
+
+@dataclasses.dataclass
+class TextLogColumns:
+    time: np.ndarray
+    step: np.ndarray
+    # `Severity` values as int8.
+    severity: np.ndarray
+    host: pd.Categorical
+    app: pd.Categorical
+    source: pd.Categorical
+    # Message i is msg_data[msg_offsets[i]:msg_offsets[i + 1]], UTF-8 encoded.
+    msg_data: np.ndarray
+    msg_offsets: np.ndarray
+    # Lazy logs: msg_data is the memory-mapped file and message i ends at msg_ends[i].
+    msg_ends: np.ndarray = None
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def is_lazy(self):
+        return self.msg_ends is not None
+
+    @property
+    def msg_nbytes(self):
+        ''' The size of the messages, in bytes. '''
+        if self.msg_ends is None:
+            return int(self.msg_offsets[-1] - self.msg_offsets[0])
+        return int(np.sum(self.msg_ends - self.msg_offsets))
+
+    def msg(self, i):
+        if self.msg_ends is None:
+            return self.msg_data[self.msg_offsets[i]:self.msg_offsets[i + 1]].tobytes().decode('utf-8')
+        return self.msg_bytes(i).decode('utf-8', errors='replace')
+
+    def msg_bytes(self, i):
+        ''' Message i, UTF-8 encoded (with "\n" line endings, like `msg`). '''
+        if self.msg_ends is None:
+            return self.msg_data[self.msg_offsets[i]:self.msg_offsets[i + 1]].tobytes()
+        data = self.msg_data[self.msg_offsets[i]:self.msg_ends[i]].tobytes()
+        return data.replace(b'\r\n', b'\n') if b'\r' in data else data
+
+    def msgs(self):
+        if self.msg_ends is not None:
+            return [self.msg(i) for i in range(len(self))]
+        data = self.msg_data.tobytes()
+        offsets = self.msg_offsets.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def packed_messages(self):
+        '''
+            (buffer, offsets) with message i at buffer[offsets[i]:offsets[i + 1]]. For a lazy log,
+            this reads every message from the file.
+        '''
+        if self.msg_ends is None:
+            return self.msg_data, self.msg_offsets
+        data = memoryview(self.msg_data)
+        buffer = b"".join([data[start:end] for start, end in zip(self.msg_offsets.tolist(), self.msg_ends.tolist())])
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.msg_ends - self.msg_offsets, out=offsets[1:])
+        return np.frombuffer(buffer, dtype=np.uint8), offsets
+
+    def message_chunks(self, chunk_size):
+        '''
+            Yields (first, buffer, offsets) for runs of whole messages of about `chunk_size` bytes:
+            message first + j is buffer[offsets[j]:offsets[j + 1]] (uint8, with "\n" line endings
+            like `msg`). The messages of lazy logs are read from the file a run at a time.
+        '''
+        n = len(self)
+        if self.msg_ends is None:
+            starts, ends = self.msg_offsets[:-1], self.msg_offsets[1:]
+        else:
+            starts, ends = self.msg_offsets, self.msg_ends
+        sizes = np.cumsum(ends - starts)
+        first = 0
+        while first < n:
+            done = int(sizes[first - 1]) if first else 0
+            last = min(max(int(np.searchsorted(sizes, done + chunk_size, side='right')), first + 1), n)
+            if self.msg_ends is None:
+                start = int(self.msg_offsets[first])
+                yield first, self.msg_data[start:int(self.msg_offsets[last])], self.msg_offsets[first:last + 1] - start
+            else:
+                data = memoryview(self.msg_data)
+                msgs = [data[start:end] for start, end in zip(starts[first:last].tolist(), ends[first:last].tolist())]
+                buffer = b"".join(msgs)
+                if b"\r\n" in buffer:
+                    msgs = [msg.tobytes().replace(b"\r\n", b"\n") for msg in msgs]
+                    buffer = b"".join(msgs)
+                offsets = np.zeros(len(msgs) + 1, dtype=np.int64)
+                np.cumsum([len(msg) for msg in msgs], out=offsets[1:])
+                yield first, np.frombuffer(buffer, dtype=np.uint8), offsets
+            first = last
+
 
 @dataclasses.dataclass
 class LogMsg:
@@ -28,31 +176,291 @@ class LogMsg:
     msg: str = None
 
 
-def decode_text_log(text_log):
-    fmt = '%Y-%m-%dT%H:%M:%S.%f'
+def _local_timestamps(stamps):
+    ''' Seconds since the epoch of naive local times (as `datetime.timestamp` would return). '''
+    naive = stamps.astype('datetime64[ns]').astype(np.int64)
+    # The UTC offset only changes with daylight saving time, so look it up once per hour.
+    hours, inverse = np.unique(naive // (3600 * 10**9), return_inverse=True)
+    offsets = np.empty(len(hours), dtype=np.int64)
+    for i, hour in enumerate(hours):
+        seconds = int(hour) * 3600
+        offsets[i] = round((seconds - (_EPOCH + timedelta(seconds=seconds)).timestamp()) * 10**6)
+    # Same rounding as `datetime.timestamp`: microseconds / 1e6.
+    return (naive // 1000 - offsets[inverse]) / 1e6
 
-    msgs = []
 
-    with open(text_log, 'r') as fn:
-        log_line = ''
-        for line in fn.readlines():
-            # Handle multi-line log lines (ensure the log ends appropriately)
-            log_line += line
-            if log_line[-2:] != "]\n":
-                continue
-            msg_prts = log_line.strip().lstrip('[').rstrip(']').split(']|[')
-            # After processing, clear the line.
-            log_line = ''
-            dt = datetime.strptime('T'.join(msg_prts[:2]), fmt)
+def _empty_columns():
+    return TextLogColumns(np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8),
+                          pd.Categorical([]), pd.Categorical([]), pd.Categorical([]),
+                          np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64))
+
+
+def _split_host_app(host_apps):
+    codes, names = pd.factorize(host_apps)
+    parts = [name.split(':', 1) for name in names]
+    hosts = np.array([p[0] for p in parts], dtype=object)
+    apps = np.array([p[1] if len(p) > 1 else "" for p in parts], dtype=object)
+    return pd.Categorical(hosts[codes]), pd.Categorical(apps[codes])
+
+
+def _pack_strings(strings):
+    ''' (UTF-8 buffer, offsets) of `strings`. '''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _parse_fields(dates, clocks, steps, severities, host_apps, sources):
+    '''
+        Parse the fields of records (object arrays of str). Returns the mask of the records that
+        are valid, and their time, step, severity, host, app and source columns.
+    '''
+    stamps = pd.to_datetime(dates + 'T' + clocks, format=_TIME_FORMAT, errors='coerce').to_numpy()
+    steps = pd.to_numeric(steps, errors='coerce')
+    # Severities, hosts and sources take few distinct values; only decode each of those once.
+    codes, names = pd.factorize(severities)
+    levels = np.array([SEVERITY_MAP.get(name.strip().lower(), 0) for name in names], dtype=np.int8)
+    severity = levels[codes]
 
-            if len(msg_prts) < 7:
+    valid = ~np.isnat(stamps) & (severity > 0) & np.isfinite(steps)
+    if not valid.all():
+        logger.warning(f"Skipping {np.count_nonzero(~valid)} malformed text log records")
+
+    hosts, apps = _split_host_app(host_apps[valid])
+    return valid, (_local_timestamps(stamps[valid]), steps[valid].astype(np.int64), severity[valid],
+                   hosts, apps, pd.Categorical(sources[valid]))
+
+
+def _decode_records(text):
+    ''' The columns of the complete records in `text`. '''
+    records = _RECORD.findall(text)
+    if not records:
+        return _empty_columns()
+    *fields, msgs = (np.array(field, dtype=object) for field in zip(*records))
+    valid, columns = _parse_fields(*fields)
+    return TextLogColumns(*columns, *_pack_strings(msgs[valid]))
+
+
+def _concat(parts):
+    parts = [p for p in parts if len(p)] or [_empty_columns()]
+    if len(parts) == 1:
+        return parts[0]
+    if parts[0].is_lazy:
+        # The offsets are into the same file.
+        msg_data = parts[0].msg_data
+        msg_offsets = np.concatenate([p.msg_offsets for p in parts])
+        msg_ends = np.concatenate([p.msg_ends for p in parts])
+    else:
+        msg_offsets = [parts[0].msg_offsets]
+        for p in parts[1:]:
+            msg_offsets.append(p.msg_offsets[1:] + msg_offsets[-1][-1])
+        msg_data = np.concatenate([p.msg_data for p in parts])
+        msg_offsets = np.concatenate(msg_offsets)
+        msg_ends = None
+    return TextLogColumns(np.concatenate([p.time for p in parts]),
+                          np.concatenate([p.step for p in parts]),
+                          np.concatenate([p.severity for p in parts]),
+                          union_categoricals([p.host for p in parts]),
+                          union_categoricals([p.app for p in parts]),
+                          union_categoricals([p.source for p in parts]),
+                          msg_data, msg_offsets, msg_ends)
+
+
+def _last_record_end(buf, start=0):
+    ''' The offset just past the last record end in `buf` whose newline is at or after `start`, or -1. '''
+    pos = len(buf)
+    while True:
+        pos = buf.rfind(b"\n", start, pos)
+        if pos < 0:
+            return -1
+        if buf.endswith(b"]", 0, pos) or buf.endswith(b"]\r", 0, pos):
+            return pos + 1
+
+
+def _decode_range(text_log, start, end, block_size=BLOCK_SIZE):
+    ''' Decode the records in bytes [start, end) of `text_log`, which must be record boundaries. '''
+    parts = []
+    pending = b""
+    with open(text_log, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            buf = pending + block
+            # Only decode complete records; the rest is carried over to the next block. `pending`
+            # holds no record end, so only the new block needs to be searched.
+            cut = _last_record_end(buf, len(pending)) if remaining > 0 else len(buf)
+            if cut < 0:
+                pending = buf
                 continue
+            pending = buf[cut:]
+            text = buf[:cut].decode('utf-8', errors='replace')
+            if '\r' in text:
+                text = text.replace('\r\n', '\n')
+            parts.append(_decode_records(text))
+    return _concat(parts)
+
+
+def _record_boundaries(text_log, n_parts):
+    ''' Offsets that split `text_log` into `n_parts` ranges of whole records. '''
+    size = os.path.getsize(text_log)
+    bounds = [0]
+    with open(text_log, 'rb') as f:
+        for i in range(1, n_parts):
+            offset = max(size * i // n_parts, bounds[-1])
+            f.seek(offset)
+            # Search forward for the end of the record that straddles the offset.
+            while True:
+                chunk = f.read(1 << 16)
+                match = _RECORD_END.search(chunk)
+                if match:
+                    offset += match.end()
+                    break
+                if len(chunk) < 1 << 16:
+                    # No record ends after the offset.
+                    offset = size
+                    break
+                # Keep the last bytes in case the marker straddles the two chunks.
+                offset += len(chunk) - (_RECORD_END_MAX_LEN - 1)
+                f.seek(offset)
+            bounds.append(min(offset, size))
+    bounds.append(size)
+    return sorted(set(bounds))
+
+
+def read_text_log_columns(text_log, processes=None):
+    ''' Decode the text log at the path `text_log` into `TextLogColumns`. '''
+    size = os.path.getsize(text_log)
+    processes = processes or MAX_PROCESSES
+    if processes <= 1 or size < MIN_PARALLEL_SIZE:
+        return _decode_range(text_log, 0, size)
+
+    bounds = _record_boundaries(text_log, processes)
+    logger.info(f"Decoding {text_log} in {len(bounds) - 1} parts")
+    with ProcessPoolExecutor(max_workers=len(bounds) - 1,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        return _concat(executor.map(_decode_range, [text_log] * (len(bounds) - 1), bounds[:-1], bounds[1:]))
+
+
+def _decode_field(values):
+    ''' Object array of str from a list of bytes. Each distinct value is only decoded once. '''
+    codes, names = pd.factorize(np.array(values, dtype=object))
+    names = np.array([name.decode('utf-8', errors='replace') for name in names] + [""], dtype=object)
+    return names[codes]
 
-            _, _, step, severity, host_app, source, msg = msg_prts
 
-            lm = LogMsg(dt.timestamp(), int(step), SEVERITY_MAP[severity.strip().lower()],
-                        *(host_app.split(':')), source, msg)
+def _index_records(data, fields, spans):
+    ''' Columns of records of `data` from their fields; the messages (at `spans`) are left in `data`. '''
+    valid, columns = _parse_fields(*(_decode_field(field) for field in zip(*fields)))
+    spans = np.array(spans, dtype=np.int64).reshape(-1, 2)[valid]
+    return TextLogColumns(*columns, data, spans[:, 0].copy(), spans[:, 1].copy())
 
-            msgs.append(lm)
 
-    return msgs
+def _index_data(data):
+    ''' Lazy columns of the records in `data` (the bytes of a text log). '''
+    parts = []
+    fields, spans = [], []
+    for match in _RECORD_BYTES.finditer(data):
+        fields.append(match.group(1, 2, 3, 4, 5, 6))
+        spans.append(match.span(7))
+        if len(fields) == INDEX_CHUNK_RECORDS:
+            parts.append(_index_records(data, fields, spans))
+            fields, spans = [], []
+    if fields:
+        parts.append(_index_records(data, fields, spans))
+    if not parts:
+        return dataclasses.replace(_empty_columns(), msg_data=data, msg_offsets=np.empty(0, dtype=np.int64),
+                                   msg_ends=np.empty(0, dtype=np.int64))
+    return _concat(parts)
+
+
+def index_path(text_log):
+    ''' Where the index of the text log at `text_log` is saved. '''
+    return text_log + ".index"
+
+
+def _save_index(path, columns, st):
+    arrays = dict(version=INDEX_VERSION, size=st.st_size, mtime_ns=st.st_mtime_ns, time=columns.time,
+                  step=columns.step, severity=columns.severity, msg_starts=columns.msg_offsets,
+                  msg_ends=columns.msg_ends)
+    for field in ('host', 'app', 'source'):
+        names = getattr(columns, field)
+        arrays[f'{field}_codes'] = names.codes
+        arrays[f'{field}_names'] = np.array(names.categories, dtype=str)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning(f"Unable to save the text log index {path}: {ex}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _load_index(path, data, st):
+    ''' The columns saved at `path`, or None if there are none for this version of the log. '''
+    try:
+        with np.load(path) as f:
+            if (int(f['version']), int(f['size']), int(f['mtime_ns'])) != (INDEX_VERSION, st.st_size, st.st_mtime_ns):
+                logger.info(f"The text log index {path} is out of date")
+                return None
+            names = [pd.Categorical.from_codes(f[f'{field}_codes'], categories=f[f'{field}_names'].astype(object))
+                     for field in ('host', 'app', 'source')]
+            return TextLogColumns(f['time'], f['step'], f['severity'], *names, data, f['msg_starts'], f['msg_ends'])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as ex:
+        logger.warning(f"Ignoring the unreadable text log index {path}: {ex}")
+        return None
+
+
+def read_text_log_index(text_log, use_cache=True):
+    '''
+        Lazy `TextLogColumns` of the text log at the path `text_log`: the file is memory-mapped and
+        messages are read from it when they are needed. The index is read from (and saved to)
+        `index_path(text_log)` if `use_cache`.
+    '''
+    st = os.stat(text_log)
+    # An empty file can't be mapped.
+    data = np.memmap(text_log, dtype=np.uint8, mode='r') if st.st_size else np.empty(0, dtype=np.uint8)
+    path = index_path(text_log)
+    if use_cache:
+        columns = _load_index(path, data, st)
+        if columns is not None:
+            return columns
+    logger.info(f"Indexing {text_log}")
+    columns = _index_data(data)
+    if use_cache:
+        _save_index(path, columns, st)
+    return columns
+
+
+def open_text_log_columns(text_log):
+    ''' `TextLogColumns` of the text log at the path `text_log`, lazy if it is large. '''
+    if os.path.getsize(text_log) >= LAZY_MIN_SIZE:
+        return read_text_log_index(text_log)
+    return read_text_log_columns(text_log)
+
+
+def read_text_log(text_log, processes=None):
+    ''' Decode the text log at the path `text_log` into a data frame with the columns `COLUMNS`. '''
+    columns = read_text_log_columns(text_log, processes)
+    return pd.DataFrame({'time': columns.time, 'step': columns.step, 'severity': columns.severity,
+                         'host': columns.host, 'app': columns.app, 'source': columns.source,
+                         'msg': columns.msgs()}, columns=COLUMNS)
+
+
+def decode_text_log(text_log):
+    columns = read_text_log_columns(text_log)
+    return [LogMsg(time, step, Severity(severity), host, app, source, msg)
+            for time, step, severity, host, app, source, msg
+            in zip(columns.time.tolist(), columns.step.tolist(), columns.severity.tolist(),
+                   np.asarray(columns.host).tolist(), np.asarray(columns.app).tolist(),
+                   np.asarray(columns.source).tolist(), columns.msgs())]
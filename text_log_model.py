@@ -1,9 +1,12 @@
-from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QVariant, Qt, QSortFilterProxyModel, QDateTime
+from PyQt5.QtCore import QAbstractTableModel, QAbstractProxyModel, QModelIndex, QVariant, Qt, QDateTime
 from PyQt5.QtGui import QBrush, QColor
 
 from enum import IntEnum, auto
 
+import numpy as np
+
 import text_log_decode as tld
+from text_log_search import MessageSearch
 
 
 class TextLogEntry(IntEnum):
@@ -16,31 +19,32 @@ class TextLogEntry(IntEnum):
 
 class TextLogItem(object):
     """
-        Data structure for storing data items in the list widget
+        One message of a `TextLogModel`, read from the columns of the model
     """
 
-    def __init__(self, log_msg):
-        self._log_msg = log_msg
+    def __init__(self, model, record):
+        self._model = model
+        self._record = record
 
     @property
     def time(self):
-        return self._log_msg.time
+        return self._model.time[self._record].item()
 
     @property
     def severity(self):
-        return self._log_msg.severity
+        return tld.Severity(self._model.severity[self._record])
 
     @property
     def msg(self):
-        return self._log_msg.msg
+        return self._model.columns.msg(self._record)
 
     @property
     def source(self):
-        return self._log_msg.source
+        return self._model.source_name(self._record)
 
     @property
     def tick(self):
-        return self._log_msg.step
+        return self._model.ticks[self._record].item()
 
     def get(self, item):
         if item == TextLogEntry.Timestamp:
@@ -55,7 +59,8 @@ class TextLogItem(object):
             return self.tick
 
     def __repr__(self):
-        return repr(self._log_msg)
+        return f"TextLogItem(time={self.time}, tick={self.tick}, severity={self.severity.name}, " \
+               f"source={self.source!r}, msg={self.msg!r})"
 
 
 _SEVERITY_FG = {
@@ -73,28 +78,87 @@ _SEVERITY_BG = {
 
 
 class TextLogModel(QAbstractTableModel):
+    """
+        The messages of a text log, stored as columns (see `text_log_decode.TextLogColumns`).
+        Nothing is stored per message besides the values in those columns. Large logs are opened
+        lazily; their messages are only read from the file when they are shown.
+    """
+
     def __init__(self, text_log, parent=None):
         QAbstractTableModel.__init__(self, parent=parent)
 
-        text_log = tld.decode_text_log(text_log)
-        self._data, self._time, self._ticks = zip(*[[TextLogItem(msg), msg.time, msg.step] for msg in text_log])
+        if not isinstance(text_log, tld.TextLogColumns):
+            text_log = tld.open_text_log_columns(text_log)
+        self._columns = text_log
+        self._source_names = np.asarray(text_log.source.categories, dtype=object)
+        self._source_codes = text_log.source.codes
+        # Record shown in each row once the model has been sorted (None: in file order).
+        self._order = None
+        self._search = MessageSearch(text_log)
+
+        self._fg_brushes = {severity: QVariant(QBrush(color)) for severity, color in _SEVERITY_FG.items()}
+        self._bg_brushes = {severity: QVariant(QBrush(color)) for severity, color in _SEVERITY_BG.items()}
+        self._severity_names = {severity: QVariant(severity.name) for severity in tld.Severity}
 
         self._header_labels = [header.name for header in TextLogEntry]
 
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def search(self):
+        """ The `text_log_search.MessageSearch` of the messages. """
+        return self._search
+
     @property
     def time(self):
-        return self._time
+        return self._columns.time
 
     @property
     def ticks(self):
-        return self._ticks
+        return self._columns.step
+
+    @property
+    def severity(self):
+        return self._columns.severity
 
     @property
     def tick_max(self):
-        return self._time.shape[0]
+        return self._columns.time.shape[0]
+
+    def source_name(self, record):
+        return self._source_names[self._source_codes[record]]
+
+    def record(self, row):
+        """ The record (index into the columns) shown in `row`. """
+        return row if self._order is None else int(self._order[row])
+
+    def records(self, rows=None):
+        """ The records shown in `rows` (an index array, or all rows if None). """
+        if rows is None:
+            return np.arange(len(self._columns)) if self._order is None else self._order
+        return rows if self._order is None else self._order[rows]
+
+    def names(self, field):
+        """ The distinct values of `field` ('host', 'app' or 'source'), sorted. """
+        return sorted(getattr(self._columns, field).categories)
+
+    def name_mask(self, field, names):
+        """ Per record: is its `field` ('host', 'app' or 'source') one of `names`. """
+        column = getattr(self._columns, field)
+        wanted = np.isin(np.asarray(column.categories, dtype=object), list(names))
+        # Code -1 (a missing name) picks the trailing False.
+        return np.append(wanted, False)[column.codes]
+
+    def text_mask(self, text, case_sensitive=False):
+        """ Per record: does its message contain `text`. Case folding only applies to ASCII letters. """
+        mask = np.zeros(len(self._columns), dtype=bool)
+        mask[self._search.find(text, case_sensitive=case_sensitive)] = True
+        return mask
 
     def rowCount(self, parent=QModelIndex()):
-        return len(self._data)
+        return len(self._columns)
 
     def columnCount(self, parent=QModelIndex()):
         return 4
@@ -105,62 +169,166 @@ class TextLogModel(QAbstractTableModel):
         return QAbstractTableModel.headerData(self, section, orientation, role)
 
     def data(self, index, role):
-        row = index.row()
         col = index.column()
-        item = self._data[index.row()]
+        record = self.record(index.row())
 
         if role == Qt.DisplayRole:
             if col == TextLogEntry.Timestamp:
-                datetime = QDateTime.fromMSecsSinceEpoch(int(item.time * 1e3))
+                datetime = QDateTime.fromMSecsSinceEpoch(int(self._columns.time[record] * 1e3))
 
                 # NOTE: Uncomment this line to show the date as well.
                 # fmt_string = "dd-MM-yyyy HH:mm:ss.zzz"
                 fmt_string = "HH:mm:ss.zzz"
                 return QVariant(datetime.toString(fmt_string))
             elif col == TextLogEntry.Severity:
-                return QVariant(item.severity.name)
+                return self._severity_names[self._columns.severity[record]]
             elif col == TextLogEntry.Message:
-                return QVariant(item.msg)
+                return QVariant(self._columns.msg(record))
             elif col == TextLogEntry.Source:
-                return QVariant(item.source)
+                return QVariant(self.source_name(record))
 
         elif role == Qt.ForegroundRole:
-            try:
-                color = _SEVERITY_FG[item.severity]
-                return QVariant(QBrush(color))
-            except KeyError:
-                pass
+            return self._fg_brushes.get(self._columns.severity[record], QVariant())
         elif role == Qt.BackgroundRole:
-            try:
-                color = _SEVERITY_BG[item.severity]
-                return QVariant(QBrush(color))
-            except KeyError:
-                pass
+            return self._bg_brushes.get(self._columns.severity[record], QVariant())
 
         elif role == Qt.UserRole:
-            return item
+            return TextLogItem(self, record)
 
         return QVariant()
 
+    def _sort_key(self, column):
+        if column == TextLogEntry.Timestamp:
+            return self._columns.time
+        elif column == TextLogEntry.Severity:
+            return self._columns.severity
+        elif column == TextLogEntry.Tick:
+            return self._columns.step
+        elif column == TextLogEntry.Source:
+            # Rank the (few) names once, then sort the records by the rank of their name.
+            rank = np.empty(len(self._source_names), dtype=np.int64)
+            rank[np.argsort(self._source_names.astype(str), kind='stable')] = np.arange(len(rank))
+            return rank[self._source_codes]
+        return np.array(self._columns.msgs(), dtype=object)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        key = self._sort_key(column)
+        if order == Qt.DescendingOrder:
+            # Reverse a stable sort of the reversed records so equal keys stay in file order.
+            rows = len(key) - 1 - np.argsort(key[::-1], kind='stable')[::-1]
+        else:
+            rows = np.argsort(key, kind='stable')
+
+        # Keep persistent indexes (e.g. the selection) on the same records.
+        old_indexes = self.persistentIndexList()
+        records = [self.record(index.row()) for index in old_indexes]
+        new_row = np.empty(len(rows), dtype=np.int64)
+        new_row[rows] = np.arange(len(rows))
+        self._order = rows
+        self.changePersistentIndexList(old_indexes, [self.index(int(new_row[record]), index.column())
+                                                     for record, index in zip(records, old_indexes)])
+        self.layoutChanged.emit()
+
+
+class TextLogFilterProxyModel(QAbstractProxyModel):
+    """
+        The rows of a `TextLogModel` that pass the filters, in order. The filters are evaluated
+        over whole columns at once and the result is kept as an array of source rows.
+    """
 
-class SeverityFilterProxyModel(QSortFilterProxyModel):
     def __init__(self, parent):
-        QSortFilterProxyModel.__init__(self, parent)
+        QAbstractProxyModel.__init__(self, parent)
 
-        # foo bar
         self._max_severity_level = tld.Severity.Debug
+        # Names to keep (None: any) by field ('host', 'app' or 'source').
+        self._names = {}
+        self._text = ""
+        # The source row of each row.
+        self._rows = np.empty(0, dtype=np.int64)
+
+    def setSourceModel(self, model):
+        old_model = self.sourceModel()
+        if old_model is not None:
+            old_model.modelReset.disconnect(self._refilter)
+            old_model.layoutChanged.disconnect(self._refilter)
+        QAbstractProxyModel.setSourceModel(self, model)
+        if model is not None:
+            model.modelReset.connect(self._refilter)
+            model.layoutChanged.connect(self._refilter)
+        self._refilter()
 
     def set_max_severity(self, severity):
         self._max_severity_level = severity
-        self.invalidateFilter()
+        self._refilter()
 
     @property
     def max_severity(self):
         return self._max_severity_level
 
-    def filterAcceptsRow(self, source_row, source_parent):
-        index = self.sourceModel().index(source_row, 0, source_parent)
-        severity = self.sourceModel().data(index, Qt.UserRole).severity
-        # print(f"{severity} <= {self._max_severity_level} : {severity <= self._max_severity_level}")
+    def set_names(self, field, names):
+        """ Only keep messages whose `field` ('host', 'app' or 'source') is in `names` (None: any). """
+        self._names[field] = None if names is None else set(names)
+        self._refilter()
+
+    def names(self, field):
+        return self._names.get(field)
+
+    def set_text(self, text):
+        """ Only keep messages containing `text` (ignoring case). """
+        self._text = text
+        self._refilter()
 
-        return severity <= self._max_severity_level
+    @property
+    def text(self):
+        return self._text
+
+    def accepted_rows(self):
+        """ The source rows that pass the filter, in order (i.e. the source row of each row). """
+        return self._rows
+
+    def _compute_rows(self):
+        model = self.sourceModel()
+        if model is None:
+            return np.empty(0, dtype=np.int64)
+        # Per record, then picked in the order of the source rows.
+        mask = model.severity <= self._max_severity_level
+        for field, names in self._names.items():
+            if names is not None:
+                mask &= model.name_mask(field, names)
+        if self._text:
+            mask &= model.text_mask(self._text)
+        return np.flatnonzero(mask[model.records()])
+
+    def _refilter(self):
+        self.beginResetModel()
+        self._rows = self._compute_rows()
+        self.endResetModel()
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self._rows)) or not (0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        model = self.sourceModel()
+        return 0 if model is None or parent.isValid() else model.columnCount()
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(int(self._rows[proxy_index.row()]), proxy_index.column())
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QModelIndex()
+        row = int(np.searchsorted(self._rows, source_index.row()))
+        if row == len(self._rows) or self._rows[row] != source_index.row():
+            return QModelIndex()
+        return self.index(row, source_index.column())
@@ -0,0 +1,309 @@
+'''
+Full-text search over the messages of a text log.
+
+The messages of a log are UTF-8 text, in memory or in the memory-mapped file of a lazy log (see
+`text_log_decode.TextLogColumns`). A `TrigramIndex` lists, for every sequence of three bytes, the
+messages that contain it (case folded). A query only has to look at the messages that contain all
+the trigrams of its text (or, for a regular expression, of the longest literal it requires);
+without an index, or for queries shorter than a trigram, all the messages are scanned, a chunk at
+a time. The index of a lazy log is saved next to it (see `read_trigram_index`).
+
+Case folding only applies to ASCII letters, and regular expressions match bytes: character
+classes such as `\\w` are ASCII only.
+'''
+
+import os
+import re
+
+import numpy as np
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# The trigram index is built from this many bytes of messages at a time: building it takes the
+# memory of the index plus about 16 bytes per byte of a chunk.
+BUILD_CHUNK_SIZE = 4 << 20
+# Logs with more message text than this aren't indexed (the index can take up to 4 bytes per byte
+# of messages); their searches scan the messages.
+MAX_INDEXED_BYTES = 256 << 20
+# Searches without an index scan this many bytes of messages at a time.
+SCAN_CHUNK_SIZE = 8 << 20
+# Version of the format of the saved trigram indexes.
+INDEX_VERSION = 1
+
+
+def _lower(data):
+    ''' `data` (uint8) with the ASCII letters in lower case. '''
+    data = np.array(data, dtype=np.uint8)
+    upper = (data >= ord('A')) & (data <= ord('Z'))
+    data[upper] += ord('a') - ord('A')
+    return data
+
+
+def _trigram_codes(needle):
+    ''' The distinct trigrams of the bytes `needle`, as integers. '''
+    b = np.frombuffer(needle, dtype=np.uint8).astype(np.int32)
+    return np.unique((b[:-2] << 16) | (b[1:-1] << 8) | b[2:])
+
+
+def _chunk_postings(msg_data, offsets):
+    '''
+        The distinct (trigram, message) pairs of the messages `msg_data[offsets[j]:offsets[j + 1]]`,
+        sorted: (codes, records), uint32.
+    '''
+    data = _lower(msg_data)
+    n = len(data) - 2
+    if n <= 0:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32)
+    codes = data[:-2].astype(np.uint32) << 16
+    codes |= data[1:-1].astype(np.uint32) << 8
+    codes |= data[2:]
+    # Trigrams that run from one message into the next aren't in either message.
+    valid = np.ones(n, dtype=bool)
+    for k in (1, 2):
+        ends = offsets[1:] - k
+        valid[ends[(ends >= 0) & (ends < n)]] = False
+    records = np.repeat(np.arange(len(offsets) - 1, dtype=np.uint32), np.diff(offsets))[:n]
+    # One key per (trigram, record) pair; sorting groups them by trigram.
+    keys = codes[valid].astype(np.uint64) << np.uint64(32)
+    del codes
+    keys |= records[valid]
+    del records, valid
+    keys.sort()
+    distinct = np.ones(len(keys), dtype=bool)
+    np.not_equal(keys[1:], keys[:-1], out=distinct[1:])
+    keys = keys[distinct]
+    return (keys >> np.uint64(32)).astype(np.uint32), (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def _runs(values):
+    ''' (distinct values, run lengths, run starts) of the sorted array `values`. '''
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], starts)) if len(values) else starts
+    return values[starts], np.diff(np.append(starts, len(values))), starts
+
+
+class TrigramIndex(object):
+    """
+        The messages containing each trigram. The records containing trigram `trigrams[i]` are
+        `records[starts[i]:starts[i + 1]]`, in ascending order.
+    """
+
+    def __init__(self, trigrams, starts, records):
+        self.trigrams = trigrams
+        self.starts = starts
+        self.records = records
+
+    @classmethod
+    def build(cls, columns):
+        '''
+            Index the messages of `columns` (`TextLogColumns`). The messages are read twice, a chunk
+            at a time: once to count the postings of each trigram, then to fill them in.
+        '''
+        n_records = len(columns)
+        record_type = np.uint32 if n_records < 2**32 else np.int64
+        counts = np.zeros(1 << 24, dtype=record_type)
+        for _, msg_data, offsets in columns.message_chunks(BUILD_CHUNK_SIZE):
+            codes, _ = _chunk_postings(msg_data, offsets)
+            values, sizes, _ = _runs(codes)
+            counts[values] += sizes.astype(record_type)
+
+        trigrams = np.flatnonzero(counts).astype(np.int32)
+        starts = np.zeros(len(trigrams) + 1, dtype=np.int64)
+        np.cumsum(counts[trigrams], out=starts[1:])
+        del counts
+        records = np.empty(starts[-1], dtype=record_type)
+        # Where the next posting of each trigram goes. Chunks come in record order, so the records
+        # of each trigram are filled in ascending order.
+        fill = starts[:-1].copy()
+        for first, msg_data, offsets in columns.message_chunks(BUILD_CHUNK_SIZE):
+            codes, chunk_records = _chunk_postings(msg_data, offsets)
+            values, sizes, runs = _runs(codes)
+            slots = np.searchsorted(trigrams, values)
+            records[np.repeat(fill[slots] - runs, sizes) + np.arange(len(codes))] = chunk_records + record_type(first)
+            fill[slots] += sizes
+        logger.debug(f"Indexed {n_records} messages: {len(trigrams)} trigrams, {len(records)} postings")
+        return cls(trigrams, starts, records)
+
+    @property
+    def nbytes(self):
+        return self.trigrams.nbytes + self.starts.nbytes + self.records.nbytes
+
+    def postings(self, code):
+        i = int(np.searchsorted(self.trigrams, code))
+        if i == len(self.trigrams) or self.trigrams[i] != code:
+            return self.records[:0]
+        return self.records[self.starts[i]:self.starts[i + 1]]
+
+    def candidates(self, needle):
+        '''
+            The records that may contain the bytes `needle` (case folded), or None if `needle` is
+            too short to narrow them down.
+        '''
+        if len(needle) < 3:
+            return None
+        postings = sorted((self.postings(code) for code in _trigram_codes(needle.lower())), key=len)
+        result = postings[0]
+        # Start from the rarest trigram so the intersections stay small.
+        for other in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result.astype(np.int64)
+
+
+def trigram_index_path(text_log):
+    ''' Where the trigram index of the text log at `text_log` is saved. '''
+    return text_log + ".trigrams"
+
+
+def _save_index(path, index, st):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=INDEX_VERSION, size=st.st_size, mtime_ns=st.st_mtime_ns, trigrams=index.trigrams,
+                     starts=index.starts, records=index.records)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        logger.warning(f"Unable to save the trigram index {path}: {ex}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _load_index(path, st):
+    ''' The trigram index saved at `path`, or None if there is none for this version of the log. '''
+    try:
+        with np.load(path) as f:
+            if (int(f['version']), int(f['size']), int(f['mtime_ns'])) != (INDEX_VERSION, st.st_size, st.st_mtime_ns):
+                logger.info(f"The trigram index {path} is out of date")
+                return None
+            return TrigramIndex(f['trigrams'], f['starts'], f['records'])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as ex:
+        logger.warning(f"Ignoring the unreadable trigram index {path}: {ex}")
+        return None
+
+
+def read_trigram_index(text_log, columns, use_cache=True):
+    '''
+        The `TrigramIndex` of `columns`, the messages of the text log at the path `text_log`, or
+        None if they are larger than `MAX_INDEXED_BYTES`. The index is read from (and saved to)
+        `trigram_index_path(text_log)` if `use_cache`.
+    '''
+    if columns.msg_nbytes > MAX_INDEXED_BYTES:
+        logger.info(f"Not indexing the {columns.msg_nbytes} bytes of messages of {text_log}; searches will scan them")
+        return None
+    st = os.stat(text_log)
+    path = trigram_index_path(text_log)
+    if use_cache:
+        index = _load_index(path, st)
+        if index is not None:
+            return index
+    index = TrigramIndex.build(columns)
+    if use_cache:
+        _save_index(path, index, st)
+    return index
+
+
+def _required_literal(pattern):
+    '''
+        The longest ASCII text that every match of the regular expression `pattern` (a string)
+        contains, case folded. Only literals outside of groups, branches and repeats are found.
+    '''
+    best = current = ""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return ""
+    for op, arg in parsed:
+        if op == sre_parse.LITERAL and arg < 128:
+            current += chr(arg).lower()
+        else:
+            current = ""
+        if len(current) > len(best):
+            best = current
+    return best
+
+
+class MessageSearch(object):
+    """
+        Searches the messages of `TextLogColumns`, with a `TrigramIndex` once one is set. The
+        messages are read as a search needs them; nothing is kept from one search to the next.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+        self._index = None
+
+    @property
+    def index(self):
+        return self._index
+
+    def set_index(self, index):
+        self._index = index
+
+    def _candidates(self, needle):
+        return None if self._index is None else self._index.candidates(needle)
+
+    def find(self, text, regex=False, case_sensitive=False):
+        '''
+            The records whose message contains `text`, or matches the regular expression `text`,
+            in ascending order. Raises `re.error` for an invalid regular expression.
+        '''
+        if regex:
+            return self._find_regex(text, case_sensitive)
+        if not text:
+            return np.arange(len(self._columns))
+        needle = text.encode('utf-8')
+        if not case_sensitive:
+            # Like `_lower`, bytes.lower() only folds ASCII letters.
+            needle = needle.lower()
+
+        candidates = self._candidates(needle)
+        if candidates is not None:
+            msg_bytes = self._columns.msg_bytes
+            found = [record for record in candidates.tolist()
+                     if needle in (msg_bytes(record) if case_sensitive else msg_bytes(record).lower())]
+            return np.array(found, dtype=np.int64)
+
+        # Scan all the messages.
+        found = []
+        for first, data, offsets in self._columns.message_chunks(SCAN_CHUNK_SIZE):
+            data = data.tobytes() if case_sensitive else data.tobytes().lower()
+            pos = data.find(needle)
+            while pos >= 0:
+                record = int(np.searchsorted(offsets, pos, side='right')) - 1
+                end = int(offsets[record + 1])
+                if pos + len(needle) <= end:
+                    found.append(first + record)
+                    # One match per message is enough.
+                    pos = data.find(needle, end)
+                else:
+                    # The match straddles two messages.
+                    pos = data.find(needle, pos + 1)
+        return np.array(found, dtype=np.int64)
+
+    def _find_regex(self, pattern, case_sensitive):
+        compiled = re.compile(pattern.encode('utf-8'), 0 if case_sensitive else re.IGNORECASE)
+        candidates = self._candidates(_required_literal(pattern).encode('ascii'))
+        # Match each message on its own, so anchors and lookarounds stop at its ends.
+        if candidates is not None:
+            msg_bytes = self._columns.msg_bytes
+            found = [record for record in candidates.tolist() if compiled.search(msg_bytes(record)) is not None]
+            return np.array(found, dtype=np.int64)
+
+        found = []
+        for first, data, offsets in self._columns.message_chunks(SCAN_CHUNK_SIZE):
+            data = memoryview(data.tobytes())
+            found.extend(first + j for j, (start, end) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+                         if compiled.search(data[start:end]) is not None)
+        return np.array(found, dtype=np.int64)
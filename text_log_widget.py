@@ -1,13 +1,19 @@
 from PyQt5.QtCore import Qt, pyqtSignal, QItemSelection, QItemSelectionModel
 from PyQt5.QtWidgets import QDockWidget, QTableView, QVBoxLayout, QHBoxLayout, QComboBox, \
-    QCheckBox, QWidget
+    QCheckBox, QWidget, QLineEdit, QLabel, QToolButton
 from PyQt5.QtWidgets import QAbstractItemView, QStyledItemDelegate, QStyleOptionViewItem, QStyle
 from PyQt5.QtGui import QPalette, QFont
 
-from text_log_model import TextLogModel, TextLogEntry, SeverityFilterProxyModel
+from text_log_model import TextLogModel, TextLogEntry, TextLogFilterProxyModel
+from text_log_search import read_trigram_index
+from checkable_combo_box import CheckableComboBox
 from logging_config import get_logger
+from workers import run_in_background
+import event_markers
+import timebase
 
 import os
+import re
 import numpy as np
 
 import text_log_decode as tld
@@ -54,6 +60,22 @@ class DockedTextLogWidget(QDockWidget):
 
         hbox.addWidget(self._filter_list)
 
+        # Lists of the sources, hosts and apps in the log; only checked ones are shown.
+        self._name_lists = {}
+        self._filling_names = False
+        for field in ('source', 'host', 'app'):
+            name_list = CheckableComboBox()
+            name_list.setToolTip(f"Messages of the checked {field}s are shown.")
+            name_list.model().itemChanged.connect(lambda item, field=field: self._set_names(field))
+            hbox.addWidget(name_list)
+            self._name_lists[field] = name_list
+
+        self._text_filter = QLineEdit()
+        self._text_filter.setPlaceholderText("Filter messages")
+        self._text_filter.setClearButtonEnabled(True)
+        self._text_filter.textChanged.connect(self._text_log.set_text_filter)
+        hbox.addWidget(self._text_filter)
+
         self._reverse_sync = QCheckBox("Reverse sync")
         self._reverse_sync.setToolTip("When checked, clicking on an entry in the text log\n" +
                                       "will move the time cursor in the plot area.")
@@ -62,18 +84,50 @@ class DockedTextLogWidget(QDockWidget):
         hbox.addWidget(self._reverse_sync)
 
         layout.addLayout(hbox)
+
+        # H-box for the search box & match navigation
+        search_box = QHBoxLayout()
+
+        self._search_text = QLineEdit()
+        self._search_text.setPlaceholderText("Search messages")
+        self._search_text.setClearButtonEnabled(True)
+        self._search_text.textChanged.connect(self._search)
+        self._search_text.returnPressed.connect(lambda: self._text_log.goto_match(True))
+        search_box.addWidget(self._search_text)
+
+        self._search_regex = QCheckBox("Regex")
+        self._search_regex.setToolTip("Search with a regular expression (matched against the UTF-8 text).")
+        self._search_regex.stateChanged.connect(self._search)
+        search_box.addWidget(self._search_regex)
+
+        for arrow, forward, tip in ((Qt.UpArrow, False, "Previous match"), (Qt.DownArrow, True, "Next match")):
+            button = QToolButton()
+            button.setArrowType(arrow)
+            button.setToolTip(tip)
+            button.clicked.connect(lambda _, forward=forward: self._text_log.goto_match(forward))
+            search_box.addWidget(button)
+
+        self._search_result = QLabel()
+        search_box.addWidget(self._search_result)
+
+        layout.addLayout(search_box)
         widget.setLayout(layout)
 
         self.setWidget(widget)
 
+        self._fill_name_lists()
+
     @property
     def has_source(self):
         return self._text_log.has_source
 
     def set_source(self, source):
         self._text_log.set_source(source)
+        self._fill_name_lists()
+        self._search()
 
     def closeEvent(self, event):
+        self._text_log.mark_events(False)
         self._text_log.close()
         self.onClose.emit()
         event.accept()
@@ -84,6 +138,41 @@ class DockedTextLogWidget(QDockWidget):
     def _set_max_severity(self, idx):
         self._text_log.set_max_severity(tld.Severity[self._filter_list.itemText(idx)])
 
+    def _search(self, *args):
+        text = self._search_text.text()
+        try:
+            counts = self._text_log.set_search(text, regex=self._search_regex.isChecked())
+        except re.error as ex:
+            self._search_result.setText("Invalid regex")
+            self._search_result.setToolTip(str(ex))
+            return
+        if not text:
+            self._search_result.clear()
+            self._search_result.setToolTip("")
+            return
+        self._search_result.setText(f"{sum(counts.values())} matches")
+        self._search_result.setToolTip("\n".join(f"{severity.name}: {count}" for severity, count in counts.items()))
+
+    def _fill_name_lists(self):
+        model = self._text_log.model().sourceModel()
+        self._filling_names = True
+        for field, name_list in self._name_lists.items():
+            name_list.clear()
+            names = model.names(field) if model is not None else []
+            for name in names:
+                name_list.addItem(name)
+                name_list.setItemChecked(name_list.count() - 1, True)
+            self._text_log.set_name_filter(field, None)
+        self._filling_names = False
+
+    def _set_names(self, field):
+        if self._filling_names:
+            return
+        name_list = self._name_lists[field]
+        checked = [name_list.itemText(i) for i in range(name_list.count()) if name_list.itemChecked(i)]
+        # All checked: also show names that aren't listed (e.g. missing ones).
+        self._text_log.set_name_filter(field, None if len(checked) == name_list.count() else checked)
+
 
 class TextLogWidget(QTableView):
     def __init__(self, parent, source, plot_manager=None):
@@ -92,15 +181,31 @@ class TextLogWidget(QTableView):
         # This proxy model is an intermediary between the original model and the view. It
         # creates a new model from the original model based on the filter settings.
         self._source = None
-        self._proxy_model = SeverityFilterProxyModel(self)
+        self._proxy_model = TextLogFilterProxyModel(self)
         # Initialize the proxy model to none. This will get updated when the source is set.
         self._proxy_model.setSourceModel(None)
 
         self.setModel(self._proxy_model)
+        # Ticks of the rows of the proxy model, sorted, and the row of each. Rebuilt lazily
+        # whenever the rows change (e.g. the filter).
+        self._sorted_ticks = None
+        self._sorted_rows = None
+        for signal in (self._proxy_model.modelReset, self._proxy_model.layoutChanged,
+                       self._proxy_model.rowsInserted, self._proxy_model.rowsRemoved):
+            signal.connect(self._invalidate_ticks)
 
         selection_model = QItemSelectionModel(self._proxy_model)
         self.setSelectionModel(selection_model)
 
+        # Records matching the search (None: no search), and the rows of those that pass the filter.
+        self._matches = None
+        self._match_rows = None
+        self._match_row = None
+
+        self._plot_manager = plot_manager
+        # The source whose time changes move the event markers.
+        self._events_source = None
+
         self.set_source(source)
 
         self.clicked.connect(self.itemClicked)
@@ -109,8 +214,6 @@ class TextLogWidget(QTableView):
 
         self._do_reverse_sync = False
 
-        self._plot_manager = plot_manager
-
         # Setup some formatting of the table.
         self.setAlternatingRowColors(True)
         self.setSortingEnabled(False)
@@ -133,6 +236,11 @@ class TextLogWidget(QTableView):
                 logger.info(f"Corresponding text log: {txt_log}")
                 # Create the model and pass it to the proxy model
                 model = TextLogModel(txt_log)
+                # Searches scan the messages until the index is ready, and always for logs too large
+                # to index. The index of a lazy log is built from the memory-mapped file and saved
+                # next to it.
+                run_in_background(read_trigram_index, txt_log, model.columns, use_cache=model.columns.is_lazy,
+                                  on_done=model.search.set_index)
             else:
                 logger.warning("No corresponding text log exists.")
 
@@ -145,6 +253,7 @@ class TextLogWidget(QTableView):
 
             if hasattr(self, "_idx") and self._idx:
                 self.update(self._idx)
+        self.mark_events()
 
     @property
     def has_source(self):
@@ -152,6 +261,41 @@ class TextLogWidget(QTableView):
 
     def _remove_source(self):
         self._source = None
+        self.mark_events()
+
+    def mark_events(self, enabled=True):
+        """ Mark the errors and warnings of the log on the plots (or clear the markers). """
+        source = self._source if enabled else None
+        if source is not self._events_source:
+            if hasattr(self._events_source, 'timeChanged'):
+                self._events_source.timeChanged.disconnect(self.mark_events)
+            if hasattr(source, 'timeChanged'):
+                source.timeChanged.connect(self.mark_events)
+            self._events_source = source
+        if self._plot_manager is None:
+            return
+        model = self._proxy_model.sourceModel()
+        if source is None or model is None:
+            self._plot_manager.set_text_log_events(None, None)
+            return
+        self._plot_manager.set_text_log_events(
+            *event_markers.select_events(model.ticks, model.severity, timebase.for_source(source)))
+
+    def _invalidate_ticks(self, *args):
+        self._sorted_ticks = None
+        self._match_rows = None
+        self._match_row = None
+
+    def _tick_index(self):
+        if self._sorted_ticks is None:
+            model = self._proxy_model.sourceModel()
+            if model is None:
+                ticks = np.empty(0, dtype=np.int64)
+            else:
+                ticks = model.ticks[model.records(self._proxy_model.accepted_rows())]
+            self._sorted_rows = np.argsort(ticks, kind='stable')
+            self._sorted_ticks = ticks[self._sorted_rows]
+        return self._sorted_ticks, self._sorted_rows
 
     def update(self, tick):
         self._idx = tick
@@ -164,23 +308,29 @@ class TextLogWidget(QTableView):
         if self._proxy_model.rowCount() <= 0:
             return
 
-        # Get the ticks associated with the current model. Maybe there's a better way to do this
-        ticks = [0] * self._proxy_model.rowCount()
-        for r in range(self._proxy_model.rowCount()):
-            idx = self._proxy_model.index(r, 0)
-            ticks[r] = self._proxy_model.data(idx, Qt.UserRole).tick
-
+        ticks, rows = self._tick_index()
         # We want to find the most recent (message) at or prior to this tick, but never after.
-        newest_idx = np.where(np.array(ticks) <= tick)[0][-1]
+        last = int(np.searchsorted(ticks, tick, side='right')) - 1
+        if last < 0:
+            self.selectionModel().clearSelection()
+            return
         # Now find the first message from the same tick:
-        first_same_tick_idx = ticks.index(ticks[newest_idx])
+        first = int(np.searchsorted(ticks, ticks[last], side='left'))
+        tick_rows = rows[first:last + 1]
 
         # Use the first column here for convenience. Ultimately, the whole row will be selected
-        first_model_idx = self._proxy_model.index(first_same_tick_idx, 0)
-        last_model_idx = self._proxy_model.index(newest_idx, 0)
+        first_model_idx = self._proxy_model.index(int(tick_rows[0]), 0)
+        last_model_idx = self._proxy_model.index(int(tick_rows[-1]), 0)
 
         # Select the applicable rows so the user knows which messages correspond to which data.
-        selection = QItemSelection(first_model_idx, last_model_idx)
+        if tick_rows[-1] - tick_rows[0] == len(tick_rows) - 1:
+            selection = QItemSelection(first_model_idx, last_model_idx)
+        else:
+            # The messages of this tick aren't next to each other (e.g. the log isn't in tick order).
+            selection = QItemSelection()
+            for row in tick_rows:
+                row_idx = self._proxy_model.index(int(row), 0)
+                selection.select(row_idx, row_idx)
         self.selectionModel().select(selection,
                                      QItemSelectionModel.Rows | QItemSelectionModel.ClearAndSelect)
         # Scroll to the first item first, in case it isn't in view.
@@ -189,8 +339,52 @@ class TextLogWidget(QTableView):
         # appear in view.
         self.scrollTo(last_model_idx, QAbstractItemView.EnsureVisible)
 
+    def set_search(self, text, regex=False):
+        """
+            Search the messages for `text` (a regular expression if `regex`). Returns the number of
+            matches by severity. Raises `re.error` for an invalid regular expression.
+        """
+        model = self._proxy_model.sourceModel()
+        self._matches = None
+        self._invalidate_ticks()
+        if model is None or not text:
+            return {}
+        self._matches = model.search.find(text, regex=regex)
+        counts = np.bincount(model.severity[self._matches], minlength=len(tld.Severity) + 1)
+        return {severity: int(counts[severity]) for severity in tld.Severity if counts[severity]}
+
+    def goto_match(self, forward=True):
+        """ Go to the next (or previous) matching message that is shown, and move the cursor to it. """
+        if self._matches is None:
+            return
+        if self._match_rows is None:
+            model = self._proxy_model.sourceModel()
+            records = model.records(self._proxy_model.accepted_rows())
+            self._match_rows = np.flatnonzero(np.isin(records, self._matches))
+        if not len(self._match_rows):
+            return
+
+        current = self._match_row if self._match_row is not None else self.currentIndex().row()
+        if forward:
+            i = int(np.searchsorted(self._match_rows, current, side='right')) % len(self._match_rows)
+        else:
+            i = int(np.searchsorted(self._match_rows, current, side='left')) - 1
+        row = int(self._match_rows[i])
+
+        index = self._proxy_model.index(row, TextLogEntry.Message)
+        tick = index.data(Qt.UserRole).tick
+        if self._plot_manager:
+            self._plot_manager.set_tick(tick)
+        else:
+            self.update(tick)
+        # Moving the cursor selects the messages of the tick; mark the match within them.
+        self._match_row = row
+        self.selectionModel().setCurrentIndex(index, QItemSelectionModel.NoUpdate)
+        self.scrollTo(index, QAbstractItemView.EnsureVisible)
+
     def itemClicked(self, index):
         # When clicking on an item in the list, jump to the correct tick in the plot.
+        self._match_row = None
         tick = index.data(Qt.UserRole).tick
         if self._plot_manager and self._do_reverse_sync:
             self._plot_manager.set_tick(tick)
@@ -200,6 +394,21 @@ class TextLogWidget(QTableView):
 
     def set_max_severity(self, severity):
         self._proxy_model.set_max_severity(severity)
+        self._refiltered()
+
+    def set_name_filter(self, field, names):
+        self._proxy_model.set_names(field, names)
+        self._refiltered()
+
+    def set_text_filter(self, text):
+        self._proxy_model.set_text(text)
+        self._refiltered()
+
+    def _refiltered(self):
+        self._invalidate_ticks()
+        # The rows were reset; select the messages of the current tick again.
+        if self._idx is not None:
+            self.update(self._idx)
 
     def set_reverse_sync(self, state):
         self._do_reverse_sync = bool(state)
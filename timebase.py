@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+'''
+Time axis representations for loaded data.
+
+Most logs are sampled at a fixed rate, in which case the time axis is fully described by
+(t0, dt, n) and any lookup (time -> tick, visible tick range, time of a tick) is plain arithmetic.
+Logs that aren't uniformly sampled keep the explicit time array and fall back to a binary search.
+
+Both classes expose the same interface so callers don't need to care which one they have.
+'''
+
+import math
+
+import numpy as np
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Maximum deviation (as a fraction of dt) of any sample from the ideal uniform grid for a time
+# series to be treated as uniformly sampled.
+DEFAULT_TOLERANCE = 1e-3
+
+# See `graph_utils.time_to_tick`. A time point that falls exactly on a sample should return that
+# sample, not the previous one.
+_TICK_EPS = 1e-9
+
+# The uniformity check is done in blocks to avoid allocating several full-length temporaries.
+_CHECK_BLOCK = 1 << 20
+
+
+class UniformTimebase(object):
+    """
+        A time axis with samples at t0 + i * dt for i in [0, n).
+    """
+
+    is_uniform = True
+
+    def __init__(self, t0, dt, n, offset=0., arrays=None):
+        self._t0 = float(t0)
+        self._dt = float(dt)
+        self._n = int(n)
+        self._offset = float(offset)
+        # Time arrays by offset, shared with the shifted copies of this timebase (see `array`).
+        self._arrays = {} if arrays is None else arrays
+
+    def __len__(self):
+        return self._n
+
+    def __getstate__(self):
+        # Don't ship the cached time arrays when pickling (e.g. to worker processes).
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    @property
+    def t0(self):
+        return self._t0 + self._offset
+
+    @property
+    def dt(self):
+        return self._dt
+
+    @property
+    def avg_dt(self):
+        return self._dt
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @property
+    def t_min(self):
+        return self.t0
+
+    @property
+    def t_max(self):
+        return self.t0 + self._dt * (self._n - 1)
+
+    def shifted(self, offset):
+        """ Returns a timebase with the supplied time offset applied (replacing any existing one). """
+        return UniformTimebase(self._t0, self._dt, self._n, offset, self._arrays)
+
+    def array(self):
+        """
+            The time axis as an explicit array. The cache is shared with the shifted copies of this
+            timebase and holds the unshifted array and the one of the latest offset.
+        """
+        array = self._arrays.get(self._offset)
+        if array is None:
+            array = self.t0 + self._dt * np.arange(self._n, dtype=np.float64)
+            for offset in [offset for offset in self._arrays if offset not in (0., self._offset)]:
+                self._arrays.pop(offset, None)
+            self._arrays[self._offset] = array
+        return array
+
+    def at(self, ticks):
+        """ Time of the supplied tick (or array of ticks). """
+        return self.t0 + self._dt * np.asarray(ticks, dtype=np.float64)
+
+    def tick_at(self, time):
+        """ The last tick at or before `time` (sample-and-hold). """
+        tick = math.floor((time - self.t0 + _TICK_EPS) / self._dt)
+        return min(max(tick, 0), self._n - 1)
+
+    def nearest_tick(self, time):
+        tick = int(round((time - self.t0) / self._dt))
+        return min(max(tick, 0), self._n - 1)
+
+    def tick_range(self, t_start, t_end):
+        """
+            Returns (first, last) such that ticks[first:last] covers [t_start, t_end], including
+            one sample on either side so that a trace is drawn all the way to the edge of the view.
+        """
+        first = math.floor((t_start - self.t0) / self._dt)
+        last = math.ceil((t_end - self.t0) / self._dt) + 2
+        first = min(max(first, 0), self._n)
+        last = min(max(last, first), self._n)
+        return first, last
+
+
+class ArrayTimebase(object):
+    """
+        A time axis backed by an explicit (monotonically increasing) array of sample times.
+    """
+
+    is_uniform = False
+
+    def __init__(self, time, offset=0., storage=None):
+        self._time = np.asarray(time, dtype=np.float64)
+        self._offset = float(offset)
+        self._array = None
+        # The `AppendBuffer` that `_time` is a view of, if this timebase was created by `extend`.
+        self._storage = storage
+        n = len(self._time)
+        self._avg_dt = float(self._time[-1] - self._time[0]) / (n - 1) if n > 1 else 0.
+
+    def __len__(self):
+        return len(self._time)
+
+    @property
+    def t0(self):
+        return self.t_min
+
+    @property
+    def dt(self):
+        return self._avg_dt
+
+    @property
+    def avg_dt(self):
+        return self._avg_dt
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @property
+    def t_min(self):
+        return self._time[0].item() + self._offset
+
+    @property
+    def t_max(self):
+        return self._time[-1].item() + self._offset
+
+    def shifted(self, offset):
+        """ Returns a timebase with the supplied time offset applied (replacing any existing one). """
+        return ArrayTimebase(self._time, offset, self._storage)
+
+    def array(self):
+        if self._array is None:
+            self._array = self._time + self._offset if self._offset else self._time
+        return self._array
+
+    def at(self, ticks):
+        return self._time[ticks] + self._offset
+
+    def tick_at(self, time):
+        tick = np.searchsorted(self._time, time - self._offset + _TICK_EPS, side='left') - 1
+        return int(min(max(tick, 0), len(self._time) - 1))
+
+    def nearest_tick(self, time):
+        t = time - self._offset
+        tick = int(np.searchsorted(self._time, t, side='left'))
+        if tick >= len(self._time):
+            return len(self._time) - 1
+        if tick > 0 and (t - self._time[tick - 1]) <= (self._time[tick] - t):
+            return tick - 1
+        return tick
+
+    def tick_range(self, t_start, t_end):
+        first = int(np.searchsorted(self._time, t_start - self._offset, side='right')) - 1
+        last = int(np.searchsorted(self._time, t_end - self._offset, side='left')) + 1
+        first = min(max(first, 0), len(self._time))
+        last = min(max(last, first), len(self._time))
+        return first, last
+
+
+def is_uniform(time, tolerance=DEFAULT_TOLERANCE):
+    """ Returns (t0, dt) if `time` is uniformly sampled to within `tolerance * dt`, otherwise None. """
+    n = len(time)
+    if n < 2:
+        return None
+    t0 = float(time[0])
+    dt = float(time[-1] - time[0]) / (n - 1)
+    if not (dt > 0) or not math.isfinite(dt):
+        return None
+
+    max_error = tolerance * dt
+    for start in range(0, n, _CHECK_BLOCK):
+        block = np.asarray(time[start:start + _CHECK_BLOCK], dtype=np.float64)
+        ideal = t0 + dt * np.arange(start, start + len(block), dtype=np.float64)
+        # A NaN in the block makes this comparison False, which is what we want.
+        if not (np.abs(block - ideal).max() <= max_error):
+            return None
+    return t0, dt
+
+
+def from_array(time, tolerance=DEFAULT_TOLERANCE):
+    """ Create the most compact timebase that represents the supplied time array. """
+    time = np.asarray(time)
+    uniform = is_uniform(time, tolerance)
+    if uniform is not None:
+        t0, dt = uniform
+        return UniformTimebase(t0, dt, len(time))
+    return ArrayTimebase(time)
+
+
+def for_source(source):
+    """ The timebase of a data source (e.g. a VarListWidget), created from its time array if needed. """
+    timebase = getattr(source.model(), 'timebase', None)
+    if timebase is None:
+        timebase = from_array(source.time)
+    return timebase
+
+
+def extend(tb, time, tolerance=DEFAULT_TOLERANCE):
+    """ `tb` with the samples at `time` (e.g. freshly streamed data) appended. The offset is kept. """
+    time = np.asarray(time, dtype=np.float64)
+    if len(time) == 0:
+        return tb
+    n = len(tb)
+    if tb.is_uniform and n >= 2:
+        t0 = tb.t0 - tb.offset
+        ideal = t0 + tb.dt * np.arange(n, n + len(time), dtype=np.float64)
+        if np.abs(time - ideal).max() <= tolerance * tb.dt:
+            return UniformTimebase(t0, tb.dt, n + len(time), tb.offset)
+    if n < 2:
+        return from_array(np.concatenate((tb.array() - tb.offset, time)), tolerance).shifted(tb.offset)
+
+    from maths.streaming import AppendBuffer
+    # Grow the time array in place (amortized O(appended)), unless it has already been extended
+    # from this timebase or it isn't stored in a buffer yet.
+    storage = getattr(tb, '_storage', None)
+    if storage is None or len(storage) != n:
+        storage = AppendBuffer(tb.array() - tb.offset)
+    return ArrayTimebase(storage.replace_tail(None, time), tb.offset, storage)
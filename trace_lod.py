@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+Level-of-detail (LOD) support for drawing very long traces.
+
+`TraceLOD` holds a pyramid of min/max envelopes of a signal. Level k summarises blocks of
+BASE_BLOCK * FACTOR**k samples. Drawing a window of the signal at a given pixel width then only
+touches a few values per pixel, independent of the number of samples in the window.
+'''
+
+import numpy as np
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+BASE_BLOCK = 8
+FACTOR = 4
+
+# Traces shorter than this are always drawn from the raw samples, so no pyramid is built for them.
+MIN_LOD_SAMPLES = 1 << 14
+
+
+def _reduce(mins, maxs, block):
+    starts = np.arange(0, len(mins), block)
+    # fmin/fmax ignore NaNs (unless a whole block is NaN) so gaps don't hide the rest of a block.
+    return np.fmin.reduceat(mins, starts), np.fmax.reduceat(maxs, starts)
+
+
+class TraceLOD(object):
+    def __init__(self, y):
+        y = np.asarray(y)
+        if y.dtype == bool:
+            y = y.astype(np.uint8)
+        self._y = y
+        self._levels = None
+
+    def __len__(self):
+        return len(self._y)
+
+    @property
+    def levels(self):
+        """ List of (block_size, mins, maxs). The pyramid is built on first use. """
+        if self._levels is None:
+            self._levels = self._build()
+        return self._levels
+
+    def _build(self):
+        levels = []
+        if len(self._y) < MIN_LOD_SAMPLES:
+            return levels
+
+        block = BASE_BLOCK
+        mins, maxs = _reduce(self._y, self._y, BASE_BLOCK)
+        levels.append((block, mins, maxs))
+        while len(mins) > FACTOR:
+            block *= FACTOR
+            mins, maxs = _reduce(mins, maxs, FACTOR)
+            levels.append((block, mins, maxs))
+        return levels
+
+    def level_for(self, n_samples, max_points):
+        """ The coarsest level that still has at least `max_points` blocks over `n_samples`. """
+        if max_points <= 0 or n_samples <= 2 * max_points:
+            return None
+        chosen = None
+        for level in self.levels:
+            if n_samples / level[0] < max_points:
+                break
+            chosen = level
+        return chosen
+
+    def envelope(self, timebase, first, last, max_points):
+        """
+            Returns (x, y) to draw ticks [first, last) of the trace using about 2 * max_points
+            vertices. Each block contributes its maximum followed by its minimum, like pyqtgraph's
+            'peak' downsampling.
+        """
+        level = self.level_for(last - first, max_points)
+        if level is None:
+            return timebase.at(np.arange(first, last)), self._y[first:last]
+
+        block, mins, maxs = level
+        b_first = first // block
+        b_last = min(-(-last // block), len(mins))
+
+        # Place each pair of points in the middle of its block.
+        ticks = np.arange(b_first, b_last) * block + block // 2
+        np.minimum(ticks, len(self._y) - 1, out=ticks)
+        x = np.repeat(timebase.at(ticks), 2)
+        y = np.empty(2 * (b_last - b_first), dtype=np.result_type(mins.dtype, np.float32))
+        y[0::2] = maxs[b_first:b_last]
+        y[1::2] = mins[b_first:b_last]
+        return x, y
+
+    def nearest(self, timebase, first, last, x, y, x_scale, y_scale):
+        """
+            Find the sample in ticks [first, last) closest to the point (x, y) in screen space.
+            `x_scale` and `y_scale` convert data units to pixels. Returns (tick, distance) or None.
+
+            The pyramid is searched top-down, keeping only the blocks whose bounding box could
+            contain a sample closer than the best guaranteed distance so far. This makes the lookup
+            roughly logarithmic in the number of samples in the range.
+        """
+        if last <= first:
+            return None
+
+        levels = self.levels
+        if not levels or last - first <= BASE_BLOCK * FACTOR:
+            return self._nearest_raw(timebase, np.arange(first, last), x, y, x_scale, y_scale)
+
+        block, _, _ = levels[-1]
+        candidates = np.arange(first // block, -(-last // block))
+        for k in range(len(levels) - 1, -1, -1):
+            block, mins, maxs = levels[k]
+            candidates = candidates[candidates < len(mins)]
+            lo_tick = np.maximum(candidates * block, first)
+            hi_tick = np.minimum((candidates + 1) * block, last) - 1
+            t_lo = timebase.at(lo_tick)
+            t_hi = timebase.at(hi_tick)
+            b_min = mins[candidates]
+            b_max = maxs[candidates]
+
+            # Lower bound: distance to the block's bounding box. Upper bound: distance to its
+            # furthest corner, since every block contains at least one sample inside its box. That
+            # sample may lie outside of [first, last) for the blocks at either end, so those
+            # don't provide an upper bound.
+            dx = np.maximum(np.maximum(t_lo - x, x - t_hi), 0.) * x_scale
+            dy = np.maximum(np.maximum(b_min - y, y - b_max), 0.) * y_scale
+            lower = np.hypot(dx, dy)
+            upper = np.hypot(np.maximum(np.abs(t_lo - x), np.abs(t_hi - x)) * x_scale,
+                             np.maximum(np.abs(b_min - y), np.abs(b_max - y)) * y_scale)
+            upper[(candidates * block < first) | ((candidates + 1) * block > last)] = np.inf
+            with np.errstate(invalid='ignore'):
+                # Blocks that are entirely NaN compare False here and are dropped.
+                candidates = candidates[lower <= np.nanmin(upper, initial=np.inf)]
+
+            child_block = block // FACTOR if k > 0 else 1
+            children = block // child_block
+            candidates = (candidates[:, np.newaxis] * children + np.arange(children)).ravel()
+
+        # `candidates` are now raw ticks.
+        ticks = candidates[(candidates >= first) & (candidates < last)]
+        return self._nearest_raw(timebase, ticks, x, y, x_scale, y_scale)
+
+    def _nearest_raw(self, timebase, ticks, x, y, x_scale, y_scale):
+        if len(ticks) == 0:
+            return None
+        dist = np.hypot((timebase.at(ticks) - x) * x_scale, (self._y[ticks] - y) * y_scale)
+        if np.all(np.isnan(dist)):
+            return None
+        best = np.nanargmin(dist)
+        return int(ticks[best]), float(dist[best])
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.graphicsItems.PlotDataItem import PlotDataset
+from pyqtgraph.Qt import QtCore
+
+from logging_config import get_logger
+from trace_lod import TraceLOD
+
+logger = get_logger(__name__)
+
+
+class _TimebaseDataset(PlotDataset):
+    """ A dataset whose x-data is the time axis of a timebase, only materialized when it is asked for. """
+
+    def __init__(self, timebase, y):
+        self._timebase = timebase
+        super().__init__(None, y, xAllFinite=True)
+
+    @property
+    def x(self):
+        return self._timebase.array()
+
+    @x.setter
+    def x(self, value):
+        # Set by the base class; the times always come from the timebase.
+        pass
+
+    def _updateDataRect(self):
+        y_min, y_max, self.yAllFinite = self._getArrayBounds(self.y, self.yAllFinite)
+        self._dataRect = QtCore.QRectF(QtCore.QPointF(self._timebase.t_min, y_min),
+                                       QtCore.QPointF(self._timebase.t_max, y_max))
+
+
+class TracePlotItem(pg.PlotDataItem):
+    """
+        A PlotDataItem for time series that does its own clipping and decimation.
+
+        pyqtgraph clips to the view with a binary search over the x-data and then downsamples the
+        visible slice on every redraw, so the cost of a redraw grows with the number of visible
+        samples. Here the visible tick range comes from the source's timebase (arithmetic for
+        uniformly sampled logs) and the points drawn come from a min/max envelope pyramid, so a
+        redraw only touches a few values per pixel. The time array itself is never built unless
+        pyqtgraph's own processing (e.g. FFT mode) needs it.
+    """
+
+    def __init__(self, timebase, y, **kwargs):
+        self._timebase = timebase
+        self._lod = TraceLOD(y)
+        # Both options are kept enabled so that the base class invalidates the display data when
+        # the x-range changes. The clipping and decimation themselves are done in
+        # `_getDisplayDataset`.
+        kwargs['clipToView'] = True
+        kwargs['autoDownsample'] = True
+        kwargs.setdefault('downsampleMethod', 'peak')
+        super().__init__(**kwargs)
+        self._set_samples(y)
+
+    @property
+    def timebase(self):
+        return self._timebase
+
+    @property
+    def lod(self):
+        return self._lod
+
+    def set_timebase(self, timebase, y=None):
+        """ Replace the time axis of this trace (e.g. when the source's time offset changes). """
+        self._timebase = timebase
+        if y is None:
+            y = self.yData
+        else:
+            self._lod = TraceLOD(y)
+        self._set_samples(y)
+
+    def _set_samples(self, y):
+        # As `setData`, with the x-data left to the timebase.
+        y = np.asarray(y).view(np.ndarray)
+        self._dataset = _TimebaseDataset(self._timebase, y) if len(y) else None
+        self._datasetMapped = None
+        self._datasetDisplay = None
+        self._adsLastValue = 1
+        self.updateItems(styleUpdate=False)
+        self.informViewBoundsChanged()
+        self.sigPlotChanged.emit(self)
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        if ax == 0 and self._dataset is not None and not self._uses_base_processing():
+            return self._timebase.t_min, self._timebase.t_max
+        return super().dataBounds(ax, frac, orthoRange)
+
+    def _uses_base_processing(self):
+        # Data transformations are rare for these plots. Let pyqtgraph handle them the usual way.
+        opts = self.opts
+        return (opts['fftMode'] or opts['derivativeMode'] or opts['phasemapMode']
+                or opts['subtractMeanMode'] or True in opts['logMode']
+                or isinstance(opts['connect'], np.ndarray))
+
+    def _getDisplayDataset(self):
+        if self._dataset is None:
+            return None
+        if self._uses_base_processing():
+            return super()._getDisplayDataset()
+        if self._datasetDisplay is not None and not self.property('xViewRangeWasChanged'):
+            return self._datasetDisplay
+
+        first, last = 0, len(self._timebase)
+        max_points = 0
+        view = self.getViewBox()
+        # While the item is being added to a plot, this can still be the plot widget.
+        if isinstance(view, pg.ViewBox):
+            if not view.autoRangeEnabled()[0]:
+                view_range = view.viewRect()
+                first, last = self._timebase.tick_range(view_range.left(), view_range.right())
+            # One min/max pair per pixel.
+            max_points = int(view.width())
+
+        x, y = self._lod.envelope(self._timebase, first, last, max_points)
+        self._datasetDisplay = PlotDataset(x, y, True, self._dataset.yAllFinite)
+
+        self.setProperty('xViewRangeWasChanged', False)
+        self.setProperty('yViewRangeWasChanged', False)
+        return self._datasetDisplay
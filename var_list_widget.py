@@ -39,6 +39,10 @@ class VarListWidget(QListView):
     def time(self):
         return self.model().time
 
+    @property
+    def timebase(self):
+        return self.model().timebase
+
     @property
     def time_offset(self):
         return self.model().time_offset
@@ -185,6 +185,13 @@ class VisualizerWidget(QWidget):
     def has_source(self, name):
         return name in self._sources
 
+    def add_link_pose_variables(self, link):
+        ''' Add the pose of `link` (a `RobotLink`) at every tick to the data of its robot. '''
+        for geometries in self._data_linked_geometry.values():
+            for g in geometries:
+                if isinstance(g, DataLinkedRobotModel) and g.has_source() and g.has_link(link):
+                    g.add_link_pose_variables([link.name])
+
     def set_source(self, name, source):
         source_type = os.path.basename(name)
 
@@ -257,6 +264,10 @@ class Visualizer3DWidget(GLViewWidget):
         for name, link in links.items():
             trackLinkAction = menu.addAction(f"Track {name}")
             trackLinkAction.setData(link)
+        for name, link in links.items():
+            if link is not None:
+                poseAction = menu.addAction(f"Add pose variables of {name}")
+                poseAction.setData(link)
 
         action = menu.exec_(self.mapToGlobal(event.pos()))
 
@@ -276,3 +287,5 @@ class Visualizer3DWidget(GLViewWidget):
                                                 grid_color)
         elif action is not None and action.text().startswith("Track"):
             self.trackGeometry(action.data())
+        elif action is not None and action.text().startswith("Add pose variables"):
+            self.parent().add_link_pose_variables(action.data())
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+Helpers for running work off of the GUI thread.
+
+`run_in_background` executes a function on the global QThreadPool. The result (or the exception)
+is delivered back on the GUI thread through Qt signals, so callbacks may safely touch widgets.
+'''
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Workers are kept alive until their result has been delivered on the GUI thread.
+_active_workers = set()
+
+
+class _WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    def __init__(self, fn, *args, **kwargs):
+        QRunnable.__init__(self)
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self.signals = _WorkerSignals()
+
+    def run(self):
+        try:
+            result = self._fn(*self._args, **self._kwargs)
+        except Exception as ex:
+            logger.exception(f"Background task {getattr(self._fn, '__name__', self._fn)} failed")
+            self.signals.failed.emit(ex)
+        else:
+            self.signals.finished.emit(result)
+
+
+def run_in_background(fn, *args, on_done=None, on_error=None, **kwargs):
+    ''' Run `fn(*args, **kwargs)` on the global thread pool. Returns the worker. '''
+    worker = Worker(fn, *args, **kwargs)
+    worker.setAutoDelete(False)
+    _active_workers.add(worker)
+    worker.signals.finished.connect(lambda _: _active_workers.discard(worker))
+    worker.signals.failed.connect(lambda _: _active_workers.discard(worker))
+    if on_done is not None:
+        worker.signals.finished.connect(on_done)
+    if on_error is not None:
+        worker.signals.failed.connect(on_error)
+    QThreadPool.globalInstance().start(worker)
+    return worker
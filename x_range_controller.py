@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Roughly one frame at 60 Hz. Range requests that arrive faster than this are coalesced so that
+# each subplot is redrawn at most once per frame.
+_FRAME_INTERVAL_MS = 16
+
+
+class XRangeController(QObject):
+    """
+        Owns the x-range of every subplot in a single plot tab.
+
+        Instead of chaining each subplot to the first one with `setXLink` (which causes a cascade of
+        range-changed signals and repaints), all range changes are funnelled through this object.
+        Requests are debounced to the frame rate and the most recent one is applied to all of the
+        registered subplots in a single batched update.
+    """
+    rangeChanged = pyqtSignal(float, float)
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+
+        self._subplots = []
+        self._range = None
+        self._pending = None
+        self._applying = False
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(_FRAME_INTERVAL_MS)
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def range(self):
+        return self._range
+
+    def add_subplot(self, subplot):
+        if subplot in self._subplots:
+            return
+        self._subplots.append(subplot)
+        # Any x-range change that didn't originate here (e.g. mouse wheel or an auto-range) is
+        # treated as a request so that the other subplots follow.
+        subplot.pw.getViewBox().sigXRangeChanged.connect(self._on_view_x_range_changed)
+        if self._range is not None:
+            self._apply_to(subplot, *self._range)
+
+    def remove_subplot(self, subplot):
+        if subplot not in self._subplots:
+            return
+        self._subplots.remove(subplot)
+        try:
+            subplot.pw.getViewBox().sigXRangeChanged.disconnect(self._on_view_x_range_changed)
+        except TypeError:
+            # Already disconnected.
+            pass
+
+    def request_range(self, start, end):
+        """ Queue a new range. It will be applied on the next frame. """
+        self._pending = (float(start), float(end))
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def set_range(self, start, end):
+        """ Apply a new range immediately, discarding any queued request. """
+        self._pending = (float(start), float(end))
+        self.flush()
+
+    def flush(self):
+        self._timer.stop()
+        if self._pending is None:
+            return
+
+        x_range = self._pending
+        self._pending = None
+
+        parent = self.parent()
+        # Suppress repaints while the range is being pushed to the subplots so that the whole tab is
+        # redrawn once instead of once per subplot.
+        batch_updates = parent is not None and hasattr(parent, 'setUpdatesEnabled') and parent.updatesEnabled()
+        if batch_updates:
+            parent.setUpdatesEnabled(False)
+        self._applying = True
+        try:
+            for subplot in self._subplots:
+                self._apply_to(subplot, *x_range)
+        finally:
+            self._applying = False
+            if batch_updates:
+                parent.setUpdatesEnabled(True)
+
+        if x_range != self._range:
+            self._range = x_range
+            self.rangeChanged.emit(*x_range)
+
+    def _apply_to(self, subplot, start, end):
+        was_applying = self._applying
+        self._applying = True
+        try:
+            subplot.pw.setXRange(min=start, max=end, padding=0)
+        finally:
+            self._applying = was_applying
+
+    def _on_view_x_range_changed(self, view_box, x_range):
+        if self._applying:
+            return
+        logger.debug(f"x-range changed outside of the controller: {x_range}")
+        self.request_range(*x_range)